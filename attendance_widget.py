@@ -5,16 +5,25 @@ import base64
 from PyQt5.QtWidgets import *
 from PyQt5.QtCore import *
 from PyQt5.QtGui import *
+import os
 from camera import WebcamThread
+from camera_manager import CameraManager, parse_camera_ids
+from ui_components import ModelLoadNotifier
 
 
 class AttendanceWidget(QWidget):
     def __init__(self, controller_window=None, db=None, face_recognizer=None):
         super().__init__()
         self.controller_window = controller_window
-        self.face_recog = face_recognizer
+        # face_recognizer là FaceModelHolder: model có thể vẫn đang nạp trên luồng nền
+        self.face_model = face_recognizer
+        self.face_recog = None
         self.db = db
         self.webcam_thread = None
+        # Nhiều camera (ATTENDANCE_CAMERAS="0,1,2,3") chạy qua CameraManager dùng chung model và gallery;
+        # preview hiển thị camera đầu tiên, thông báo chấm công đến từ mọi camera
+        self.camera_ids = parse_camera_ids(os.environ.get('ATTENDANCE_CAMERAS', '0'))
+        self.camera_manager = None
 
         self.setWindowTitle("🏢 Hệ thống chấm công")
         self.setMinimumSize(1200, 800)
@@ -23,7 +32,7 @@ class AttendanceWidget(QWidget):
         self.setup_styles()
         self.setup_ui()
         self.setup_connections()
-        self.log_message("🚀 Hệ thống đã sẵn sàng", "info")
+        self.watch_face_model()
 
     def setup_styles(self):
         try:
@@ -171,6 +180,27 @@ class AttendanceWidget(QWidget):
         self.start_button.toggled.connect(self.toggle_webcam)
         self.btn_back.clicked.connect(self.go_back)
 
+    # Chỉ cho bắt đầu chấm công khi model nhận diện đã nạp xong
+    def watch_face_model(self):
+        self.model_notifier = ModelLoadNotifier(self)
+        self.model_notifier.ready.connect(self.on_model_ready)
+        self.model_notifier.failed.connect(self.on_model_failed)
+        if self.face_model.get_if_ready() is None:
+            self.start_button.setEnabled(False)
+            self.update_status("⏳ Đang nạp mô hình", "warning")
+            self.log_message("⏳ Đang nạp mô hình nhận diện...", "info")
+        self.model_notifier.watch(self.face_model.start())
+
+    def on_model_ready(self, model):
+        self.face_recog = model
+        self.start_button.setEnabled(True)
+        self.update_status("⚪ Trạng thái: Chờ", "idle")
+        self.log_message("🚀 Hệ thống đã sẵn sàng", "info")
+
+    def on_model_failed(self, error):
+        self.update_status("🔴 Lỗi mô hình", "danger")
+        self.log_message(f"Không nạp được mô hình nhận diện: {error}", "error")
+
     def toggle_webcam(self, checked):
         if checked:
             check_type = self.check_type_combo.currentText().replace("📥 ", "").replace("📤 ", "")
@@ -178,10 +208,21 @@ class AttendanceWidget(QWidget):
             self.update_status("🟢 Đang hoạt động", "success")
             self.check_type = check_type
 
-            self.webcam_thread = WebcamThread(self.face_recog, self.db, self.check_type)
-            self.webcam_thread.frame_processed.connect(self.show_image)
-            self.webcam_thread.attendance_logged.connect(self.handle_attendance_logged)
-            self.webcam_thread.start()
+            if len(self.camera_ids) > 1:
+                self.camera_manager = CameraManager(self.face_recog, self.db)
+                for camera_id in self.camera_ids:
+                    thread = self.camera_manager.add_camera(camera_id, self.check_type)
+                    thread.attendance_logged.connect(self.handle_attendance_logged)
+                self.webcam_thread = self.camera_manager.cameras[self.camera_ids[0]]
+                self.webcam_thread.frame_processed.connect(self.show_image)
+                self.camera_manager.start_all()
+                self.log_message(f"📹 {len(self.camera_ids)} camera: {self.camera_ids}", "info")
+            else:
+                self.webcam_thread = WebcamThread(self.face_recog, self.db, self.check_type,
+                                                  camera_id=self.camera_ids[0])
+                self.webcam_thread.frame_processed.connect(self.show_image)
+                self.webcam_thread.attendance_logged.connect(self.handle_attendance_logged)
+                self.webcam_thread.start()
 
             self.start_mock_camera()
             self.start_button.setText("⏹️ Dừng")
@@ -191,8 +232,16 @@ class AttendanceWidget(QWidget):
             self.start_button.setText("▶️ Bắt đầu")
             self.image_label.setText("📷\nCamera đã tắt")
 
-            if hasattr(self, 'webcam_thread') and self.webcam_thread.isRunning():
-                self.webcam_thread.stop()
+            self.stop_cameras()
+
+    # Dừng camera đơn hoặc toàn bộ camera của CameraManager
+    def stop_cameras(self):
+        if self.camera_manager is not None:
+            self.camera_manager.close()
+            self.camera_manager = None
+        elif self.webcam_thread is not None:
+            # Luồng đã tự dừng (hết video) vẫn cần stop() để giải phóng gallery và kết nối của nó
+            self.webcam_thread.stop()
 
     def start_mock_camera(self):
         self.image_label.setText("📹\nCamera đang hoạt động...\n\n✨ Đưa mặt vào để chấm công")
@@ -349,9 +398,7 @@ class AttendanceWidget(QWidget):
         """Xử lý khi nhấn nút back"""
         try:
             # Dừng webcam nếu đang chạy
-            if hasattr(self, 'webcam_thread') and self.webcam_thread and self.webcam_thread.isRunning():
-                self.webcam_thread.stop()
-                self.webcam_thread.wait()
+            self.stop_cameras()
 
             # Hiển thị lại màn hình chính
             if self.controller_window:
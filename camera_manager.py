@@ -0,0 +1,204 @@
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+
+from camera import WebcamThread
+from gallery_store import GalleryStore
+from model_identity import LEGACY_MODEL_NAME
+
+logger = logging.getLogger(__name__)
+
+
+# Danh sách camera dạng "0,1,2,3" (biến môi trường ATTENDANCE_CAMERAS); số là chỉ số thiết bị
+def parse_camera_ids(value):
+    camera_ids = []
+    for item in (value or '').split(','):
+        item = item.strip()
+        if item:
+            camera_ids.append(int(item) if item.isdigit() else item)
+    return camera_ids or [0]
+
+
+class CameraConnection:
+    """Kết nối cơ sở dữ liệu riêng của một camera: các WebcamThread chạy song song
+    không được dùng chung một kết nối pyodbc."""
+
+    def __init__(self, db):
+        self.employees = db.open_employee_operations()
+        self.attendance = db.open_attendance_operations()
+
+    def close(self):
+        for operations in (self.employees, self.attendance):
+            try:
+                operations.conn.close()
+            except Exception as e:
+                logger.error(f"Camera connection close error: {e}")
+
+
+class InferenceScheduler:
+    """Một luồng detector dùng chung cho nhiều camera, phục vụ xoay vòng giữa các nguồn.
+
+    Mỗi nguồn có tối đa một khung hình chờ: khung hình mới thay khung hình cũ
+    chưa xử lý (Future cũ bị hủy), nên camera nhanh không thể chiếm hết detector
+    và không camera nào phải đợi quá một vòng. ArcFace của các camera đi qua
+    EmbeddingBatcher chung của face_recog nên cũng được gom batch.
+    """
+
+    def __init__(self, face_recog):
+        self.face_recog = face_recog
+        self._pending = OrderedDict()
+        self._order = deque()
+        self._condition = threading.Condition()
+        self._running = True
+        self.stats = {}
+        self._thread = threading.Thread(target=self._run, name='InferenceScheduler', daemon=True)
+        self._thread.start()
+
+    def _source_stats(self, source_id):
+        if source_id not in self.stats:
+            self.stats[source_id] = {'served': 0, 'superseded': 0, 'wait_time': 0.0, 'detect_time': 0.0}
+        return self.stats[source_id]
+
+    # Gửi khung hình của một nguồn; Future trả về danh sách Face (chưa có embedding)
+    def submit(self, source_id, frame, roi_state=None):
+        future = Future()
+        with self._condition:
+            if not self._running:
+                raise RuntimeError("InferenceScheduler đã dừng")
+            old = self._pending.get(source_id)
+            if old is not None:
+                old[2].cancel()
+                self._source_stats(source_id)['superseded'] += 1
+            else:
+                self._order.append(source_id)
+            self._pending[source_id] = (frame, roi_state, future, time.perf_counter())
+            self._condition.notify()
+        return future
+
+    def detect(self, source_id, frame, roi_state=None, timeout=None):
+        return self.submit(source_id, frame, roi_state).result(timeout)
+
+    # Lấy nguồn kế tiếp theo vòng, nguồn vừa được phục vụ xuống cuối hàng
+    def _next_request(self):
+        with self._condition:
+            while self._running and not self._order:
+                self._condition.wait()
+            if not self._order:
+                return None, None
+            source_id = self._order.popleft()
+            return source_id, self._pending.pop(source_id)
+
+    def _run(self):
+        while True:
+            source_id, request = self._next_request()
+            if request is None:
+                return
+            frame, roi_state, future, submitted = request
+            if not future.set_running_or_notify_cancel():
+                continue
+            stats = self._source_stats(source_id)
+            started = time.perf_counter()
+            stats['wait_time'] += started - submitted
+            try:
+                faces = self.face_recog.detect_faces(frame, roi_state=roi_state)
+                future.set_result(faces)
+            except Exception as e:
+                future.set_exception(e)
+            stats['detect_time'] += time.perf_counter() - started
+            stats['served'] += 1
+
+    def get_statistics(self):
+        result = {}
+        for source_id, stats in list(self.stats.items()):
+            served = max(stats['served'], 1)
+            result[source_id] = {
+                'served': stats['served'], 'superseded': stats['superseded'],
+                'wait_ms': stats['wait_time'] * 1000 / served, 'detect_ms': stats['detect_time'] * 1000 / served,
+            }
+        return result
+
+    def close(self):
+        with self._condition:
+            self._running = False
+            for _, _, future, _ in self._pending.values():
+                future.cancel()
+            self._pending.clear()
+            self._order.clear()
+            self._condition.notify_all()
+        self._thread.join(timeout=3)
+
+
+class CameraManager:
+    """Chạy nhiều camera trên một model, một gallery và một bộ lập lịch suy luận.
+
+    Mỗi camera là một WebcamThread riêng với check_type, cooldown, tracker, ROI,
+    kết nối cơ sở dữ liệu và thống kê của nó; detector được InferenceScheduler xen kẽ công bằng giữa
+    các camera, ArcFace được gom batch qua EmbeddingBatcher, gallery chỉ nạp và
+    làm mới một lần cho mọi camera.
+    """
+
+    def __init__(self, face_recog, db, gallery_store=None, snapshot_dir="gallery_snapshot",
+                 max_batch=8, max_wait=0.005):
+        self.face_recog = face_recog
+        self.db = db
+        self.gallery_store = gallery_store or GalleryStore(
+            db, refresh_interval=30, snapshot_dir=snapshot_dir,
+            model_name=getattr(face_recog, 'model_name', LEGACY_MODEL_NAME))
+        # Chỉ bật (và khi close() thì tắt lại) batcher nếu face_recog chưa có sẵn
+        self._owns_batcher = getattr(face_recog, 'embedding_batcher', None) is None
+        if self._owns_batcher:
+            face_recog.enable_embedding_batching(max_batch=max_batch, max_wait=max_wait)
+        self.scheduler = InferenceScheduler(face_recog)
+        self.cameras = OrderedDict()
+        self.connections = []
+
+    def add_camera(self, camera_id, check_type):
+        if camera_id in self.cameras:
+            raise ValueError(f"Camera {camera_id} đã được thêm")
+        db = self.db
+        if hasattr(db, 'open_attendance_operations'):
+            db = CameraConnection(db)
+            self.connections.append(db)
+        thread = WebcamThread(self.face_recog, db, check_type, camera_id=camera_id,
+                              gallery_store=self.gallery_store, scheduler=self.scheduler)
+        self.cameras[camera_id] = thread
+        return thread
+
+    def start_all(self):
+        for thread in self.cameras.values():
+            if not thread.isRunning():
+                thread.start()
+        logger.info(f"🔥 Camera manager started {len(self.cameras)} cameras")
+
+    def stop_all(self):
+        for thread in self.cameras.values():
+            thread.stop()
+        logger.info("🔥 Camera manager stopped")
+
+    def set_check_type(self, camera_id, check_type):
+        self.cameras[camera_id].update_check_type(check_type)
+
+    def get_statistics(self):
+        scheduler_stats = self.scheduler.get_statistics()
+        return {
+            'cameras': {camera_id: dict(thread.get_statistics(), check_type=thread.check_type,
+                                        scheduler=scheduler_stats.get(camera_id))
+                        for camera_id, thread in self.cameras.items()},
+            'gallery': self.gallery_store.get_statistics(),
+            'embedding_batcher': (self.face_recog.embedding_batcher.get_statistics()
+                                  if self.face_recog.embedding_batcher else None),
+        }
+
+    # Dừng mọi camera rồi giải phóng bộ lập lịch, gallery dùng chung và batcher do manager bật
+    def close(self):
+        self.stop_all()
+        self.scheduler.close()
+        if self._owns_batcher:
+            self.face_recog.enable_embedding_batching(False)
+            self._owns_batcher = False
+        self.gallery_store.close()
+        for connection in self.connections:
+            connection.close()
+        self.connections = []
@@ -6,11 +6,11 @@ import hashlib
 
 
 class Database:
+    CONNECTION_STRING = 'DRIVER={SQL Server};SERVER=KIMCHI;DATABASE=FaceAttendanceDB1;UID=Sinhvien;PWD=123456'
+
     def __init__(self):
         try:
-            self.conn = pyodbc.connect(
-                'DRIVER={SQL Server};SERVER=KIMCHI;DATABASE=FaceAttendanceDB1;UID=Sinhvien;PWD=123456'
-            )
+            self.conn = pyodbc.connect(self.CONNECTION_STRING)
             self.cursor = self.conn.cursor()
             logging.info("Database connection established successfully.")
 
@@ -77,6 +77,16 @@ class Database:
             print(f"Authentication error: {e}")
             return False
 
+    def open_employee_operations(self):
+        """Tạo EmployeeOperations trên một kết nối riêng cho luồng nền (kết nối pyodbc không dùng chung giữa các luồng)."""
+        conn = pyodbc.connect(self.CONNECTION_STRING)
+        return EmployeeOperations(conn, conn.cursor())
+
+    def open_attendance_operations(self):
+        """Tạo AttendanceOperations trên một kết nối riêng (mỗi camera của CameraManager ghi chấm công trên luồng riêng)."""
+        conn = pyodbc.connect(self.CONNECTION_STRING)
+        return AttendanceOperations(conn, conn.cursor())
+
     def close(self):
         """Close the database connection."""
         if self.conn:
@@ -3,11 +3,46 @@ import logging
 import hashlib
 import cv2
 import os
+from .encoding_codec import EMBEDDING_BYTES, decode_embedding, encode_embedding, encode_embedding_text
 
 class EmployeeOperations:
+    # Giai đoạn đọc song song: vẫn ghi thêm chuỗi Encoding cũ cho các máy chưa cập nhật
+    WRITE_LEGACY_TEXT = True
+
     def __init__(self, conn, cursor):
         self.conn = conn
         self.cursor = cursor
+        self._columns = {}
+
+    def _has_encoding_column(self, column):
+        """Kiểm tra (một lần cho mỗi cột) FaceEncodings đã có cột do db/migrations thêm vào chưa."""
+        if column not in self._columns:
+            cursor = self.conn.cursor()
+            try:
+                cursor.execute("SELECT COL_LENGTH('FaceEncodings', ?)", (column,))
+                self._columns[column] = cursor.fetchone()[0] is not None
+            finally:
+                cursor.close()
+        return self._columns[column]
+
+    def has_binary_encoding_column(self):
+        """Cột EncodingBin VARBINARY(2048) (migration 001)."""
+        return self._has_encoding_column('EncodingBin')
+
+    def has_model_name_column(self):
+        """Cột ModelName ghi gói model đã tạo embedding (migration 002)."""
+        return self._has_encoding_column('ModelName')
+
+    def get_encoding_models(self):
+        """Trả về {ModelName: số dòng} của FaceEncodings; None là dòng cũ chưa ghi model."""
+        if not self.has_model_name_column():
+            return {}
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute("SELECT ModelName, COUNT(*) FROM FaceEncodings GROUP BY ModelName")
+            return {model: count for model, count in cursor.fetchall()}
+        finally:
+            cursor.close()
 
     def get_all_employees(self):
         """Get all employee details including user role."""
@@ -186,62 +221,148 @@ class EmployeeOperations:
             if cursor:
                 cursor.close()
 
-    def add_encoding(self, emp_id, encoding_str):
+    def add_encoding(self, emp_id, encoding, model_name=None):
         """
-        Lưu mã hóa khuôn mặt (face embedding) dưới dạng chuỗi vào bảng FaceEncodings.
+        Lưu mã hóa khuôn mặt (face embedding) vào bảng FaceEncodings.
 
         Args:
             emp_id (str): Mã nhân viên.
-            encoding_str (str): Chuỗi encoding, ví dụ '0.123,0.456,...'
+            encoding: Embedding 512 chiều (mảng/list) hoặc chuỗi '0.123,0.456,...'.
+                Được lưu dạng float32 nhị phân trong EncodingBin, kèm chuỗi cũ
+                trong Encoding khi WRITE_LEGACY_TEXT bật.
+            model_name (str): Model nhận diện đã tạo embedding (ví dụ 'w600k_r50'), ghi vào ModelName.
         """
         try:
-            query = """
-                    INSERT INTO FaceEncodings (EmployeeID, Encoding, CreatedAt)
-                    VALUES (?, ?, GETDATE())
+            values = self._encoding_values(encoding, model_name)
+            columns = ', '.join(values)
+            placeholders = ', '.join('?' * len(values))
+            query = f"""
+                    INSERT INTO FaceEncodings (EmployeeID, {columns}, CreatedAt)
+                    VALUES (?, {placeholders}, GETDATE())
                     """
-            self.cursor.execute(query, (emp_id, encoding_str))
+            self.cursor.execute(query, (emp_id, *values.values()))
             self.conn.commit()
 
         except Exception as e:
             logging.error(f"[Lỗi add_encoding] emp_id={emp_id}, error: {e}")
 
+    # Giá trị các cột embedding theo những cột đang có trong bảng
+    def _encoding_values(self, encoding, model_name=None):
+        if self.has_binary_encoding_column():
+            values = {'Encoding': self._legacy_text(encoding), 'EncodingBin': encode_embedding(encoding)}
+        else:
+            values = {'Encoding': encode_embedding_text(encoding)}
+        if model_name and self.has_model_name_column():
+            values['ModelName'] = model_name
+        return values
+
+    def _legacy_text(self, encoding):
+        return encode_embedding_text(encoding) if self.WRITE_LEGACY_TEXT else None
+
     def get_all_encodings(self):
         """Return all encodings as a dict: {EmployeeID: encoding_list}"""
-        print("Step 1: Executing query to fetch EmployeeID and Encoding from database")
-        self.cursor.execute("SELECT EmployeeID, Encoding FROM FaceEncodings")
+        encodings = {}
+        for _, emp_id, encoding in self.get_all_encoding_rows():
+            encodings[emp_id] = encoding.tolist()
+        return encodings
 
-        print("Step 2: Fetching all results from the database")
-        results = self.cursor.fetchall()
-        print(f"Number of records fetched: {len(results)}")
+    def get_all_encoding_rows(self):
+        """Trả về mọi dòng FaceEncodings dạng [(EncodingID, EmployeeID, encoding_list)].
 
-        encodings = {}
-        for i, (emp_id, encoding_str) in enumerate(results, 1):
-            print(f"Step 3.{i}: Processing EmployeeID = {emp_id}")
-            print(f" - Original encoding string: {encoding_str}")
+        Khác với get_all_encodings, không dòng nào bị bỏ khi một nhân viên có nhiều template.
+        """
+        return self._fetch_encoding_rows(f"SELECT EncodingID, EmployeeID, {self._encoding_columns()} FROM FaceEncodings")
 
-            try:
-                # Chuyển chuỗi encoding thành danh sách số float
-                parts = encoding_str.split(',')
-                encoding = []
-                for x in parts:
-                    x = x.strip()
-                    try:
-                        encoding.append(float(x))
-                    except ValueError:
-                        print(f"  ⚠️ Bỏ qua giá trị không hợp lệ: '{x}'")
-
-                # Lưu kết quả nếu danh sách đủ độ dài (512 chiều)
-                if len(encoding) == 512:
-                    encodings[emp_id] = encoding
-                    print(f" - Converted encoding (first 5 values): {encoding[:5]}... ✅")
-                else:
-                    print(f"  ⚠️ Bỏ qua vì độ dài encoding không đúng (length = {len(encoding)})")
-
-            except Exception as e:
-                print(f" [Lỗi khi xử lý encoding cho EmployeeID={emp_id}]: {e}")
-
-        print("Step 4: Returning the complete encodings dictionary")
-        return encodings
+    def get_encoding_rows_since(self, last_encoding_id, last_created_at):
+        """Chỉ lấy các dòng mới (EncodingID lớn hơn) hoặc vừa cập nhật (CreatedAt không nhỏ hơn mốc)."""
+        query = f"""
+            SELECT EncodingID, EmployeeID, {self._encoding_columns()} FROM FaceEncodings
+            WHERE EncodingID > ? OR CreatedAt >= ?
+        """
+        return self._fetch_encoding_rows(query, (last_encoding_id, last_created_at))
+
+    def get_encoding_watermark(self):
+        """Phiên bản gallery rẻ để so sánh: (MAX(EncodingID), MAX(CreatedAt), COUNT(*))."""
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute("SELECT MAX(EncodingID), MAX(CreatedAt), COUNT(*) FROM FaceEncodings")
+            max_id, max_created_at, count = cursor.fetchone()
+            return (max_id or 0, max_created_at, count)
+        finally:
+            cursor.close()
+
+    def get_encoding_ids(self):
+        """Danh sách EncodingID hiện có, dùng để phát hiện các dòng đã bị xóa."""
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute("SELECT EncodingID FROM FaceEncodings")
+            return [row[0] for row in cursor.fetchall()]
+        finally:
+            cursor.close()
+
+    # Đọc song song: EncodingBin nếu đã có cột; chuỗi Encoding cũ chỉ tải về cho dòng chưa có EncodingBin hợp lệ
+    def _encoding_columns(self):
+        if not self.has_binary_encoding_column():
+            return "NULL, Encoding"
+        return (f"EncodingBin, CASE WHEN EncodingBin IS NULL OR DATALENGTH(EncodingBin) <> {EMBEDDING_BYTES} "
+                f"THEN Encoding END")
+
+    def _fetch_encoding_rows(self, query, params=()):
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute(query, params)
+            rows = []
+            for encoding_id, emp_id, encoding_bin, encoding_str in cursor.fetchall():
+                encoding = decode_embedding(encoding_bin, encoding_str)
+                if encoding is None:
+                    logging.warning(f"Bỏ qua encoding lỗi EncodingID={encoding_id}")
+                    continue
+                rows.append((encoding_id, emp_id, encoding))
+            return rows
+        finally:
+            cursor.close()
+
+    def migrate_encodings_to_binary(self, batch_size=500):
+        """Chuyển một lần mọi dòng chỉ có chuỗi Encoding sang EncodingBin, theo lô.
+
+        Trả về (số dòng đã chuyển, số dòng lỗi bị bỏ qua).
+        """
+        if not self.has_binary_encoding_column():
+            raise RuntimeError("Chưa có cột EncodingBin, hãy chạy db/migrations/001_face_encoding_binary.sql")
+
+        converted, skipped, last_id = 0, 0, 0
+        cursor = self.conn.cursor()
+        cursor.fast_executemany = True
+        try:
+            while True:
+                cursor.execute("""
+                    SELECT TOP (?) EncodingID, Encoding FROM FaceEncodings
+                    WHERE EncodingBin IS NULL AND Encoding IS NOT NULL AND EncodingID > ?
+                    ORDER BY EncodingID
+                """, (batch_size, last_id))
+                batch = cursor.fetchall()
+                if not batch:
+                    break
+                last_id = batch[-1][0]
+
+                updates = []
+                for encoding_id, encoding_str in batch:
+                    encoding = decode_embedding(None, encoding_str)
+                    if encoding is None:
+                        skipped += 1
+                        continue
+                    updates.append((encode_embedding(encoding), encoding_id))
+                if updates:
+                    cursor.executemany("UPDATE FaceEncodings SET EncodingBin = ? WHERE EncodingID = ?", updates)
+                    self.conn.commit()
+                converted += len(updates)
+                logging.info(f"Đã chuyển {converted} encoding sang nhị phân (bỏ qua {skipped})")
+            return converted, skipped
+        except Exception:
+            self.conn.rollback()
+            raise
+        finally:
+            cursor.close()
 
     def get_employee_info(self, emp_id):
         """Lấy thông tin nhân viên theo ID"""
@@ -304,15 +425,30 @@ class EmployeeOperations:
             logging.error(f"Lỗi cập nhật nhân viên hoặc vai trò: {e}")
             raise e
 
-    def update_face_encoding(self, employee_id, encoding_str):
-        """Cập nhật face encoding của nhân viên"""
+    def update_face_encoding(self, employee_id, encoding, model_name=None):
+        """Cập nhật face encoding của nhân viên (mảng embedding hoặc chuỗi '0.1,0.2,...').
+
+        Mỗi dòng FaceEncodings là một template riêng, nên chỉ template mới nhất
+        (EncodingID lớn nhất) được thay; các template khác của nhân viên giữ nguyên.
+        Nhân viên chưa có template thì thêm dòng mới. CreatedAt được đặt lại để
+        bộ nhớ đệm gallery nhận ra dòng đã thay đổi.
+        """
         try:
             cursor = self.conn.cursor()
-            cursor.execute("""
+            values = self._encoding_values(encoding, model_name)
+            assignments = ', '.join(f"{column} = ?" for column in values)
+            cursor.execute(f"""
                 UPDATE FaceEncodings
-                SET Encoding = ?
-                WHERE EmployeeID = ?
-            """, (encoding_str, employee_id))
+                SET {assignments}, CreatedAt = GETDATE()
+                WHERE EncodingID = (SELECT MAX(EncodingID) FROM FaceEncodings WHERE EmployeeID = ?)
+            """, (*values.values(), employee_id))
+            if cursor.rowcount == 0:
+                columns = ', '.join(values)
+                placeholders = ', '.join('?' * len(values))
+                cursor.execute(f"""
+                    INSERT INTO FaceEncodings (EmployeeID, {columns}, CreatedAt)
+                    VALUES (?, {placeholders}, GETDATE())
+                """, (employee_id, *values.values()))
             self.conn.commit()
             print(f"Updated face encoding for employee {employee_id}")
         except Exception as e:
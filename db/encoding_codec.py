@@ -0,0 +1,47 @@
+import logging
+
+import numpy as np
+
+# Embedding ArcFace: 512 số float32 little-endian = 2048 byte (cột EncodingBin VARBINARY(2048))
+EMBEDDING_DIM = 512
+EMBEDDING_DTYPE = np.dtype('<f4')
+EMBEDDING_BYTES = EMBEDDING_DIM * EMBEDDING_DTYPE.itemsize
+
+
+def encode_embedding(embedding):
+    """Chuyển embedding (mảng, list hoặc chuỗi '0.1,0.2,...') thành bytes float32 để lưu vào EncodingBin."""
+    if isinstance(embedding, str):
+        embedding = parse_encoding_text(embedding)
+        if embedding is None:
+            raise ValueError("Chuỗi encoding không hợp lệ")
+    vector = np.asarray(embedding, dtype=EMBEDDING_DTYPE).reshape(-1)
+    if vector.shape[0] != EMBEDDING_DIM:
+        raise ValueError(f"Embedding phải có {EMBEDDING_DIM} chiều, nhận được {vector.shape[0]}")
+    return vector.tobytes()
+
+
+def encode_embedding_text(embedding):
+    """Định dạng văn bản cũ '0.123,0.456,...' (cột Encoding) cho giai đoạn đọc song song."""
+    if isinstance(embedding, str):
+        return embedding
+    return ','.join(map(str, np.asarray(embedding, dtype=np.float32).reshape(-1).tolist()))
+
+
+def parse_encoding_text(encoding_str):
+    """Đọc định dạng văn bản cũ, trả về None nếu chuỗi lỗi hoặc sai số chiều."""
+    try:
+        vector = np.array(encoding_str.split(','), dtype=np.float32)
+    except (AttributeError, ValueError):
+        return None
+    return vector if vector.shape[0] == EMBEDDING_DIM else None
+
+
+def decode_embedding(encoding_bin=None, encoding_str=None):
+    """Đọc một dòng FaceEncodings, ưu tiên EncodingBin (zero-copy), sau đó tới chuỗi Encoding cũ."""
+    if encoding_bin is not None:
+        if len(encoding_bin) == EMBEDDING_BYTES:
+            return np.frombuffer(encoding_bin, dtype=EMBEDDING_DTYPE)
+        logging.warning(f"EncodingBin sai kích thước ({len(encoding_bin)} byte), thử cột Encoding")
+    if encoding_str is not None:
+        return parse_encoding_text(encoding_str)
+    return None
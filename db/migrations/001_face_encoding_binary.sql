@@ -0,0 +1,9 @@
+-- Thêm cột embedding nhị phân: 512 float32 little-endian = 2048 byte.
+-- Trong giai đoạn đọc song song, ứng dụng đọc EncodingBin trước rồi mới tới chuỗi Encoding cũ,
+-- và vẫn ghi cả hai cột. Sau khi chạy xong, chuyển dữ liệu cũ bằng:
+--     python -m tools.migrate_encodings
+IF COL_LENGTH('dbo.FaceEncodings', 'EncodingBin') IS NULL
+BEGIN
+    ALTER TABLE [dbo].[FaceEncodings] ADD [EncodingBin] [varbinary](2048) NULL
+END
+GO
@@ -0,0 +1,9 @@
+-- Ghi model nhận diện (file ONNX ArcFace: w600k_r50, w600k_mbf, ...) đã tạo từng embedding.
+-- Embedding của các model khác nhau không so sánh được với nhau; GalleryStore cảnh báo khi
+-- model đang chạy khác với model trong bảng. Dòng cũ (NULL) được coi là w600k_r50 của buffalo_l;
+-- giá trị tên gói cũ (buffalo_l, buffalo_m, buffalo_l_int8, ...) được quy về model nhận diện của gói.
+IF COL_LENGTH('dbo.FaceEncodings', 'ModelName') IS NULL
+BEGIN
+    ALTER TABLE [dbo].[FaceEncodings] ADD [ModelName] [nvarchar](64) NULL
+END
+GO
@@ -0,0 +1,123 @@
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import numpy as np
+from insightface.utils import face_align
+
+logger = logging.getLogger(__name__)
+
+
+# Căn chỉnh khuôn mặt về kích thước đầu vào ArcFace theo 5 điểm mốc của detector
+def align_face(rec_model, frame, face):
+    return face_align.norm_crop(frame, landmark=face.kps, image_size=rec_model.input_size[0])
+
+
+# Số ảnh tối đa model nhận trong một lần chạy: 1 nếu chiều batch của ONNX bị cố định bằng 1
+def model_batch_limit(rec_model, max_batch):
+    batch_dim = rec_model.session.get_inputs()[0].shape[0]
+    if isinstance(batch_dim, int) and batch_dim > 0:
+        return min(max_batch, batch_dim)
+    return max_batch
+
+
+class EmbeddingBatcher:
+    """Gom ảnh khuôn mặt đã căn chỉnh từ nhiều luồng thành một batch NCHW cho ArcFace.
+
+    Mỗi submit() trả về một Future. Luồng nền chạy một lần get_feat cho tối đa
+    max_batch ảnh; batch được gửi ngay khi đủ, hoặc khi ảnh đầu tiên đã chờ quá
+    max_wait giây, nên độ trễ thêm vào không vượt quá max_wait. Nhờ vậy các khuôn
+    mặt của cùng một khung hình, hay của nhiều camera trong cùng một tick, dùng
+    chung một lần chạy session.
+    """
+
+    def __init__(self, rec_model, max_batch=8, max_wait=0.005):
+        self.rec_model = rec_model
+        self.max_batch = model_batch_limit(rec_model, max_batch)
+        self.max_wait = max_wait
+        self.stats = {'batches': 0, 'items': 0, 'max_batch_seen': 0, 'run_time': 0.0}
+
+        self._pending = deque()
+        self._condition = threading.Condition()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='EmbeddingBatcher', daemon=True)
+        self._thread.start()
+
+    # Gửi một ảnh đã căn chỉnh, Future trả về embedding (chưa chuẩn hóa) của ảnh đó
+    def submit(self, aligned):
+        future = Future()
+        with self._condition:
+            if not self._running:
+                raise RuntimeError("EmbeddingBatcher đã đóng")
+            self._pending.append((time.perf_counter(), aligned, future))
+            self._condition.notify()
+        return future
+
+    # Căn chỉnh và embed các khuôn mặt của một khung hình, gán face.embedding như ArcFaceONNX.get
+    def embed_faces(self, frame, faces, timeout=None):
+        submitted = []
+        for face in faces:
+            if face.kps is None:
+                continue
+            submitted.append((face, self.submit(align_face(self.rec_model, frame, face))))
+        for face, future in submitted:
+            try:
+                face.embedding = future.result(timeout=timeout)
+            except Exception as e:
+                logger.error(f"Embedding failed: {e}")
+        return faces
+
+    # Chờ tới khi có ảnh, sau đó tới khi đủ batch hoặc ảnh đầu tiên hết hạn chờ
+    def _next_batch(self):
+        with self._condition:
+            while self._running and not self._pending:
+                self._condition.wait()
+            while self._running and len(self._pending) < self.max_batch:
+                remaining = self._pending[0][0] + self.max_wait - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            count = min(len(self._pending), self.max_batch)
+            return [self._pending.popleft() for _ in range(count)]
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                if not self._running:
+                    return
+                continue
+            futures = [item[2] for item in batch]
+            try:
+                started = time.perf_counter()
+                features = self.rec_model.get_feat([item[1] for item in batch])
+                self.stats['run_time'] += time.perf_counter() - started
+                self.stats['batches'] += 1
+                self.stats['items'] += len(batch)
+                self.stats['max_batch_seen'] = max(self.stats['max_batch_seen'], len(batch))
+                for future, feature in zip(futures, np.asarray(features, dtype=np.float32)):
+                    future.set_result(feature)
+            except Exception as e:
+                logger.error(f"Batched embedding error: {e}")
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def get_statistics(self):
+        batches = self.stats['batches']
+        return {
+            'batches': batches, 'items': self.stats['items'],
+            'mean_batch': self.stats['items'] / batches if batches else 0.0,
+            'max_batch_seen': self.stats['max_batch_seen'],
+            'ms_per_item': self.stats['run_time'] * 1000 / self.stats['items'] if self.stats['items'] else 0.0,
+            'pending': len(self._pending), 'max_batch': self.max_batch, 'max_wait': self.max_wait,
+        }
+
+    # Xử lý nốt các ảnh đang chờ rồi dừng luồng nền
+    def close(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        self._thread.join(timeout=5)
@@ -6,8 +6,7 @@ from datetime import datetime
 import pyodbc
 import os
 from db.database import Database
-from ui_components import CustomTableWidget, Sidebar
-from face_recognition_util import FaceRecognitionUtil
+from ui_components import CustomTableWidget, Sidebar, ModelLoadNotifier
 import time
 from camera import WebcamThread
 from camera import Camera
@@ -35,7 +34,9 @@ class EmployeeAttendanceApp(QMainWindow):
         self.db = db
         self.current_frame = None
         self.current_embedding = None
-        self.face_util = face_recognizer # new update
+        # face_recognizer là FaceModelHolder; face_util có khi model nạp xong (quản lý nhân viên không cần chờ)
+        self.face_model = face_recognizer
+        self.face_util = None
         self.controller_window = controller_window
         self.timer = None
         self.current_cam = None
@@ -49,6 +50,23 @@ class EmployeeAttendanceApp(QMainWindow):
 
         self.init_ui()
 
+        self.model_notifier = ModelLoadNotifier(self)
+        self.model_notifier.ready.connect(self.on_model_ready)
+        self.model_notifier.failed.connect(lambda error: print(f"Không nạp được mô hình nhận diện: {error}"))
+        self.model_notifier.watch(self.face_model.start())
+
+    def on_model_ready(self, model):
+        self.face_util = model
+
+    # Chụp khuôn mặt cần model; nếu model còn đang nạp thì báo và cho thử lại sau
+    def face_model_ready(self, notice_label):
+        if self.face_util is not None:
+            return True
+        notice_label.setText("Mô hình nhận diện đang được nạp, vui lòng thử lại sau giây lát...")
+        notice_label.setStyleSheet("color: #d97706; padding: 8px; background: #fff7ed; border-radius: 4px;")
+        notice_label.setVisible(True)
+        return False
+
     def init_ui(self):
         # Sidebar với callbacks
         callbacks = {
@@ -1296,6 +1314,8 @@ class EmployeeAttendanceApp(QMainWindow):
 
     def capture_image(self):
         """Bắt đầu capture với preview trong PyQt"""
+        if not self.face_model_ready(self.label_notice):
+            return
         try:
             self.label_notice.setText("Đang khởi động camera...")
             self.label_notice.setVisible(True)
@@ -1371,8 +1391,8 @@ class EmployeeAttendanceApp(QMainWindow):
                 face_img=face_img_bytes
             )
 
-            encoding_str = ','.join(map(str, self.current_embedding.tolist()))
-            self.db.employees.add_encoding(emp_id, encoding_str)
+            self.db.employees.add_encoding(emp_id, self.current_embedding,
+                                               model_name=self.face_util.model_name)
 
             username = str(emp_id)
 
@@ -1485,6 +1505,8 @@ class EmployeeAttendanceApp(QMainWindow):
 
     def capture_face_for_edit(self):
         """Bắt đầu capture khuôn mặt cho chế độ edit"""
+        if not self.face_model_ready(self.edit_label_notice):
+            return
         try:
             self.edit_label_notice.setText("Đang khởi động camera...")
             self.edit_label_notice.setStyleSheet(
@@ -1743,9 +1765,9 @@ class EmployeeAttendanceApp(QMainWindow):
             if hasattr(self, 'edit_current_embedding') and self.edit_current_embedding is not None:
                 print("Cập nhật dữ liệu khuôn mặt mới...")
 
-                # Chuyển embedding thành chuỗi lưu vào DB
-                encoding_str = ','.join(map(str, self.edit_current_embedding.tolist()))
-                self.db.employees.update_face_encoding(employee_id, encoding_str)
+                # Lưu embedding vào DB (nhị phân float32, kèm chuỗi cũ trong giai đoạn chuyển đổi)
+                self.db.employees.update_face_encoding(employee_id, self.edit_current_embedding,
+                                                       model_name=self.face_util.model_name)
 
                 # Cập nhật ảnh khuôn mặt nếu có
                 if hasattr(self, 'edit_selected_avatar_frame') and self.edit_selected_avatar_frame is not None:
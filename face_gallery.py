@@ -0,0 +1,339 @@
+import numpy as np
+
+
+class FaceGallery:
+    """Kho embedding của toàn bộ nhân viên dưới dạng một ma trận N×512 float32.
+
+    Mỗi dòng đã được chuẩn hóa (L2) sẵn nên điểm cosine với một probe chỉ cần
+    một phép nhân ma trận-vector thay vì gọi compare_faces cho từng nhân viên.
+
+    Một nhân viên có thể có nhiều template (nhiều dòng FaceEncodings, ví dụ có
+    và không đeo kính). Các dòng được xếp liền nhau theo nhân viên và điểm được
+    gộp theo nhân viên ngay trong phép tính vector:
+        - 'max':  lấy template khớp nhất
+        - 'top2': trung bình hai template khớp nhất (một template thì như 'max')
+
+    Ma trận có thể lưu gọn để chứa gallery rất lớn trong RAM:
+        - 'float32': 2 KB/template, chính xác
+        - 'float16': 1 KB/template, chỉ tiết kiệm bộ nhớ: NumPy không có phép nhân
+          float16 nhanh nên chậm hơn float32 nhiều lần; nên dùng 'int8'
+        - 'int8':    512 B + 4 B scale/template (lượng tử hóa theo từng vector)
+    Với 'float16'/'int8', lượt quét chạy trên dữ liệu nén (theo khối). Nếu có
+    full_matrix (các dòng float32 gốc, thường là np.memmap của bản chụp trên đĩa,
+    xem keep_full và GalleryStore) thì rerank_k nhân viên tốt nhất được chấm lại
+    bằng float32; không có thì dùng luôn điểm của lượt quét.
+    """
+
+    REDUCE_MODES = ('max', 'top2')
+    STORAGE_MODES = ('float32', 'float16', 'int8')
+    SCAN_BLOCK_ROWS = 512
+
+    def __init__(self, dim=512, reduce='max', storage='float32', rerank_k=32, keep_full=False):
+        if reduce not in self.REDUCE_MODES:
+            raise ValueError(f"reduce phải là một trong {self.REDUCE_MODES}")
+        if storage not in self.STORAGE_MODES:
+            raise ValueError(f"storage phải là một trong {self.STORAGE_MODES}")
+        self.dim = dim
+        self.reduce = reduce
+        self.storage = storage
+        self.rerank_k = rerank_k
+        self.matrix = np.empty((0, dim), dtype=self._storage_dtype(storage))
+        self.scales = None
+        # Bản float32 gốc, cùng thứ tự dòng với matrix, cho bước rerank. keep_full: giữ các dòng float32
+        # khi nạp để bản chụp ghi ra đĩa, sau đó người gọi thay bằng np.memmap (không nằm trong RAM)
+        self.keep_full = keep_full and storage != 'float32'
+        self.full_matrix = None
+        self.template_ids = np.empty((0,), dtype=np.int64)
+        self.row_employee = np.empty((0,), dtype=np.int64)
+        self.employee_ids = np.empty((0,), dtype=np.int64)
+        self.offsets = np.zeros(1, dtype=np.int64)
+
+    # Tạo gallery từ dict {EmployeeID: encoding_list} của get_all_encodings
+    @classmethod
+    def from_encodings(cls, encodings, dim=512, **kwargs):
+        rows = [(-1, emp_id, encoding) for emp_id, encoding in encodings.items()]
+        return cls.from_rows(rows, dim=dim, **kwargs)
+
+    # Tạo gallery từ các dòng (EncodingID, EmployeeID, encoding) của get_all_encoding_rows
+    @classmethod
+    def from_rows(cls, rows, dim=512, **kwargs):
+        gallery = cls(dim=dim, **kwargs)
+        gallery.load_rows(rows)
+        return gallery
+
+    # Nạp lại toàn bộ embedding từ dict {EmployeeID: encoding_list}
+    def load(self, encodings):
+        self.load_rows([(-1, emp_id, encoding) for emp_id, encoding in encodings.items()])
+
+    # Nạp lại toàn bộ template, chuẩn hóa một lần và xếp các dòng theo nhân viên
+    def load_rows(self, rows):
+        template_ids, emp_ids, matrix = self._parse_rows(rows)
+        stored, scales = self._quantize(matrix, self.storage)
+        self._set_arrays(stored, scales, emp_ids, template_ids, matrix if self.keep_full else None)
+
+    # Tách các dòng (EncodingID, EmployeeID, encoding) thành mảng, bỏ dòng sai số chiều
+    def _parse_rows(self, rows):
+        template_ids, emp_ids, vectors = [], [], []
+        for template_id, emp_id, encoding in rows:
+            vector = np.asarray(encoding, dtype=np.float32).reshape(-1)
+            if vector.shape[0] != self.dim:
+                continue
+            template_ids.append(template_id)
+            emp_ids.append(emp_id)
+            vectors.append(vector)
+
+        if vectors:
+            matrix = self._normalize_rows(np.vstack(vectors))
+        else:
+            matrix = np.empty((0, self.dim), dtype=np.float32)
+        return np.asarray(template_ids, dtype=np.int64), np.asarray(emp_ids, dtype=np.int64), matrix
+
+    # Sắp xếp các dòng (đã nén) theo nhân viên và dựng bảng ánh xạ dòng -> nhân viên
+    def _set_arrays(self, stored, scales, emp_ids, template_ids, full=None):
+        employee_ids, row_employee = np.unique(emp_ids, return_inverse=True)
+        order = np.argsort(row_employee, kind='stable')
+        counts = np.bincount(row_employee, minlength=employee_ids.shape[0])
+
+        self.matrix = np.ascontiguousarray(stored[order])
+        self.scales = scales[order] if scales is not None else None
+        self.full_matrix = np.ascontiguousarray(full[order]) if full is not None else None
+        self.template_ids = template_ids[order]
+        self.row_employee = row_employee[order]
+        self.employee_ids = employee_ids
+        self.offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+
+    # Tạo gallery mới từ gallery hiện tại cộng các dòng thêm/sửa và trừ các dòng đã xóa
+    def with_changes(self, rows, removed_template_ids=()):
+        """Các dòng cũ giữ nguyên dạng đã chuẩn hóa/nén, chỉ dòng mới phải xử lý.
+
+        Gallery hiện tại không bị sửa nên luồng nhận diện vẫn đọc được trong lúc
+        cập nhật; người gọi chỉ cần thay tham chiếu sang gallery mới.
+        """
+        template_ids, emp_ids, matrix = self._parse_rows(rows)
+        stored, scales = self._quantize(matrix, self.storage)
+
+        replaced = np.concatenate([template_ids, np.asarray(list(removed_template_ids), dtype=np.int64)])
+        keep = ~np.isin(self.template_ids, replaced)
+
+        gallery = FaceGallery(dim=self.dim, reduce=self.reduce, storage=self.storage, rerank_k=self.rerank_k,
+                              keep_full=self.keep_full)
+        # Gallery cũ không có dòng float32 (ví dụ bản chụp cũ) thì gallery mới cũng không rerank
+        full = None
+        if gallery.keep_full and self.full_matrix is not None:
+            full = np.concatenate([np.asarray(self.full_matrix[keep], dtype=np.float32), matrix])
+        gallery._set_arrays(
+            np.concatenate([self.matrix[keep], stored]),
+            np.concatenate([self.scales[keep], scales]) if scales is not None else None,
+            np.concatenate([self.row_ids[keep], emp_ids]),
+            np.concatenate([self.template_ids[keep], template_ids]),
+            full,
+        )
+        return gallery
+
+    @staticmethod
+    def _storage_dtype(storage):
+        return {'float32': np.float32, 'float16': np.float16, 'int8': np.int8}[storage]
+
+    # Nén ma trận float32 đã chuẩn hóa theo kiểu lưu trữ, trả về (matrix, scales)
+    @staticmethod
+    def _quantize(matrix, storage):
+        matrix = np.asarray(matrix, dtype=np.float32)
+        if storage == 'float32':
+            return np.ascontiguousarray(matrix), None
+        if storage == 'float16':
+            return np.ascontiguousarray(matrix, dtype=np.float16), None
+        # int8 đối xứng: mỗi vector một scale = max|x| / 127
+        scales = np.abs(matrix).max(axis=1) / 127.0 if matrix.size else np.empty(0, dtype=np.float32)
+        scales = np.where(scales > 0, scales, 1.0).astype(np.float32)
+        quantized = np.clip(np.rint(matrix / scales[:, None]), -127, 127).astype(np.int8)
+        return np.ascontiguousarray(quantized), scales
+
+    # Giải nén các dòng (hoặc toàn bộ) về float32
+    def dequantize(self, rows=None):
+        matrix = self.matrix if rows is None else self.matrix[rows]
+        if self.storage == 'float32':
+            return np.asarray(matrix, dtype=np.float32)
+        matrix = matrix.astype(np.float32)
+        if self.scales is not None:
+            matrix *= (self.scales if rows is None else self.scales[rows])[:, None]
+        return matrix
+
+    # Cosine giữa một probe và các dòng chỉ định, tính trên dữ liệu nén (dùng cho chỉ mục ANN)
+    def row_cosines(self, rows, probe):
+        return self.dequantize(rows) @ probe
+
+    # Số byte ma trận embedding đang chiếm trong RAM
+    @property
+    def nbytes(self):
+        return self.matrix.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    # Cosine F×N giữa probe và mọi dòng; dữ liệu nén được giải nén theo khối để giới hạn bộ nhớ
+    def _scan(self, probes):
+        return self.scan_rows(probes, self.matrix, self.scales)
+
+    # probes · matrix.T với matrix float32 hoặc nén (float16/int8 + scales), giải nén theo khối
+    @classmethod
+    def scan_rows(cls, probes, matrix, scales=None):
+        if matrix.dtype == np.float32:
+            return probes @ matrix.T
+        n = matrix.shape[0]
+        cosines = np.empty((probes.shape[0], n), dtype=np.float32)
+        for start in range(0, n, cls.SCAN_BLOCK_ROWS):
+            end = min(start + cls.SCAN_BLOCK_ROWS, n)
+            block = matrix[start:end].astype(np.float32)
+            cosines[:, start:end] = probes @ block.T
+            if scales is not None:
+                cosines[:, start:end] *= scales[start:end]
+        return cosines
+
+    # Số template (số dòng của ma trận)
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    @property
+    def num_employees(self):
+        return self.employee_ids.shape[0]
+
+    # EmployeeID của từng dòng template
+    @property
+    def row_ids(self):
+        return self.employee_ids[self.row_employee]
+
+    # Chuẩn hóa L2 từng dòng, dòng có norm ~0 được giữ bằng 0 (không bao giờ khớp)
+    @staticmethod
+    def _normalize_rows(matrix):
+        matrix = np.asarray(matrix, dtype=np.float32)
+        if matrix.size == 0:
+            return matrix
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms < 1e-6] = np.inf
+        return np.ascontiguousarray(matrix / norms, dtype=np.float32)
+
+    # Chuẩn hóa probe, trả về None nếu embedding không hợp lệ
+    @staticmethod
+    def _prepare_probe(embedding, dim):
+        if embedding is None:
+            return None
+        probe = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        if probe.shape[0] != dim:
+            return None
+        norm = np.linalg.norm(probe)
+        if norm <= 1e-6:
+            return None
+        return probe / norm
+
+    # Công thức tương đồng kết hợp giống hệt FaceRecognitionUtil.compare_faces
+    @staticmethod
+    def blend_similarity(cosine):
+        cosine = np.clip(cosine, -1.0, 1.0)
+        # Với vector đơn vị: ||a - b|| = sqrt(2 - 2cos)
+        euclidean_dist = np.sqrt(np.maximum(2.0 - 2.0 * cosine, 0.0))
+        similarity = cosine * 0.8 + (2.0 - euclidean_dist) / 2.0 * 0.2
+        return cosine * 0.9 + similarity * 0.1
+
+    # So khớp một probe với toàn bộ gallery, trả về (EmployeeID, điểm) tốt nhất
+    def match(self, embedding):
+        ids, scores = self.match_batch([embedding], top_k=1)
+        if ids.shape[0] == 0 or ids[0, 0] is None:
+            return None, 0.0
+        return ids[0, 0], float(scores[0, 0])
+
+    # So khớp F probe với toàn bộ gallery bằng một phép GEMM (F×512 · 512×N)
+    def match_batch(self, embeddings, top_k=1):
+        """Trả về (ids F×k, scores F×k) theo nhân viên, sắp xếp giảm dần theo điểm.
+
+        Probe không hợp lệ hoặc gallery rỗng cho id None và điểm 0.
+        """
+        matrix = self.matrix
+        num_probes = len(embeddings)
+        k = max(1, min(top_k, self.num_employees))
+        out_ids = np.full((num_probes, k), None, dtype=object)
+        out_scores = np.zeros((num_probes, k), dtype=np.float32)
+        if num_probes == 0 or matrix.shape[0] == 0:
+            return out_ids, out_scores
+
+        probes = np.zeros((num_probes, self.dim), dtype=np.float32)
+        valid = np.zeros(num_probes, dtype=bool)
+        for i, embedding in enumerate(embeddings):
+            probe = self._prepare_probe(embedding, self.dim)
+            if probe is not None:
+                probes[i] = probe
+                valid[i] = True
+        if not valid.any():
+            return out_ids, out_scores
+
+        valid_probes = probes[valid]
+        employee_scores = self._reduce_by_employee(self._scan(valid_probes))
+        if self.full_matrix is not None and self.storage != 'float32' and self.rerank_k:
+            ids, scores = self._rerank(valid_probes, employee_scores, k)
+            out_ids[valid] = ids
+            out_scores[valid] = scores
+            return out_ids, out_scores
+
+        top = self._top_k_indices(employee_scores, k)
+        out_ids[valid] = self.employee_ids[top].tolist()
+        out_scores[valid] = np.take_along_axis(employee_scores, top, axis=1)
+        return out_ids, out_scores
+
+    # Chấm lại bằng các dòng float32 gốc (full_matrix) các nhân viên dẫn đầu của lượt quét trên dữ liệu nén
+    def _rerank(self, probes, employee_scores, k):
+        num_probes = probes.shape[0]
+        shortlist = self._top_k_indices(employee_scores, max(k, min(self.rerank_k, self.num_employees)))
+        ids = np.full((num_probes, k), None, dtype=object)
+        scores = np.zeros((num_probes, k), dtype=np.float32)
+        for i in range(num_probes):
+            rows = np.concatenate([np.arange(self.offsets[e], self.offsets[e + 1]) for e in shortlist[i]])
+            cosines = np.asarray(self.full_matrix[rows], dtype=np.float32) @ probes[i]
+            emp_ids, emp_scores = self.reduce_candidates(self.employee_ids[self.row_employee[rows]],
+                                                         cosines, self.reduce)
+            top = self._top_k_indices(emp_scores[None, :], min(k, emp_ids.size))[0]
+            ids[i, :top.size] = emp_ids[top].tolist()
+            scores[i, :top.size] = emp_scores[top]
+        return ids, scores
+
+    # Gộp ma trận cosine F×N (theo template) thành điểm kết hợp F×E (theo nhân viên)
+    def _reduce_by_employee(self, cosines):
+        offsets = self.offsets
+        starts = offsets[:-1]
+        single_template = cosines.shape[1] == self.num_employees
+
+        # Điểm kết hợp đơn điệu tăng theo cosine nên gộp trên cosine rồi mới tính điểm
+        best = cosines if single_template else np.maximum.reduceat(cosines, starts, axis=1)
+        if self.reduce == 'max' or single_template:
+            return self.blend_similarity(best)
+
+        # top2: loại template tốt nhất rồi lấy max lần nữa để có template tốt thứ hai
+        is_best = cosines >= best[:, self.row_employee]
+        masked = np.where(is_best, -np.inf, cosines)
+        second = np.maximum.reduceat(masked, starts, axis=1)
+        # Nhiều template cùng đạt max, hoặc nhân viên chỉ có một template
+        ties = np.add.reduceat(is_best, starts, axis=1) >= 2
+        second = np.where(ties | (np.diff(offsets) == 1), best, second)
+        return (self.blend_similarity(best) + self.blend_similarity(second)) / 2.0
+
+    # Gộp điểm của các dòng ứng viên (1 probe) theo nhân viên, dùng cho chỉ mục ANN
+    @classmethod
+    def reduce_candidates(cls, emp_ids, cosines, reduce='max'):
+        """Trả về (EmployeeID duy nhất, điểm kết hợp) cho các dòng ứng viên."""
+        order = np.argsort(-cosines, kind='stable')
+        emp_sorted, cos_sorted = emp_ids[order], cosines[order]
+        unique_ids, first = np.unique(emp_sorted, return_index=True)
+        scores = cls.blend_similarity(cos_sorted[first])
+        if reduce == 'top2':
+            # Bỏ dòng tốt nhất của mỗi nhân viên, dòng đầu tiên còn lại là template tốt thứ hai
+            rest = np.ones(emp_sorted.shape[0], dtype=bool)
+            rest[first] = False
+            second_ids, second_pos = np.unique(emp_sorted[rest], return_index=True)
+            second = scores.copy()
+            second[np.searchsorted(unique_ids, second_ids)] = cls.blend_similarity(cos_sorted[rest][second_pos])
+            scores = (scores + second) / 2.0
+        return unique_ids, scores
+
+    # Chỉ số top-k theo từng dòng, đã sắp xếp giảm dần
+    @staticmethod
+    def _top_k_indices(scores, k):
+        if k >= scores.shape[1]:
+            return np.argsort(-scores, axis=1)
+        part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        order = np.argsort(-np.take_along_axis(scores, part, axis=1), axis=1)
+        return np.take_along_axis(part, order, axis=1)
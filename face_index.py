@@ -0,0 +1,337 @@
+import logging
+import time
+
+import numpy as np
+
+from face_gallery import FaceGallery
+
+logger = logging.getLogger(__name__)
+
+
+# np.savez tự thêm đuôi .npz: chuẩn hóa trước để save, load và os.path.exists dùng cùng một tên file
+def index_file_path(path):
+    return path if path.endswith('.npz') else path + '.npz'
+
+
+# Lấy mẫu sample_size dòng float32 từ ma trận hoặc FaceGallery (chỉ giải nén phần được chọn)
+def _sample_rows(source, sample_size, rng):
+    n = len(source)
+    rows = np.sort(rng.choice(n, sample_size, replace=False)) if sample_size < n else slice(None)
+    if isinstance(source, FaceGallery):
+        return source.dequantize(rows)
+    return np.asarray(source[rows], dtype=np.float32)
+
+
+# Duyệt gallery theo khối dòng float32 để không giải nén cả ma trận cùng lúc
+def _iter_blocks(gallery, chunk=8192):
+    for start in range(0, len(gallery), chunk):
+        end = min(start + chunk, len(gallery))
+        yield start, end, gallery.dequantize(slice(start, end))
+
+
+class IVFIndex:
+    """Chỉ mục IVF (inverted file) thuần NumPy cho gallery rất lớn.
+
+    Các embedding được chia vào n_lists cụm bằng k-means cầu (cosine). Khi tra
+    cứu, probe chỉ được so với các dòng thuộc n_probe cụm gần nhất rồi xếp hạng
+    lại chính xác bằng cosine đầy đủ. n_probe là núm vặn recall/độ trễ:
+    tăng n_probe thì recall gần với quét toàn bộ hơn nhưng chậm hơn.
+
+    Chỉ mục không giữ bản sao embedding: mỗi danh sách là các chỉ số dòng của
+    FaceGallery và điểm được tính trên ma trận nén của gallery (float16/int8),
+    nên ngoài gallery chỉ tốn 8 byte/dòng cho chỉ số.
+    """
+
+    def __init__(self, n_lists=None, n_probe=8, dim=512, reduce='max'):
+        self.dim = dim
+        self.reduce = reduce
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.centroids = None
+        self.gallery = None
+        self.rows = np.empty((0,), dtype=np.int64)
+        self.ids = np.empty((0,), dtype=np.int64)
+        self.offsets = np.zeros(1, dtype=np.int64)
+
+    def __len__(self):
+        return self.rows.shape[0]
+
+    @property
+    def is_trained(self):
+        return self.centroids is not None
+
+    # Dựng chỉ mục cho một FaceGallery
+    def build(self, gallery, n_iter=10, seed=0):
+        self.train(gallery, n_iter=n_iter, seed=seed)
+        return self.add(gallery)
+
+    # Học tâm cụm bằng k-means cầu trên một mẫu của gallery (FaceGallery hoặc ma trận đã chuẩn hóa)
+    def train(self, source, n_iter=10, seed=0, max_points_per_list=256):
+        n = len(source)
+        if n == 0:
+            raise ValueError("Không thể huấn luyện IVF trên gallery rỗng")
+
+        n_lists = self.n_lists or max(1, int(np.sqrt(n)))
+        n_lists = min(n_lists, n)
+        rng = np.random.default_rng(seed)
+
+        # Chỉ cần một mẫu cỡ vài trăm điểm mỗi cụm để học tâm cụm
+        sample_size = min(n, n_lists * max_points_per_list)
+        sample = _sample_rows(source, sample_size, rng)
+
+        centroids = sample[rng.choice(sample.shape[0], n_lists, replace=False)].copy()
+        started = time.time()
+        for _ in range(n_iter):
+            assign = self._assign(sample, centroids)
+            counts = np.bincount(assign, minlength=n_lists)
+            sums = self._sum_by_list(sample, assign, counts)
+
+            # Cụm rỗng được khởi tạo lại bằng một điểm ngẫu nhiên
+            empty = counts == 0
+            if empty.any():
+                sums[empty] = sample[rng.choice(sample.shape[0], int(empty.sum()), replace=False)]
+            centroids = FaceGallery._normalize_rows(sums)
+
+        self.n_lists = n_lists
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        logger.info(f"IVF trained: {n_lists} lists on {sample.shape[0]} vectors in {time.time() - started:.2f}s")
+        return self
+
+    # Tạo chỉ mục mới dùng lại tâm cụm đã học cho gallery mới (không huấn luyện lại)
+    def rebuild(self, gallery):
+        index = IVFIndex(n_lists=self.n_lists, n_probe=self.n_probe, dim=self.dim, reduce=self.reduce)
+        index.centroids = self.centroids
+        return index.add(gallery)
+
+    # Gán mọi dòng của gallery vào cụm; mỗi danh sách là một đoạn liên tiếp của mảng chỉ số dòng
+    def add(self, gallery):
+        if not self.is_trained:
+            raise RuntimeError("IVFIndex chưa được huấn luyện")
+        assign = np.empty(len(gallery), dtype=np.int64)
+        for start, end, block in _iter_blocks(gallery):
+            assign[start:end] = np.argmax(block @ self.centroids.T, axis=1)
+        order = np.argsort(assign, kind='stable')
+        counts = np.bincount(assign, minlength=self.n_lists)
+
+        self.gallery = gallery
+        self.rows = order
+        self.ids = gallery.row_ids[order]
+        self.offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+        return self
+
+    # Cộng các vector theo cụm trên bản đã sắp xếp (nhanh hơn nhiều so với np.add.at)
+    @staticmethod
+    def _sum_by_list(matrix, assign, counts):
+        sums = np.zeros((counts.shape[0], matrix.shape[1]), dtype=np.float32)
+        ordered = matrix[np.argsort(assign, kind='stable')]
+        offsets = np.concatenate(([0], np.cumsum(counts)))
+        for l in np.flatnonzero(counts):
+            sums[l] = ordered[offsets[l]:offsets[l + 1]].sum(axis=0)
+        return sums
+
+    # Gán cụm theo từng khối để không cấp phát ma trận N×L quá lớn
+    @staticmethod
+    def _assign(matrix, centroids, chunk=65536):
+        assign = np.empty(matrix.shape[0], dtype=np.int64)
+        for start in range(0, matrix.shape[0], chunk):
+            block = matrix[start:start + chunk]
+            assign[start:start + chunk] = np.argmax(block @ centroids.T, axis=1)
+        return assign
+
+    # Cùng API với FaceGallery.match
+    def match(self, embedding):
+        ids, scores = self.match_batch([embedding], top_k=1)
+        if ids.shape[0] == 0 or ids[0, 0] is None:
+            return None, 0.0
+        return ids[0, 0], float(scores[0, 0])
+
+    # Cùng API với FaceGallery.match_batch: (ids F×k, scores F×k)
+    def match_batch(self, embeddings, top_k=1, n_probe=None):
+        num_probes = len(embeddings)
+        k = max(1, top_k)
+        out_ids = np.full((num_probes, k), None, dtype=object)
+        out_scores = np.zeros((num_probes, k), dtype=np.float32)
+        if num_probes == 0 or len(self) == 0:
+            return out_ids, out_scores
+
+        probes = [FaceGallery._prepare_probe(e, self.dim) for e in embeddings]
+        valid = [i for i, p in enumerate(probes) if p is not None]
+        if not valid:
+            return out_ids, out_scores
+
+        n_probe = min(n_probe or self.n_probe, self.n_lists)
+        probe_matrix = np.stack([probes[i] for i in valid])
+        coarse = probe_matrix @ self.centroids.T
+        lists = FaceGallery._top_k_indices(coarse, n_probe)
+
+        for row, i in enumerate(valid):
+            candidates, cosines = self._scan_lists(lists[row], probe_matrix[row])
+            if candidates.size == 0:
+                continue
+            # Nhiều template của cùng một nhân viên được gộp giống FaceGallery
+            emp_ids, scores = FaceGallery.reduce_candidates(self.ids[candidates], cosines, self.reduce)
+            kk = min(k, emp_ids.size)
+            top = FaceGallery._top_k_indices(scores[None, :], kk)[0]
+            out_ids[i, :kk] = emp_ids[top].tolist()
+            out_scores[i, :kk] = scores[top]
+        return out_ids, out_scores
+
+    # Xếp hạng lại chính xác trên các danh sách được chọn, chấm điểm trên ma trận nén của gallery
+    def _scan_lists(self, list_ids, probe):
+        positions = [np.arange(self.offsets[l], self.offsets[l + 1]) for l in list_ids
+                     if self.offsets[l + 1] > self.offsets[l]]
+        if not positions:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        positions = np.concatenate(positions)
+        return positions, self.gallery.row_cosines(self.rows[positions], probe)
+
+    # Lưu tâm cụm ra file .npz (danh sách dòng dựng lại từ gallery bằng rebuild)
+    def save(self, path):
+        if not self.is_trained:
+            raise RuntimeError("IVFIndex chưa được huấn luyện")
+        np.savez(index_file_path(path), centroids=self.centroids, n_probe=np.int64(self.n_probe), reduce=np.str_(self.reduce))
+
+    # Nạp tâm cụm đã lưu bằng save(); gọi rebuild(gallery) trước khi tra cứu
+    @classmethod
+    def load(cls, path):
+        with np.load(index_file_path(path), allow_pickle=False) as data:
+            centroids = data['centroids']
+            index = cls(n_lists=centroids.shape[0], n_probe=int(data['n_probe']), dim=centroids.shape[1],
+                        reduce=str(data['reduce']))
+            index.centroids = centroids
+        return index
+
+
+class PCAIndex:
+    """So khớp hai tầng: lọc thô bằng embedding giảm chiều PCA, chấm lại ở 512 chiều.
+
+    Cơ sở PCA (mean + n_components thành phần chính) học từ chính FaceEncodings.
+    Tầng thô chấm điểm probe với toàn bộ gallery trên vector 64/128 chiều (rẻ
+    hơn 4-8 lần), giữ shortlist dòng tốt nhất rồi chấm lại bằng cosine 512 chiều
+    đầy đủ và công thức kết hợp của compare_faces. shortlist là núm vặn
+    recall/độ trễ giống n_probe của IVFIndex.
+
+    Vector giảm chiều được lưu cùng kiểu nén với gallery (int8 thì có scale theo
+    dòng); bước chấm lại đọc thẳng ma trận nén của gallery, không giữ bản float32.
+    """
+
+    def __init__(self, n_components=128, shortlist=100, dim=512, reduce='max'):
+        self.dim = dim
+        self.reduce = reduce
+        self.n_components = n_components
+        self.shortlist = shortlist
+        self.mean = None
+        self.components = None
+        self.explained_variance_ratio = None
+        self.gallery = None
+        self.reduced = np.empty((0, n_components), dtype=np.float32)
+        self.reduced_scales = None
+        self.ids = np.empty((0,), dtype=np.int64)
+
+    def __len__(self):
+        return self.ids.shape[0]
+
+    @property
+    def is_trained(self):
+        return self.components is not None
+
+    # Học cơ sở PCA từ FaceGallery hoặc ma trận đã chuẩn hóa (trên một mẫu nếu gallery lớn)
+    def fit(self, source, max_samples=50000, seed=0):
+        if len(source) < 2:
+            raise ValueError("Cần ít nhất 2 embedding để học PCA")
+        matrix = _sample_rows(source, min(len(source), max_samples), np.random.default_rng(seed))
+
+        started = time.time()
+        mean = matrix.mean(axis=0)
+        centered = matrix - mean
+        # Ma trận hiệp phương sai 512×512 nhỏ nên dùng eigh thay vì SVD trên N×512
+        covariance = (centered.T @ centered) / (matrix.shape[0] - 1)
+        eigenvalues, eigenvectors = np.linalg.eigh(covariance.astype(np.float64))
+        order = np.argsort(eigenvalues)[::-1][:self.n_components]
+
+        self.mean = mean.astype(np.float32)
+        self.components = np.ascontiguousarray(eigenvectors[:, order].T, dtype=np.float32)
+        self.explained_variance_ratio = (eigenvalues[order] / max(eigenvalues.sum(), 1e-12)).astype(np.float32)
+        logger.info(f"PCA fitted: {self.n_components} components on {matrix.shape[0]} vectors, "
+                    f"explained variance {self.explained_variance_ratio.sum():.3f} in {time.time() - started:.2f}s")
+        return self
+
+    # Chiếu (các) vector đã chuẩn hóa xuống không gian PCA
+    def transform(self, matrix):
+        return np.ascontiguousarray((np.asarray(matrix, dtype=np.float32) - self.mean) @ self.components.T)
+
+    # Tạo chỉ mục mới dùng lại cơ sở PCA đã học cho gallery mới
+    def rebuild(self, gallery):
+        index = PCAIndex(n_components=self.n_components, shortlist=self.shortlist, dim=self.dim,
+                         reduce=self.reduce)
+        index.mean, index.components = self.mean, self.components
+        index.explained_variance_ratio = self.explained_variance_ratio
+        return index.add(gallery)
+
+    # Chiếu gallery theo khối rồi nén vector giảm chiều theo kiểu lưu trữ của gallery
+    def add(self, gallery):
+        if not self.is_trained:
+            raise RuntimeError("PCAIndex chưa được học")
+        reduced = np.empty((len(gallery), self.components.shape[0]), dtype=np.float32)
+        for start, end, block in _iter_blocks(gallery):
+            reduced[start:end] = self.transform(block)
+        self.reduced, self.reduced_scales = FaceGallery._quantize(reduced, gallery.storage)
+        self.gallery = gallery
+        self.ids = gallery.row_ids
+        return self
+
+    # Cùng API với FaceGallery.match
+    def match(self, embedding):
+        ids, scores = self.match_batch([embedding], top_k=1)
+        if ids.shape[0] == 0 or ids[0, 0] is None:
+            return None, 0.0
+        return ids[0, 0], float(scores[0, 0])
+
+    # Cùng API với FaceGallery.match_batch: (ids F×k, scores F×k)
+    def match_batch(self, embeddings, top_k=1, shortlist=None):
+        num_probes = len(embeddings)
+        k = max(1, top_k)
+        out_ids = np.full((num_probes, k), None, dtype=object)
+        out_scores = np.zeros((num_probes, k), dtype=np.float32)
+        if num_probes == 0 or len(self) == 0:
+            return out_ids, out_scores
+
+        probes = [FaceGallery._prepare_probe(e, self.dim) for e in embeddings]
+        valid = [i for i, p in enumerate(probes) if p is not None]
+        if not valid:
+            return out_ids, out_scores
+
+        probe_matrix = np.stack([probes[i] for i in valid])
+        # Hạng tử probe·mean như nhau với mọi dòng nên chỉ cần chiếu probe, không trừ mean
+        coarse = FaceGallery.scan_rows(probe_matrix @ self.components.T, self.reduced, self.reduced_scales)
+        candidates = FaceGallery._top_k_indices(coarse, min(shortlist or self.shortlist, len(self)))
+
+        for row, i in enumerate(valid):
+            rows = candidates[row]
+            cosines = self.gallery.row_cosines(rows, probe_matrix[row])
+            emp_ids, scores = FaceGallery.reduce_candidates(self.ids[rows], cosines, self.reduce)
+            kk = min(k, emp_ids.size)
+            top = FaceGallery._top_k_indices(scores[None, :], kk)[0]
+            out_ids[i, :kk] = emp_ids[top].tolist()
+            out_scores[i, :kk] = scores[top]
+        return out_ids, out_scores
+
+    # Lưu cơ sở PCA ra file .npz (dữ liệu gallery luôn lấy lại từ cơ sở dữ liệu)
+    def save(self, path):
+        if not self.is_trained:
+            raise RuntimeError("PCAIndex chưa được học")
+        np.savez(index_file_path(path), mean=self.mean, components=self.components,
+                 explained_variance_ratio=self.explained_variance_ratio,
+                 shortlist=np.int64(self.shortlist), reduce=np.str_(self.reduce))
+
+    # Nạp cơ sở PCA đã lưu bằng save() hoặc tools/fit_pca.py
+    @classmethod
+    def load(cls, path):
+        with np.load(index_file_path(path), allow_pickle=False) as data:
+            components = data['components']
+            index = cls(n_components=components.shape[0], shortlist=int(data['shortlist']),
+                        dim=components.shape[1], reduce=str(data['reduce']))
+            index.mean = data['mean']
+            index.components = components
+            index.explained_variance_ratio = data['explained_variance_ratio']
+        return index
@@ -1,26 +1,45 @@
 import numpy as np
 import cv2
-from insightface.app import FaceAnalysis
+from insightface.app.common import Face
 import time
-from collections import deque
+
+from embedding_batcher import EmbeddingBatcher, align_face, model_batch_limit
+from face_tracker import FaceTracker, RoiState
+from model_identity import normalize_model_name, recognition_model_name
+from onnx_config import OnnxRuntimeConfig, TunedFaceAnalysis
 
 
 class FaceRecognitionUtil:
 
-    def __init__(self, det_size=(416, 416)):
+    def __init__(self, det_size=(416, 416), onnx_config=None, model_pack='buffalo_l', model_root='~/.insightface'):
+
+        # Cấu hình ONNX Runtime (số luồng, mức tối ưu, cache model đã tối ưu), xem tools/tune_onnx.py
+        self.onnx_config = onnx_config or OnnxRuntimeConfig.load_or_default()
 
         # Cấu hình tối ưu cho cả tốc độ và chính xác
-        self.face_app = FaceAnalysis(
-            name='buffalo_l',
-            providers=['CPUExecutionProvider']
+        # Chỉ nạp detector và ArcFace: landmark 2d/3d và genderage của buffalo_l không được dùng.
+        # model_pack: buffalo_l/m/s/sc, thư mục trong <model_root>/models (ví dụ 'buffalo_l_int8' do
+        # tools/quantize_models.py tạo) hoặc đường dẫn thư mục model riêng; so sánh bằng tools/bench_model_packs.py
+        self.model_pack = model_pack
+        self.model_root = model_root
+        self.face_app = TunedFaceAnalysis(
+            name=model_pack,
+            root=model_root,
+            allowed_modules=['detection', 'recognition'],
+            config=self.onnx_config
         )
 
         # Kích thước phát hiện tối ưu
         self.face_app.prepare(ctx_id=0, det_size=det_size)
+        self.det_model = self.face_app.det_model
+        self.rec_model = self.face_app.models.get('recognition')
+        # Định danh embedding theo model ArcFace (tên file ONNX), không theo tên gói: buffalo_l,
+        # buffalo_m và buffalo_l_int8 cùng là 'w600k_r50', dùng cho cột ModelName và bản chụp gallery
+        self.model_name = (recognition_model_name(self.rec_model.model_file) if self.rec_model is not None
+                           else normalize_model_name(model_pack))
 
         # Cache thông minh với tracking
-        self.face_tracker = {}
-        self.detection_history = deque(maxlen=5)
+        self.face_tracker = FaceTracker()
         self.last_frame_faces = []
         self.frame_cache_time = 0
         self.cache_duration = 0.033  # ~30 FPS
@@ -30,10 +49,23 @@ class FaceRecognitionUtil:
         self.max_faces = 3  # Giảm để tăng tốc độ
         self.confidence_threshold = 0.6  # Threshold vừa phải
 
-        # ROI adaptative để tăng tốc độ
-        self.roi_enabled = False
-        self.current_roi = None
+        # ROI thích ứng: hợp các bbox gần đây (detection_history) cộng roi_expansion,
+        # quét toàn khung hình mỗi full_scan_interval tick để bắt người mới vào.
+        # roi_state là trạng thái mặc định; nhiều camera dùng chung model thì truyền RoiState riêng
+        self.roi_enabled = True
+        self.roi_state = RoiState()
         self.roi_expansion = 50
+        self.full_scan_interval = 10
+        self.max_roi_fraction = 0.6
+
+        # Detect trên bản thu nhỏ vừa det_size, ArcFace căn chỉnh từ khung hình độ phân giải đầy đủ
+        self.detect_downscale = True
+
+        # ArcFace chạy một lần cho cả batch khuôn mặt; EmbeddingBatcher (nếu bật) gom thêm
+        # khuôn mặt từ nhiều camera trong cùng một tick, xem enable_embedding_batching
+        self.embedding_batcher = None
+        # Không dùng batcher: tối đa max_embed_batch ảnh mỗi lần get_feat, model có batch cố định bị giới hạn theo nó
+        self.max_embed_batch = 32
 
         # Frame enhancement - tối ưu
         self.clahe = cv2.createCLAHE(clipLimit=1.5, tileGridSize=(8, 8))
@@ -74,6 +106,57 @@ class FaceRecognitionUtil:
 
         return aligned_face, embedding
 
+    # Chỉ chạy detector (trong ROI nếu có, trên bản thu nhỏ): trả về các Face có bbox, kps,
+    # det_score theo tọa độ khung hình gốc để ArcFace căn chỉnh từ ảnh độ phân giải đầy đủ
+    def detect_faces(self, frame, max_num=0, roi_state=None):
+        roi_state = self.roi_state if roi_state is None else roi_state
+        region, (offset_x, offset_y), scale, input_size = self._next_detection_region(frame, roi_state)
+        try:
+            bboxes, kpss = self.det_model.detect(region, input_size=input_size, max_num=max_num, metric='default')
+        except Exception as e:
+            print(f"[ERROR] Detection failed: {e}")
+            return []
+
+        # Đưa tọa độ từ bản thu nhỏ về độ phân giải gốc rồi dịch về khung hình gốc
+        if scale != 1.0:
+            bboxes[:, 0:4] /= scale
+            if kpss is not None:
+                kpss /= scale
+        if offset_x or offset_y:
+            bboxes[:, [0, 2]] += offset_x
+            bboxes[:, [1, 3]] += offset_y
+            if kpss is not None:
+                kpss[:, :, 0] += offset_x
+                kpss[:, :, 1] += offset_y
+
+        faces = []
+        for i in range(bboxes.shape[0]):
+            kps = kpss[i] if kpss is not None else None
+            faces.append(Face(bbox=bboxes[i, 0:4], kps=kps, det_score=bboxes[i, 4]))
+        self._update_roi([face.bbox for face in faces], frame.shape, roi_state)
+        return faces
+
+    # Chỉ chạy ArcFace cho các khuôn mặt được chọn (căn chỉnh theo kps của detector),
+    # mọi khuôn mặt của khung hình đi chung một batch NCHW trong một lần chạy session
+    def embed_faces(self, frame, faces):
+        batcher = self.embedding_batcher
+        if batcher is not None:
+            return batcher.embed_faces(frame, faces)
+
+        faces_with_kps = [face for face in faces if face.kps is not None]
+        if not faces_with_kps:
+            return faces
+        try:
+            crops = [align_face(self.rec_model, frame, face) for face in faces_with_kps]
+            limit = model_batch_limit(self.rec_model, self.max_embed_batch)
+            for start in range(0, len(crops), limit):
+                features = self.rec_model.get_feat(crops[start:start + limit])
+                for face, feature in zip(faces_with_kps[start:start + limit], features):
+                    face.embedding = feature
+        except Exception as e:
+            print(f"[ERROR] Embedding failed: {e}")
+        return faces
+
     # Cải thiệm chất lượng frame và tối ưu
     def _enhance_frame(self, frame):
         try:
@@ -98,11 +181,8 @@ class FaceRecognitionUtil:
     # Phát hiện và kiểm tra chất lượng
     def _fast_face_detection(self, frame):
         try:
-            # ROI detection nếu enabled
-            detection_frame = self._get_detection_region(frame)
-
-            # Detection chính
-            faces = self.face_app.get(detection_frame)
+            # Detection chính (trong ROI nếu enabled), chỉ embed các khuôn mặt đạt chất lượng
+            faces = self.detect_faces(frame)
 
             if not faces:
                 return []
@@ -112,6 +192,7 @@ class FaceRecognitionUtil:
             for face in faces[:self.max_faces]:
                 if self._validate_face_quality_fast(face):
                     validated_faces.append(face)
+            self.embed_faces(frame, validated_faces)
 
             # Sắp xếp dựa trên điểm tổng hợp
             if len(validated_faces) > 1:
@@ -119,6 +200,11 @@ class FaceRecognitionUtil:
                     key=lambda f: self._calculate_face_score(f),
                     reverse=True
                 )
+
+            # Gắn track_id để cùng một người giữ nguyên id giữa các khung hình
+            tracks = self.face_tracker.update([f.bbox for f in validated_faces], time.time())
+            for face, track in zip(validated_faces, tracks):
+                face.track_id = track.track_id
             return validated_faces
 
         except Exception as e:
@@ -321,13 +407,14 @@ class FaceRecognitionUtil:
             return False, 0.0
 
     # Xác định vùng khuôn mặt
-    def _get_detection_region(self, frame):
+    def _get_detection_region(self, frame, state=None):
 
-        if not self.roi_enabled or self.current_roi is None:
-            return frame
+        state = self.roi_state if state is None else state
+        if not self.roi_enabled or state.current_roi is None:
+            return frame, (0, 0)
 
         # Lấy tọa độ vùng quan tâm
-        x1, y1, x2, y2 = self.current_roi
+        x1, y1, x2, y2 = state.current_roi
         h, w = frame.shape[:2]
 
         # Kiểm tra ranh giới
@@ -336,7 +423,66 @@ class FaceRecognitionUtil:
         x2 = min(w, x2)
         y2 = min(h, y2)
 
-        return frame[y1:y2, x1:x2]
+        return frame[y1:y2, x1:x2], (x1, y1)
+
+    # Tỉ lệ thu nhỏ để cả khung hình vừa det_size (1.0 nếu khung hình đã nhỏ hơn)
+    def _detection_scale(self, frame):
+        if not self.detect_downscale:
+            return 1.0
+        det_w, det_h = self.det_model.input_size
+        h, w = frame.shape[:2]
+        return min(1.0, det_w / w, det_h / h)
+
+    # Chọn vùng detect cho tick này: ROI, hoặc toàn khung hình theo chu kỳ / khi chưa có ROI.
+    # Trả về (ảnh đưa vào detector, offset trong khung hình gốc, tỉ lệ thu nhỏ, input_size)
+    def _next_detection_region(self, frame, state=None):
+        state = self.roi_state if state is None else state
+        state.detection_ticks += 1
+        scale = self._detection_scale(frame)
+        full_scan = state.detection_ticks % self.full_scan_interval == 0
+        region, offset, use_roi = frame, (0, 0), False
+        if not full_scan and self.roi_enabled and state.current_roi is not None:
+            roi_region, roi_offset = self._get_detection_region(frame, state)
+            if roi_region.size > 0:
+                region, offset, use_roi = roi_region, roi_offset, True
+                state.roi_ticks += 1
+
+        # INTER_AREA cho ảnh thu nhỏ ít răng cưa hơn phép resize tuyến tính bên trong detector
+        if scale < 1.0:
+            size = (max(1, int(round(region.shape[1] * scale))), max(1, int(round(region.shape[0] * scale))))
+            region = cv2.resize(region, size, interpolation=cv2.INTER_AREA)
+
+        # Vùng cắt: kích thước đầu vào detector theo vùng (bội số 32, không vượt det_size) nên rẻ hơn
+        input_size = None
+        if use_roi:
+            det_w, det_h = self.det_model.input_size
+            input_size = (min(det_w, -(-region.shape[1] // 32) * 32), min(det_h, -(-region.shape[0] // 32) * 32))
+        return region, offset, scale, input_size
+
+    # Cập nhật ROI từ hợp các bbox trong vài tick gần nhất cộng roi_expansion
+    def _update_roi(self, bboxes, frame_shape, state=None):
+        state = self.roi_state if state is None else state
+        state.detection_history.append([np.asarray(b[:4], dtype=np.float32) for b in bboxes])
+        if not self.roi_enabled:
+            return
+
+        recent = [b for boxes in state.detection_history for b in boxes]
+        if not recent:
+            state.current_roi = None
+            return
+
+        boxes = np.stack(recent)
+        h, w = frame_shape[:2]
+        x1 = max(0, int(boxes[:, 0].min()) - self.roi_expansion)
+        y1 = max(0, int(boxes[:, 1].min()) - self.roi_expansion)
+        x2 = min(w, int(boxes[:, 2].max()) + self.roi_expansion)
+        y2 = min(h, int(boxes[:, 3].max()) + self.roi_expansion)
+
+        # ROI gần bằng cả khung hình thì cắt cũng không lợi gì
+        if x2 <= x1 or y2 <= y1 or (x2 - x1) * (y2 - y1) > self.max_roi_fraction * w * h:
+            state.current_roi = None
+        else:
+            state.current_roi = (x1, y1, x2, y2)
 
     # Chỉ vẽ khi được yêu cầu rõ ràng (mặc định tắt)
     def draw_face_box(self, frame, draw_enabled=False):
@@ -375,6 +521,7 @@ class FaceRecognitionUtil:
         for idx, face in enumerate(faces[:self.max_faces]):
             info = {
                 'face_id': idx,
+                'track_id': getattr(face, 'track_id', None),
                 'bbox': face.bbox.tolist(),
                 'confidence': getattr(face, 'det_score', 0.0),
                 'quality_score': self._calculate_face_score(face),
@@ -423,16 +570,27 @@ class FaceRecognitionUtil:
 
         self.roi_enabled = enabled
         if not enabled:
-            self.current_roi = None
+            self.roi_state.clear()
         print(f"[INFO] ROI optimization {'enabled' if enabled else 'disabled'}")
 
+    # Gom khuôn mặt từ nhiều luồng (nhiều camera) vào chung một batch ArcFace;
+    # max_wait giới hạn thời gian một khuôn mặt phải chờ batch đầy
+    def enable_embedding_batching(self, enabled=True, max_batch=8, max_wait=0.005):
+
+        if self.embedding_batcher is not None:
+            self.embedding_batcher.close()
+            self.embedding_batcher = None
+        if enabled:
+            self.embedding_batcher = EmbeddingBatcher(self.rec_model, max_batch=max_batch, max_wait=max_wait)
+        print(f"[INFO] Embedding batching {'enabled' if enabled else 'disabled'}")
+
     # Xóa tất cả dữ liệu được lưu trữ tạm thời
     def clear_cache(self):
 
         self.last_frame_faces = []
         self.frame_cache_time = 0
-        self.face_tracker = {}
-        self.detection_history.clear()
+        self.face_tracker = FaceTracker()
+        self.roi_state.clear()
 
     # Khởi động và làm nóng mô hình học máy
     def warm_up(self, test_frame):
@@ -445,6 +603,10 @@ class FaceRecognitionUtil:
             for _ in range(3):
                 self.face_app.get(enhanced_frame)
 
+            # Ảnh trống không có khuôn mặt nên ArcFace được làm nóng riêng bằng một crop rỗng
+            if self.rec_model is not None:
+                self.rec_model.get_feat(np.zeros((112, 112, 3), dtype=np.uint8))
+
             print("[INFO] Model warmed up successfully")
 
         except Exception as e:
@@ -461,5 +623,8 @@ class FaceRecognitionUtil:
             'max_faces': self.max_faces, # Số lượng khuôn mặt tối đa
             'confidence_threshold': self.confidence_threshold, # Ngưỡng tin cậy tối thiểu
             'roi_enabled': self.roi_enabled, # Trạng thái của tính năng tối ưu hóa vùng quan tâm
-            'detection_size': getattr(self.face_app, 'det_size', 'unknown') # Kích thước của mô hình phát hiện khuôn mặt.
+            'current_roi': self.roi_state.current_roi, # Vùng detect hiện tại (None = toàn khung hình)
+            'roi_ratio': self.roi_state.roi_ticks / self.roi_state.detection_ticks if self.roi_state.detection_ticks else 0.0, # Tỉ lệ tick chỉ detect trong ROI
+            'detection_size': getattr(self.face_app, 'det_size', 'unknown'), # Kích thước của mô hình phát hiện khuôn mặt.
+            'embedding_batcher': self.embedding_batcher.get_statistics() if self.embedding_batcher else None
         }
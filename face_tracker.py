@@ -0,0 +1,158 @@
+import itertools
+from collections import deque
+
+import numpy as np
+
+
+# Trạng thái ROI của một nguồn khung hình; mỗi camera giữ một bản riêng khi dùng chung một model
+class RoiState:
+
+    def __init__(self, history=5):
+        self.current_roi = None
+        self.detection_history = deque(maxlen=history)
+        self.detection_ticks = 0
+        self.roi_ticks = 0
+
+    def clear(self):
+        self.current_roi = None
+        self.detection_history.clear()
+
+
+class Track:
+    """Một khuôn mặt được theo dõi qua nhiều khung hình, kèm danh tính đã nhận diện."""
+
+    def __init__(self, track_id, bbox, current_time):
+        self.track_id = track_id
+        self.bbox = np.asarray(bbox, dtype=np.float32)
+        self.created_at = current_time
+        self.last_seen = current_time
+        self.age = 1
+        self.lost = 0
+
+        self.emp_id = None
+        self.similarity = 0.0
+        self.verified_at = None
+
+    @property
+    def centroid(self):
+        return (self.bbox[:2] + self.bbox[2:4]) / 2.0
+
+    @property
+    def diagonal(self):
+        return float(np.hypot(self.bbox[2] - self.bbox[0], self.bbox[3] - self.bbox[1]))
+
+    @property
+    def has_identity(self):
+        return self.emp_id is not None
+
+
+class FaceTracker:
+    """Bộ theo dõi khuôn mặt theo IoU, dự phòng bằng khoảng cách tâm.
+
+    Mỗi lần update, các bbox mới được ghép tham lam với track hiện có theo IoU
+    giảm dần; bbox chưa ghép được thử lại theo khoảng cách tâm (chuẩn hóa theo
+    đường chéo bbox) để chịu được chuyển động nhanh. Track không thấy quá
+    max_lost lần liên tiếp bị xóa. Danh tính của track được dùng lại cho tới
+    khi hết reverify_interval giây, lúc đó khuôn mặt được nhận diện lại; nếu
+    lần xác minh lại không khớp thì danh tính bị thay hoặc xóa. Danh tính có
+    điểm dưới confident_similarity được nhận diện lại mỗi lần, còn khuôn mặt
+    chưa đăng ký chỉ được thử lại sau unknown_retry_interval giây.
+    """
+
+    def __init__(self, iou_threshold=0.3, max_centroid_distance=0.5, max_lost=5, reverify_interval=2.0,
+                 confident_similarity=0.7, unknown_retry_interval=0.5):
+        self.iou_threshold = iou_threshold
+        self.max_centroid_distance = max_centroid_distance
+        self.max_lost = max_lost
+        self.reverify_interval = reverify_interval
+        self.confident_similarity = confident_similarity
+        self.unknown_retry_interval = unknown_retry_interval
+        self.tracks = {}
+        self._next_id = itertools.count(1)
+
+    def __len__(self):
+        return len(self.tracks)
+
+    # Ghép bbox của khung hình hiện tại với các track, trả về track tương ứng từng bbox
+    def update(self, bboxes, current_time):
+        bboxes = [np.asarray(b[:4], dtype=np.float32) for b in bboxes]
+        tracks = list(self.tracks.values())
+        assigned = [None] * len(bboxes)
+        used = set()
+
+        if tracks and bboxes:
+            iou = np.array([[self.bbox_iou(b, t.bbox) for t in tracks] for b in bboxes])
+            for flat in np.argsort(-iou, axis=None):
+                i, j = divmod(int(flat), len(tracks))
+                if iou[i, j] < self.iou_threshold:
+                    break
+                if assigned[i] is None and j not in used:
+                    assigned[i] = tracks[j]
+                    used.add(j)
+
+            # Dự phòng: bbox chưa ghép được lấy track gần nhất theo tâm
+            for i, bbox in enumerate(bboxes):
+                if assigned[i] is not None:
+                    continue
+                centroid = (bbox[:2] + bbox[2:4]) / 2.0
+                best_j, best_distance = None, self.max_centroid_distance
+                for j, track in enumerate(tracks):
+                    if j in used:
+                        continue
+                    distance = np.linalg.norm(centroid - track.centroid) / max(track.diagonal, 1.0)
+                    if distance < best_distance:
+                        best_j, best_distance = j, distance
+                if best_j is not None:
+                    assigned[i] = tracks[best_j]
+                    used.add(best_j)
+
+        for i, bbox in enumerate(bboxes):
+            track = assigned[i]
+            if track is None:
+                track = Track(next(self._next_id), bbox, current_time)
+                self.tracks[track.track_id] = track
+                assigned[i] = track
+            else:
+                track.bbox = bbox
+                track.age += 1
+                track.lost = 0
+                track.last_seen = current_time
+
+        # Track không xuất hiện ở khung hình này
+        matched_ids = {t.track_id for t in assigned}
+        for track_id in list(self.tracks):
+            if track_id in matched_ids:
+                continue
+            track = self.tracks[track_id]
+            track.lost += 1
+            if track.lost > self.max_lost:
+                del self.tracks[track_id]
+        return assigned
+
+    # Track cần chạy ArcFace: chưa có danh tính chắc chắn hoặc đã đến hạn xác minh lại
+    def needs_embedding(self, track, current_time):
+        if track.verified_at is None:
+            return True
+        elapsed = current_time - track.verified_at
+        if not track.has_identity:
+            return elapsed >= self.unknown_retry_interval
+        if track.similarity < self.confident_similarity:
+            return True
+        return elapsed >= self.reverify_interval
+
+    # Ghi kết quả nhận diện mới nhất; emp_id None nghĩa là xác minh lại thất bại
+    def assign_identity(self, track, emp_id, similarity, current_time):
+        track.emp_id = emp_id
+        track.similarity = similarity if emp_id is not None else 0.0
+        track.verified_at = current_time
+
+    def clear(self):
+        self.tracks.clear()
+
+    @staticmethod
+    def bbox_iou(a, b):
+        x1, y1 = max(a[0], b[0]), max(a[1], b[1])
+        x2, y2 = min(a[2], b[2]), min(a[3], b[3])
+        inter = max(0.0, x2 - x1) * max(0.0, y2 - y1)
+        union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+        return float(inter / union) if union > 0 else 0.0
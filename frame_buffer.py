@@ -0,0 +1,121 @@
+import logging
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class FrameRingBuffer:
+    """Vòng đệm nhỏ giữ các khung hình mới nhất kèm số thứ tự tăng dần.
+
+    Luồng đọc camera ghi đè khung hình cũ nhất, không bao giờ chờ người đọc.
+    Mỗi người đọc (nhận diện, hiển thị) tự nhớ số thứ tự đã xử lý và gọi
+    latest(after_seq) để lấy khung hình mới nhất; các khung hình bị vượt qua
+    được tính là bị bỏ (seq mới - seq cũ - 1).
+    """
+
+    def __init__(self, capacity=3):
+        self.capacity = capacity
+        self._frames = deque(maxlen=capacity)
+        self._condition = threading.Condition()
+        self._closed = False
+        self.seq = 0
+
+    # Ghi khung hình mới, trả về số thứ tự của nó
+    def put(self, frame, timestamp=None):
+        with self._condition:
+            self.seq += 1
+            self._frames.append((self.seq, timestamp or time.time(), frame))
+            self._condition.notify_all()
+            return self.seq
+
+    # (seq, timestamp, frame) mới nhất có seq > after_seq; None nếu hết timeout hoặc đã đóng
+    def latest(self, after_seq=0, timeout=None):
+        deadline = None if timeout is None else time.time() + timeout
+        with self._condition:
+            while not self._closed and (not self._frames or self._frames[-1][0] <= after_seq):
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._condition.wait(remaining)
+            if not self._frames or self._frames[-1][0] <= after_seq:
+                return None
+            return self._frames[-1]
+
+    # Khung hình theo số thứ tự nếu còn trong vòng đệm
+    def get(self, seq):
+        with self._condition:
+            for entry in self._frames:
+                if entry[0] == seq:
+                    return entry
+        return None
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    @property
+    def closed(self):
+        return self._closed
+
+
+class FrameGrabber:
+    """Luồng riêng chỉ đọc camera (read() chặn theo FPS camera) và đẩy vào FrameRingBuffer.
+
+    Đọc liên tục giữ bộ đệm của driver luôn rỗng, nên người đọc chậm vẫn luôn
+    nhận được khung hình mới nhất thay vì khung hình cũ xếp hàng.
+    """
+
+    def __init__(self, source, buffer, max_failures=100):
+        self.source = source
+        self.buffer = buffer
+        self.max_failures = max_failures
+        self.stats = {'grabbed': 0, 'failures': 0}
+        self.fps = 0.0
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='FrameGrabber', daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        failures = 0
+        window_start, window_frames = time.time(), 0
+        while self._running:
+            ret, frame = self.source.read()
+            if not ret or frame is None:
+                if not getattr(self.source, 'is_live', True):
+                    # Video/thư mục ảnh đã hết
+                    break
+                self.stats['failures'] += 1
+                failures += 1
+                if failures >= self.max_failures:
+                    logger.error(f"Camera read failed {failures} times in a row, stopping capture")
+                    break
+                time.sleep(0.01)
+                continue
+            failures = 0
+            self.buffer.put(frame)
+            self.stats['grabbed'] += 1
+
+            window_frames += 1
+            now = time.time()
+            if now - window_start >= 1.0:
+                self.fps = window_frames / (now - window_start)
+                window_start, window_frames = now, 0
+        self.buffer.close()
+
+    @property
+    def is_alive(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def stop(self, timeout=2.0):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.buffer.close()
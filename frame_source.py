@@ -0,0 +1,202 @@
+import glob
+import logging
+import os
+import time
+
+import cv2
+
+logger = logging.getLogger(__name__)
+
+PACING_MODES = ('realtime', 'fast')
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+STREAM_PREFIXES = ('rtsp://', 'rtsps://', 'rtmp://', 'http://', 'https://', 'udp://', 'tcp://')
+
+
+class FrameSource:
+    """Nguồn khung hình chung cho WebcamThread, Camera và các công cụ.
+
+    Cùng giao diện với cv2.VideoCapture (read, isOpened, release, get, set) nên
+    dùng thay được ở mọi chỗ đang gọi VideoCapture. Nguồn ghi sẵn (video, thư
+    mục ảnh) có hai nhịp: 'realtime' phát đúng FPS gốc như camera thật, 'fast'
+    đọc nhanh nhất có thể; frame_time() trả về thời điểm của khung hình trong
+    bản ghi (khung hình thứ n / FPS) để chạy lại cho kết quả giống hệt nhau.
+    Nguồn trực tiếp (thiết bị, RTSP) luôn theo thời gian thực.
+    """
+
+    is_live = True
+    is_device = False
+
+    def __init__(self, pacing='realtime'):
+        if pacing not in PACING_MODES:
+            raise ValueError(f"pacing phải là một trong {PACING_MODES}")
+        self.pacing = pacing
+        self.frames_read = 0
+        self._started_at = None
+
+    @property
+    def fps(self):
+        return 0.0
+
+    def read(self):
+        raise NotImplementedError
+
+    # Thời điểm của khung hình vừa đọc: đồng hồ thật với nguồn trực tiếp, thời gian trong bản ghi với nguồn ghi sẵn
+    def frame_time(self):
+        if self.is_live:
+            return time.time()
+        return (self.frames_read - 1) / (self.fps or 30.0) if self.frames_read else 0.0
+
+    # Nhịp 'realtime' cho nguồn ghi sẵn: chờ tới thời điểm phát của khung hình kế tiếp
+    def _pace(self):
+        if self.is_live or self.pacing != 'realtime':
+            return
+        if self._started_at is None:
+            self._started_at = time.perf_counter()
+            return
+        due = self._started_at + self.frames_read / (self.fps or 30.0)
+        delay = due - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+    def isOpened(self):
+        return True
+
+    def get(self, prop):
+        return 0.0
+
+    def set(self, prop, value):
+        return False
+
+    def release(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+
+class VideoCaptureSource(FrameSource):
+    """Thiết bị (chỉ số), file video hoặc luồng mạng (RTSP/HTTP) qua cv2.VideoCapture."""
+
+    def __init__(self, target, pacing='realtime', loop=False, reconnect_delay=2.0):
+        super().__init__(pacing)
+        self.target = target
+        self.loop = loop
+        self.reconnect_delay = reconnect_delay
+        self.is_device = isinstance(target, int)
+        self.is_live = self.is_device or str(target).lower().startswith(STREAM_PREFIXES)
+        self.cap = cv2.VideoCapture(target)
+        self._fps = self.cap.get(cv2.CAP_PROP_FPS) or 0.0
+
+    @property
+    def fps(self):
+        return self._fps
+
+    def read(self):
+        self._pace()
+        ret, frame = self.cap.read()
+        if not ret and self.loop and not self.is_live:
+            # Hết file: quay lại đầu khi lặp
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ret, frame = self.cap.read()
+        if not ret and self.is_live and not self.is_device:
+            self._reconnect()
+        if ret:
+            self.frames_read += 1
+        return ret, frame
+
+    # Luồng mạng rớt kết nối thì mở lại sau reconnect_delay giây
+    def _reconnect(self):
+        logger.warning(f"Stream {self.target} lost, reconnecting in {self.reconnect_delay}s")
+        self.cap.release()
+        time.sleep(self.reconnect_delay)
+        self.cap = cv2.VideoCapture(self.target)
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def get(self, prop):
+        return self.cap.get(prop)
+
+    def set(self, prop, value):
+        return self.cap.set(prop, value)
+
+    def release(self):
+        if self.cap.isOpened():
+            self.cap.release()
+
+
+class ImageFolderSource(FrameSource):
+    """Thư mục ảnh (ví dụ captured_frames/) đọc theo thứ tự tên file, mỗi ảnh là một khung hình."""
+
+    is_live = False
+
+    def __init__(self, directory, pacing='fast', fps=10.0, loop=False):
+        super().__init__(pacing)
+        self.directory = directory
+        self.loop = loop
+        self._fps = fps
+        self.paths = sorted(path for path in glob.glob(os.path.join(directory, '**', '*'), recursive=True)
+                            if path.lower().endswith(IMAGE_EXTENSIONS))
+        self._index = 0
+        self.frame_size = None
+
+    @property
+    def fps(self):
+        return self._fps
+
+    def read(self):
+        while True:
+            if self._index >= len(self.paths):
+                if not self.loop or not self.paths:
+                    return False, None
+                self._index = 0
+            path = self.paths[self._index]
+            self._index += 1
+            frame = cv2.imread(path)
+            if frame is None:
+                logger.warning(f"Skip unreadable image {path}")
+                continue
+            self._pace()
+            self.frames_read += 1
+            self.frame_size = (frame.shape[1], frame.shape[0])
+            return True, frame
+
+    def isOpened(self):
+        return bool(self.paths)
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FPS:
+            return self._fps
+        if prop == cv2.CAP_PROP_FRAME_COUNT:
+            return float(len(self.paths))
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            return float(self._index)
+        if self.frame_size is None and self.paths:
+            frame = cv2.imread(self.paths[0])
+            if frame is not None:
+                self.frame_size = (frame.shape[1], frame.shape[0])
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return float(self.frame_size[0]) if self.frame_size else 0.0
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return float(self.frame_size[1]) if self.frame_size else 0.0
+        return 0.0
+
+
+# Mở nguồn theo mô tả: số/chuỗi số là thiết bị, URL là luồng mạng, thư mục là ảnh, còn lại là file video
+def open_frame_source(spec, pacing='realtime', loop=False, fps=10.0):
+    if isinstance(spec, FrameSource):
+        return spec
+    if isinstance(spec, str) and spec.strip().isdigit():
+        spec = int(spec.strip())
+    if isinstance(spec, int):
+        return VideoCaptureSource(spec)
+    if spec.lower().startswith(STREAM_PREFIXES):
+        return VideoCaptureSource(spec)
+    if os.path.isdir(spec):
+        return ImageFolderSource(spec, pacing=pacing, fps=fps, loop=loop)
+    if not os.path.exists(spec):
+        raise FileNotFoundError(f"Không tìm thấy nguồn khung hình: {spec}")
+    return VideoCaptureSource(spec, pacing=pacing, loop=loop)
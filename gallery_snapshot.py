@@ -0,0 +1,151 @@
+import json
+import logging
+import os
+import shutil
+import time
+from datetime import datetime
+
+import numpy as np
+
+from face_gallery import FaceGallery
+from model_identity import LEGACY_MODEL_NAME, normalize_model_name
+
+logger = logging.getLogger(__name__)
+
+
+class GallerySnapshot:
+    """Bản chụp gallery trên đĩa cục bộ để kiosk nhận diện được ngay khi khởi động.
+
+    Mỗi lần lưu tạo một thư mục thế hệ mới gen-<n>/ gồm các file .npy (ma trận,
+    scale, EncodingID, EmployeeID, offsets) và header.json (phiên bản định dạng,
+    model, số chiều, kiểu lưu trữ, watermark của bảng FaceEncodings). File CURRENT
+    trỏ tới thế hệ hiện hành và được thay bằng os.replace, nên một lần lưu bị
+    ngắt giữa chừng không bao giờ làm hỏng bản chụp đang dùng.
+
+    Khi nạp, các ma trận được mở bằng np.load(mmap_mode='r'): hệ điều hành chỉ đọc
+    trang nào thực sự được dùng nên khởi động chỉ mất vài mili giây.
+    """
+
+    FORMAT_VERSION = 1
+    ARRAYS = ('matrix', 'scales', 'full_matrix', 'template_ids', 'row_employee', 'employee_ids', 'offsets')
+    KEEP_GENERATIONS = 2
+
+    def __init__(self, directory, model_name=LEGACY_MODEL_NAME):
+        self.directory = directory
+        self.model_name = normalize_model_name(model_name)
+
+    # Lưu gallery và watermark thành một thế hệ mới, trả về đường dẫn thế hệ đó
+    def save(self, gallery, watermark):
+        os.makedirs(self.directory, exist_ok=True)
+        generation = self._current_generation() + 1
+        name = f"gen-{generation}"
+        tmp_path = os.path.join(self.directory, f".{name}.tmp-{os.getpid()}")
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+
+        for array_name in self.ARRAYS:
+            array = getattr(gallery, array_name)
+            if array is not None:
+                np.save(os.path.join(tmp_path, f"{array_name}.npy"), np.ascontiguousarray(array))
+
+        header = {
+            'format_version': self.FORMAT_VERSION,
+            'model': self.model_name,
+            'dim': gallery.dim,
+            'storage': gallery.storage,
+            'reduce': gallery.reduce,
+            'templates': len(gallery),
+            'employees': gallery.num_employees,
+            'watermark': self._encode_watermark(watermark),
+            'saved_at': time.time(),
+        }
+        with open(os.path.join(tmp_path, 'header.json'), 'w', encoding='utf-8') as f:
+            json.dump(header, f)
+
+        final_path = os.path.join(self.directory, name)
+        shutil.rmtree(final_path, ignore_errors=True)
+        os.replace(tmp_path, final_path)
+        self._write_current(name)
+        self._remove_old_generations(generation)
+        return final_path
+
+    # Nạp thế hệ hiện hành, trả về (gallery, watermark) hoặc None nếu không dùng được
+    def load(self, reduce='max', storage='float32', dim=512):
+        name = self._read_current()
+        if name is None:
+            return None
+        path = os.path.join(self.directory, name)
+        try:
+            with open(os.path.join(path, 'header.json'), encoding='utf-8') as f:
+                header = json.load(f)
+
+            # Bản chụp cũ ghi tên gói ('buffalo_l'), so sánh theo model nhận diện
+            header['model'] = normalize_model_name(header.get('model'))
+            expected = {'format_version': self.FORMAT_VERSION, 'model': self.model_name,
+                        'dim': dim, 'storage': storage}
+            mismatched = [k for k, v in expected.items() if header.get(k) != v]
+            if mismatched:
+                logger.warning(f"Gallery snapshot {path} bỏ qua do khác {', '.join(mismatched)}")
+                return None
+
+            gallery = FaceGallery(dim=dim, reduce=reduce, storage=storage, keep_full=True)
+            for array_name in self.ARRAYS:
+                file_path = os.path.join(path, f"{array_name}.npy")
+                if os.path.exists(file_path):
+                    setattr(gallery, array_name, np.load(file_path, mmap_mode='r', allow_pickle=False))
+            if gallery.matrix.shape[0] != gallery.template_ids.shape[0]:
+                raise ValueError("số dòng ma trận và EncodingID không khớp")
+            return gallery, self._decode_watermark(header['watermark'])
+        except Exception as e:
+            logger.error(f"Không đọc được gallery snapshot {path}: {e}")
+            return None
+
+    # Mở một mảng của thế hệ đã lưu bằng mmap (chỉ đọc)
+    @staticmethod
+    def open_array(path, array_name):
+        return np.load(os.path.join(path, f"{array_name}.npy"), mmap_mode='r', allow_pickle=False)
+
+    # Watermark (MAX(EncodingID), MAX(CreatedAt), COUNT(*)) chuyển sang dạng JSON
+    @staticmethod
+    def _encode_watermark(watermark):
+        last_id, last_created_at, count = watermark
+        return [last_id, last_created_at.isoformat() if last_created_at else None, count]
+
+    @staticmethod
+    def _decode_watermark(value):
+        last_id, last_created_at, count = value
+        return last_id, datetime.fromisoformat(last_created_at) if last_created_at else None, count
+
+    def _read_current(self):
+        try:
+            with open(os.path.join(self.directory, 'CURRENT'), encoding='utf-8') as f:
+                return f.read().strip() or None
+        except OSError:
+            return None
+
+    def _write_current(self, name):
+        tmp_file = os.path.join(self.directory, f"CURRENT.tmp-{os.getpid()}")
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            f.write(name)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, os.path.join(self.directory, 'CURRENT'))
+
+    def _current_generation(self):
+        name = self._read_current()
+        try:
+            return int(name.split('-', 1)[1]) if name else 0
+        except (IndexError, ValueError):
+            return 0
+
+    # Xóa các thế hệ cũ; trên Windows file đang được mmap sẽ không xóa được và được thử lại lần sau
+    def _remove_old_generations(self, generation):
+        for entry in os.listdir(self.directory):
+            if not entry.startswith('gen-'):
+                continue
+            try:
+                old = int(entry.split('-', 1)[1])
+            except ValueError:
+                continue
+            if old <= generation - self.KEEP_GENERATIONS:
+                shutil.rmtree(os.path.join(self.directory, entry), ignore_errors=True)
@@ -0,0 +1,339 @@
+import logging
+import os
+import threading
+import time
+
+from face_gallery import FaceGallery
+from face_index import IVFIndex, PCAIndex, index_file_path
+from gallery_snapshot import GallerySnapshot
+from model_identity import LEGACY_MODEL_NAME, normalize_model_name
+from shared_gallery import SharedGalleryWriter
+
+logger = logging.getLogger(__name__)
+
+
+class GalleryStore:
+    """Giữ gallery hiện hành và làm mới nó từ bảng FaceEncodings.
+
+    Mỗi lần làm mới chỉ hỏi phiên bản (watermark) của bảng:
+    (MAX(EncodingID), MAX(CreatedAt), COUNT(*)). Nếu không đổi thì không tải gì;
+    nếu đổi thì chỉ lấy các dòng mới/vừa sửa, và khi số dòng không khớp thì đối
+    chiếu danh sách EncodingID để loại các dòng đã xóa. Gallery mới được dựng
+    trên luồng nền rồi thay thế bằng một phép gán tham chiếu duy nhất, nên luồng
+    nhận diện không bao giờ bị chặn hay thấy trạng thái dở dang.
+
+    Nếu có snapshot_dir, gallery được nạp ngay từ bản chụp trên đĩa (mmap) khi khởi
+    tạo và lần làm mới đầu tiên chỉ đối chiếu phần thay đổi kể từ watermark của bản
+    chụp; sau mỗi lần gallery thay đổi, bản chụp được ghi lại.
+
+    Nếu có shared_name, tiến trình này là tiến trình ghi duy nhất: mỗi gallery mới
+    được công bố vào shared memory để các tiến trình khác đọc zero-copy bằng
+    SharedGalleryReader(shared_name).
+    """
+
+    def __init__(self, db, refresh_interval=30, reduce='max', storage='float32',
+                 snapshot_dir=None, model_name=LEGACY_MODEL_NAME, shared_name=None):
+        self.db = db
+        self.refresh_interval = refresh_interval
+        self.reduce = reduce
+        self.storage = storage
+        if storage == 'float16':
+            logger.warning("Gallery float16 chỉ tiết kiệm bộ nhớ và chậm hơn float32 nhiều lần, nên dùng int8")
+        # Gallery nén giữ dòng float32 gốc trong bản chụp trên đĩa (mmap) để rerank, không giữ trong RAM
+        self.keep_full = storage != 'float32' and snapshot_dir is not None
+
+        self.gallery = FaceGallery(reduce=reduce, storage=storage, keep_full=self.keep_full)
+        self.ann_index = None
+        self.watermark = None
+        self.last_refresh_time = 0
+
+        # Chỉ mục ANN (IVF hoặc PCA hai tầng) chỉ dùng khi gallery rất lớn, còn lại quét toàn bộ
+        self.ann_kind = 'ivf'
+        self.ann_min_gallery_size = 50000
+        self.ann_n_probe = 8
+        self.ann_index_path = None
+        self.pca_components = 128
+        self.pca_shortlist = 100
+
+        self._employees = None
+        self._owns_employees = False
+        self._closed = False
+        self._refresh_lock = threading.Lock()
+        self._refresh_thread = None
+        # _refresh_lock giữ suốt lần làm mới (truy vấn DB, dựng chỉ mục); _swap_lock chỉ giữ lúc thay gallery.
+        # clear() tăng _generation dưới _swap_lock nên không phải chờ lần làm mới đang chạy,
+        # lần làm mới đó thấy thế hệ đã đổi thì bỏ kết quả thay vì ghi đè gallery rỗng
+        self._swap_lock = threading.Lock()
+        self._generation = 0
+
+        self.model_name = normalize_model_name(model_name)
+        self.model_mismatch = None
+        self._models_checked = False
+
+        self.snapshot = GallerySnapshot(snapshot_dir, self.model_name) if snapshot_dir else None
+        self.loaded_from_snapshot = False
+        self.shared_writer = SharedGalleryWriter(shared_name) if shared_name else None
+        if self.snapshot is not None:
+            self.load_snapshot()
+
+    # Nạp gallery từ bản chụp trên đĩa, không cần tới cơ sở dữ liệu
+    def load_snapshot(self):
+        started = time.time()
+        loaded = self.snapshot.load(reduce=self.reduce, storage=self.storage)
+        if loaded is None:
+            return False
+        gallery, watermark = loaded
+        with self._refresh_lock:
+            generation = self._generation
+            ann_index = self._build_ann_index(gallery)
+            if not self._swap(generation, gallery, ann_index, watermark):
+                return False
+            self.loaded_from_snapshot = True
+            self._publish_shared(gallery, watermark)
+        logger.info(f"🔥 Gallery snapshot loaded: {len(gallery)} templates, "
+                    f"{gallery.num_employees} employees in {(time.time() - started) * 1000:.1f}ms")
+        return True
+
+    # Đối tượng dùng để tra cứu: chỉ mục ANN nếu có, nếu không thì gallery
+    @property
+    def matcher(self):
+        ann_index = self.ann_index
+        return ann_index if ann_index is not None else self.gallery
+
+    # Làm mới trên luồng nền nếu đã đến hạn; không bao giờ chặn người gọi
+    def maybe_refresh(self, current_time=None):
+        current_time = current_time or time.time()
+        if current_time - self.last_refresh_time < self.refresh_interval:
+            return False
+        self.last_refresh_time = current_time
+        return self.refresh_async()
+
+    def refresh_async(self, full=False):
+        if self._refresh_thread is not None and self._refresh_thread.is_alive():
+            return False
+        self._refresh_thread = threading.Thread(target=self.refresh, kwargs={'full': full}, daemon=True)
+        self._refresh_thread.start()
+        return True
+
+    # Đồng bộ gallery với cơ sở dữ liệu, trả về True nếu gallery thay đổi
+    def refresh(self, full=False):
+        with self._refresh_lock:
+            if self._closed:
+                return False
+            generation = self._generation
+            try:
+                employees = self._get_employees()
+                watermark = employees.get_encoding_watermark()
+                if not full and watermark == self.watermark:
+                    return False
+
+                started = time.time()
+                if full or not self._models_checked:
+                    self._check_encoding_models(employees)
+                if full or self.watermark is None:
+                    gallery = FaceGallery.from_rows(employees.get_all_encoding_rows(), reduce=self.reduce,
+                                                    storage=self.storage, keep_full=self.keep_full)
+                    mode = 'full'
+                else:
+                    gallery = self._incremental_gallery(employees, watermark)
+                    mode = 'incremental'
+
+                ann_index = self._build_ann_index(gallery)
+                if not self._swap(generation, gallery, ann_index, watermark):
+                    logger.info("Gallery refresh discarded: gallery was cleared while it ran")
+                    return False
+                logger.info(f"🔥 Gallery {mode} refresh: {len(gallery)} templates, "
+                            f"{gallery.num_employees} employees in {time.time() - started:.2f}s")
+                self._publish_shared(gallery, watermark)
+                self._save_snapshot(gallery, watermark)
+                return True
+            except Exception as e:
+                logger.error(f"Gallery refresh error: {e}")
+                # Kết nối có thể đã hỏng: đóng nó, lần sau mở kết nối mới
+                self._close_employees()
+                return False
+            finally:
+                # close() gọi trong lúc đang làm mới thì kết nối được đóng ở đây
+                if self._closed:
+                    self._close_employees()
+
+    # Thay gallery, chỉ mục và watermark cùng lúc, trừ khi clear() đã chạy kể từ khi bắt đầu dựng chúng
+    def _swap(self, generation, gallery, ann_index, watermark):
+        with self._swap_lock:
+            if generation != self._generation:
+                return False
+            self.ann_index = ann_index
+            self.gallery = gallery
+            self.watermark = watermark
+            return True
+
+    # Embedding của gói model khác nằm trong không gian khác, so khớp sẽ sai; chỉ cảnh báo, không chặn
+    def _check_encoding_models(self, employees):
+        if not hasattr(employees, 'get_encoding_models'):
+            return
+        try:
+            models = employees.get_encoding_models()
+        except Exception as e:
+            logger.error(f"Encoding model check error: {e}")
+            return
+        self._models_checked = True
+        # So theo model nhận diện: dòng cũ (NULL) là buffalo_l, tên gói cũ và bản _int8 quy về file ONNX gốc
+        counts = {}
+        for model, count in models.items():
+            model = normalize_model_name(model)
+            counts[model] = counts.get(model, 0) + count
+        others = {model: count for model, count in counts.items() if model != self.model_name}
+        self.model_mismatch = others or None
+        if others:
+            logger.warning(f"⚠️ Model đang dùng là {self.model_name} nhưng FaceEncodings có embedding của "
+                           f"{others}; cần đăng ký lại khuôn mặt hoặc chọn đúng gói model")
+
+    # Lỗi ghi bản chụp không được làm hỏng lần làm mới
+    def _save_snapshot(self, gallery, watermark):
+        if self.snapshot is None:
+            return
+        try:
+            path = self.snapshot.save(gallery, watermark)
+            # Dòng float32 gốc đã nằm trên đĩa: đổi sang mmap để bỏ bản trong RAM
+            if gallery.full_matrix is not None:
+                gallery.full_matrix = self.snapshot.open_array(path, 'full_matrix')
+        except Exception as e:
+            logger.error(f"Gallery snapshot save error: {e}")
+
+    def _publish_shared(self, gallery, watermark):
+        if self.shared_writer is None:
+            return
+        try:
+            self.shared_writer.publish(gallery, watermark)
+        except Exception as e:
+            logger.error(f"Shared gallery publish error: {e}")
+
+    # Chỉ tải các dòng mới/vừa sửa, đối chiếu ID khi có dòng bị xóa
+    def _incremental_gallery(self, employees, watermark):
+        last_id, last_created_at, _ = self.watermark
+        rows = employees.get_encoding_rows_since(last_id, last_created_at)
+        gallery = self.gallery.with_changes(rows)
+
+        if len(gallery) != watermark[2]:
+            existing = set(employees.get_encoding_ids())
+            removed = [t for t in gallery.template_ids.tolist() if t not in existing]
+            if removed:
+                gallery = gallery.with_changes([], removed)
+        return gallery
+
+    # Luồng nền dùng kết nối riêng vì kết nối pyodbc không an toàn khi dùng chung giữa các luồng
+    def _get_employees(self):
+        if self._employees is None:
+            if hasattr(self.db, 'open_employee_operations'):
+                self._employees = self.db.open_employee_operations()
+                self._owns_employees = True
+            else:
+                self._employees = self.db.employees
+                self._owns_employees = False
+        return self._employees
+
+    # Chỉ đóng kết nối do store tự mở, kết nối chung của db để nguyên
+    def _close_employees(self):
+        employees, self._employees = self._employees, None
+        if employees is None or not self._owns_employees:
+            return
+        self._owns_employees = False
+        try:
+            employees.conn.close()
+        except Exception as e:
+            logger.error(f"Gallery connection close error: {e}")
+
+    # Dựng chỉ mục IVF khi gallery đủ lớn; tâm cụm đã học được tái sử dụng giữa các lần cập nhật
+    def _build_ann_index(self, gallery):
+        if len(gallery) < self.ann_min_gallery_size:
+            return None
+        try:
+            if self.ann_kind == 'pca':
+                return self._build_pca_index(gallery)
+            index = self.ann_index if isinstance(self.ann_index, IVFIndex) else None
+            if index is None and self.ann_index_path and os.path.exists(self.ann_index_path):
+                index = IVFIndex.load(self.ann_index_path)
+            if index is None or index.dim != gallery.dim:
+                # Chỉ ghi file khi vừa huấn luyện: các lần làm mới sau dùng lại đúng các tâm cụm này
+                index = IVFIndex(n_probe=self.ann_n_probe, dim=gallery.dim).train(gallery)
+                if self.ann_index_path:
+                    index.save(self.ann_index_path)
+            index.reduce = gallery.reduce
+            index = index.rebuild(gallery)
+            index.n_probe = self.ann_n_probe
+            return index
+        except Exception as e:
+            logger.error(f"ANN index error, falling back to brute force: {e}")
+            return None
+
+    # Cơ sở PCA nạp từ file (tools/fit_pca.py) nếu có, nếu không thì học một lần trên gallery
+    def _build_pca_index(self, gallery):
+        index = self.ann_index if isinstance(self.ann_index, PCAIndex) else None
+        if index is None and self.ann_index_path and os.path.exists(self.ann_index_path):
+            index = PCAIndex.load(self.ann_index_path)
+        if index is None or index.dim != gallery.dim:
+            index = PCAIndex(n_components=self.pca_components, dim=gallery.dim).fit(gallery)
+            if self.ann_index_path:
+                index.save(self.ann_index_path)
+        index.reduce = gallery.reduce
+        index.shortlist = self.pca_shortlist
+        return index.rebuild(gallery)
+
+    # Bật chỉ mục ANN cho gallery lớn; n_probe càng lớn recall càng cao nhưng chậm hơn
+    def set_ann_mode(self, min_gallery_size=50000, n_probe=8, index_path=None):
+        self.ann_kind = 'ivf'
+        self.ann_min_gallery_size = min_gallery_size
+        self.ann_n_probe = n_probe
+        self.ann_index_path = index_file_path(index_path) if index_path else None
+        if isinstance(self.ann_index, IVFIndex):
+            self.ann_index.n_probe = n_probe
+        else:
+            # Chỉ mục kiểu khác được bỏ, chỉ mục mới dựng ở lần gallery thay đổi tiếp theo
+            self.ann_index = None
+        logger.info(f"🔥 ANN mode: min {min_gallery_size} faces, n_probe={n_probe}")
+
+    # So khớp hai tầng PCA: lọc thô ở n_components chiều, chấm lại shortlist dòng ở 512 chiều
+    def set_pca_mode(self, min_gallery_size=50000, n_components=128, shortlist=100, basis_path=None):
+        self.ann_kind = 'pca'
+        self.ann_min_gallery_size = min_gallery_size
+        self.pca_components = n_components
+        self.pca_shortlist = shortlist
+        self.ann_index_path = index_file_path(basis_path) if basis_path else None
+        if isinstance(self.ann_index, PCAIndex):
+            self.ann_index.shortlist = shortlist
+        else:
+            self.ann_index = None
+        logger.info(f"🔥 PCA mode: min {min_gallery_size} faces, {n_components}-d, shortlist={shortlist}")
+
+    # Xóa gallery trong bộ nhớ, lần làm mới sau sẽ tải lại toàn bộ; không chờ lần làm mới đang chạy
+    def clear(self):
+        empty = FaceGallery(reduce=self.reduce, storage=self.storage, keep_full=self.keep_full)
+        with self._swap_lock:
+            self._generation += 1
+            self.ann_index = None
+            self.gallery = empty
+            self.watermark = None
+            self.last_refresh_time = 0
+
+    def get_statistics(self):
+        gallery = self.gallery
+        return {
+            'employees': gallery.num_employees, 'templates': len(gallery),
+            'storage': gallery.storage, 'gallery_bytes': gallery.nbytes,
+            'ann_index': self.ann_index is not None, 'watermark': self.watermark,
+            'from_snapshot': self.loaded_from_snapshot, 'model': self.model_name,
+            'model_mismatch': self.model_mismatch,
+            'generation': self.shared_writer.generation if self.shared_writer else None,
+        }
+
+    # Đóng kết nối riêng và gỡ shared memory; không chờ lần làm mới đang chạy, nó tự đóng kết nối khi xong
+    def close(self):
+        self._closed = True
+        if self._refresh_lock.acquire(blocking=False):
+            try:
+                self._close_employees()
+            finally:
+                self._refresh_lock.release()
+        if self.shared_writer is not None:
+            self.shared_writer.close()
+            self.shared_writer = None
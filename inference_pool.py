@@ -0,0 +1,236 @@
+import itertools
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from shared_gallery import attach_segment
+
+logger = logging.getLogger(__name__)
+
+
+# Tiến trình worker: sở hữu một FaceRecognitionUtil, đọc khung hình từ slot shared memory
+def _worker_main(worker_id, model_pack, model_root, onnx_threads, max_faces, task_queue, result_queue):
+    from face_recognition_util import FaceRecognitionUtil
+    from onnx_config import OnnxRuntimeConfig
+
+    try:
+        config = OnnxRuntimeConfig.load_or_default().copy(intra_op_num_threads=onnx_threads,
+                                                          inter_op_num_threads=1)
+        recog = FaceRecognitionUtil(onnx_config=config, model_pack=model_pack, model_root=model_root)
+    except Exception as e:
+        result_queue.put(('error', worker_id, None, repr(e)))
+        return
+    result_queue.put(('ready', worker_id, None, None))
+
+    segments = {}
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+        seq, slot_name, shape, dtype = task
+        try:
+            if slot_name not in segments:
+                segments[slot_name] = attach_segment(slot_name)
+            frame = np.ndarray(shape, dtype=np.dtype(dtype), buffer=segments[slot_name].buf)
+
+            started = time.perf_counter()
+            faces = recog.detect_faces(frame)
+            faces.sort(key=lambda f: (f.bbox[2] - f.bbox[0]) * (f.bbox[3] - f.bbox[1]), reverse=True)
+            faces = faces[:max_faces]
+            detected = time.perf_counter()
+            recog.embed_faces(frame, faces)
+            embedded = time.perf_counter()
+            del frame
+
+            payload = [(face.bbox, face.kps, float(face.det_score), face.embedding) for face in faces]
+            result_queue.put(('result', worker_id, seq, (payload, detected - started, embedded - detected)))
+        except Exception as e:
+            result_queue.put(('failed', worker_id, seq, repr(e)))
+
+    for shm in segments.values():
+        shm.close()
+
+
+class InferencePool:
+    """N tiến trình worker, mỗi tiến trình một FaceRecognitionUtil, chạy detector + ArcFace song song.
+
+    Khung hình được chép vào một slot shared memory (không pickle ndarray), qua
+    hàng đợi chỉ gửi (seq, tên slot, shape, dtype). submit() trả về Future với
+    danh sách Face (bbox, kps, det_score, embedding); các Future luôn hoàn thành
+    theo đúng thứ tự submit dù worker trả kết quả lệch thứ tự. Mỗi worker dùng
+    cpu_count / num_workers luồng ONNX để các tiến trình không tranh nhau lõi.
+    Trạng thái ROI nằm trong từng worker, tính theo các khung hình worker đó nhận.
+    """
+
+    def __init__(self, num_workers=2, model_pack='buffalo_l', model_root='~/.insightface',
+                 max_frame_shape=(1080, 1920, 3), max_faces=5, onnx_threads=None):
+        self.num_workers = num_workers
+        self.max_faces = max_faces
+        self.slot_size = int(np.prod(max_frame_shape))
+        onnx_threads = onnx_threads or max(1, (os.cpu_count() or 1) // num_workers)
+
+        # spawn: không fork tiến trình đang có luồng ONNX Runtime
+        context = multiprocessing.get_context('spawn')
+        self._task_queue = context.Queue()
+        self._result_queue = context.Queue()
+
+        # Mỗi worker hai slot: một slot đang xử lý, một slot đã chép sẵn khung hình tiếp theo
+        self._slots = [shared_memory.SharedMemory(create=True, size=self.slot_size) for _ in range(num_workers * 2)]
+        self._free_slots = list(range(len(self._slots)))
+        self._slot_of = {}
+        self._slot_condition = threading.Condition()
+
+        self._seq = itertools.count(1)
+        self._futures = {}
+        self._finished = {}
+        self._next_seq = 1
+        self._lock = threading.Lock()
+        self.ready_workers = set()
+        self.error = None
+        self.stats = {'submitted': 0, 'completed': 0, 'failed': 0, 'detect_time': 0.0, 'embed_time': 0.0}
+
+        self._workers = [
+            context.Process(target=_worker_main, name=f'InferenceWorker-{i}', daemon=True,
+                            args=(i, model_pack, model_root, onnx_threads, max_faces,
+                                  self._task_queue, self._result_queue))
+            for i in range(num_workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+        self._running = True
+        self._collector = threading.Thread(target=self._collect, name='InferencePoolCollector', daemon=True)
+        self._collector.start()
+        logger.info(f"🔥 Inference pool: {num_workers} workers x {onnx_threads} ONNX threads")
+
+    @property
+    def is_ready(self):
+        return len(self.ready_workers) == self.num_workers
+
+    def wait_ready(self, timeout=None):
+        deadline = None if timeout is None else time.time() + timeout
+        while not self.is_ready and self.error is None:
+            if deadline is not None and time.time() >= deadline:
+                return False
+            time.sleep(0.05)
+        return self.is_ready
+
+    # Chép khung hình vào slot rảnh rồi giao cho worker; chờ tối đa slot_timeout nếu mọi slot đều bận
+    def submit(self, frame, slot_timeout=5.0):
+        if self.error is not None:
+            raise RuntimeError(f"Inference pool lỗi: {self.error}")
+        frame = np.ascontiguousarray(frame)
+        if frame.nbytes > self.slot_size:
+            raise ValueError(f"Khung hình {frame.shape} lớn hơn slot {self.slot_size} byte")
+
+        with self._slot_condition:
+            if not self._slot_condition.wait_for(lambda: self._free_slots, timeout=slot_timeout):
+                raise TimeoutError("Không có slot shared memory rảnh")
+            slot = self._free_slots.pop()
+        shm = self._slots[slot]
+        np.ndarray(frame.shape, dtype=frame.dtype, buffer=shm.buf)[...] = frame
+
+        future = Future()
+        with self._lock:
+            seq = next(self._seq)
+            self._futures[seq] = future
+            self._slot_of[seq] = slot
+        self._task_queue.put((seq, shm.name, frame.shape, frame.dtype.str))
+        self.stats['submitted'] += 1
+        return future
+
+    # Nhận kết quả từ worker, trả slot, hoàn thành Future theo đúng thứ tự seq
+    def _collect(self):
+        # Import muộn: chỉ tiến trình dùng pool mới phải nạp insightface
+        from insightface.app.common import Face
+        while self._running:
+            try:
+                kind, worker_id, seq, payload = self._result_queue.get(timeout=0.5)
+            except queue.Empty:
+                self._check_workers()
+                continue
+
+            if kind == 'ready':
+                self.ready_workers.add(worker_id)
+                continue
+            if kind == 'error':
+                logger.error(f"Inference worker {worker_id} failed to load: {payload}")
+                self._fail_all(payload)
+                continue
+
+            with self._slot_condition:
+                self._free_slots.append(self._slot_of.pop(seq))
+                self._slot_condition.notify()
+            if kind == 'result':
+                faces_data, detect_time, embed_time = payload
+                self.stats['detect_time'] += detect_time
+                self.stats['embed_time'] += embed_time
+                self.stats['completed'] += 1
+                faces = [Face(bbox=bbox, kps=kps, det_score=det_score, embedding=embedding)
+                         for bbox, kps, det_score, embedding in faces_data]
+                self._finish(seq, faces, None)
+            else:
+                self.stats['failed'] += 1
+                self._finish(seq, None, RuntimeError(payload))
+
+    def _finish(self, seq, result, error):
+        with self._lock:
+            if seq not in self._futures:
+                return
+            self._finished[seq] = (result, error)
+            while self._next_seq in self._finished:
+                result, error = self._finished.pop(self._next_seq)
+                future = self._futures.pop(self._next_seq)
+                if error is None:
+                    future.set_result(result)
+                else:
+                    future.set_exception(error)
+                self._next_seq += 1
+
+    # Worker chết giữa chừng thì khung hình của nó không bao giờ trả về: báo lỗi mọi Future đang chờ
+    def _check_workers(self):
+        dead = [w.name for w in self._workers if not w.is_alive()]
+        if dead and self._running and self.error is None:
+            self._fail_all(f"worker dừng bất thường: {', '.join(dead)}")
+
+    def _fail_all(self, reason):
+        self.error = reason
+        with self._lock:
+            futures, self._futures = self._futures, {}
+            self._finished.clear()
+        for future in futures.values():
+            if not future.done():
+                future.set_exception(RuntimeError(reason))
+
+    def get_statistics(self):
+        completed = max(self.stats['completed'], 1)
+        return {
+            'workers': self.num_workers, 'ready_workers': len(self.ready_workers),
+            'submitted': self.stats['submitted'], 'completed': self.stats['completed'],
+            'failed': self.stats['failed'], 'in_flight': len(self._futures),
+            'detect_ms': self.stats['detect_time'] * 1000 / completed,
+            'embed_ms': self.stats['embed_time'] * 1000 / completed,
+            'error': self.error,
+        }
+
+    def close(self, timeout=5.0):
+        self._running = False
+        for _ in self._workers:
+            self._task_queue.put(None)
+        for worker in self._workers:
+            worker.join(timeout)
+            if worker.is_alive():
+                worker.terminate()
+        self._collector.join(timeout=1)
+        self._fail_all("pool đã đóng")
+        for shm in self._slots:
+            shm.close()
+            shm.unlink()
+        self._slots = []
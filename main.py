@@ -5,7 +5,7 @@ import openpyxl
 import os
 from db.database import Database
 from ui_components import CustomTableWidget, Sidebar
-from face_recognition_util import FaceRecognitionUtil
+from model_holder import FaceModelHolder
 import time
 from camera import WebcamThread
 from camera import Camera
@@ -18,7 +18,7 @@ from PyQt5.QtWidgets import (QApplication, QWidget, QVBoxLayout, QHBoxLayout,
                              QPushButton, QLabel, QDesktopWidget, QComboBox,
                              QLineEdit, QMessageBox)
 from PyQt5.QtGui import QFont, QIcon
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, QTimer
 
 # Import other application windows/widgets that the controller manages
 from employee_attendance import EmployeeAttendanceApp
@@ -227,6 +227,9 @@ class Controller:
 
         self.main_window.show()
 
+        # Model nhận diện được nạp trên luồng nền sau khi cửa sổ chính đã hiện
+        QTimer.singleShot(0, self.face_recognizer.start)
+
     # Phương thức thống nhất để chuyển đổi và quản lý các cửa sổ
     def show_window(self, window_type, user_info=None, selected_role=None):
 
@@ -584,7 +587,14 @@ if __name__ == "__main__":
 
     # Tạo đối tượng cơ sở dữ liệu và nhận diện khuôn mặt
     db = Database()
-    face_recognizer = FaceRecognitionUtil()
+    # Gói model chọn qua biến môi trường FACE_MODEL_PACK (buffalo_l/m/s/sc hoặc thư mục model).
+    # Chưa nạp ở đây: Controller bắt đầu nạp nền khi cửa sổ chính hiện (xem FaceModelHolder)
+    # insightface (~1 s import) cũng chỉ được import trong hàm nạp này, trên luồng nền
+    def load_face_model():
+        from face_recognition_util import FaceRecognitionUtil
+        return FaceRecognitionUtil(model_pack=os.environ.get('FACE_MODEL_PACK', 'buffalo_l'))
+
+    face_recognizer = FaceModelHolder(load_face_model)
 
     # Truyền vào Controller
     controller = Controller(db, face_recognizer)
@@ -0,0 +1,91 @@
+import logging
+import threading
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class FaceModelHolder:
+    """Nạp FaceRecognitionUtil một lần, trên luồng nền, khi có người cần tới.
+
+    start() bắt đầu nạp (kiểm tra/tải gói model, tạo session ONNX) rồi tự chạy
+    warm_up; gọi nhiều lần hay từ nhiều luồng chỉ nạp một lần. Giao diện không
+    được chờ: dùng get_if_ready() (None nếu chưa xong) và add_ready_callback()
+    để được báo khi model sẵn sàng hoặc nạp lỗi. get() chặn tới khi nạp xong,
+    chỉ dành cho luồng nền và công cụ dòng lệnh.
+    """
+
+    def __init__(self, factory, warm_up=True, warm_up_shape=(480, 640, 3)):
+        self.factory = factory
+        self.warm_up = warm_up
+        self.warm_up_shape = warm_up_shape
+        self.model = None
+        self.error = None
+        self.load_time = None
+
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._thread = None
+        self._callbacks = []
+
+    @property
+    def is_loading(self):
+        return self._thread is not None and not self._done.is_set()
+
+    @property
+    def is_ready(self):
+        return self._done.is_set() and self.model is not None
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._load, name='FaceModelLoader', daemon=True)
+                self._thread.start()
+        return self
+
+    def _load(self):
+        started = time.time()
+        try:
+            model = self.factory()
+            if self.warm_up:
+                model.warm_up(np.zeros(self.warm_up_shape, dtype=np.uint8))
+            self.model = model
+            logger.info(f"🔥 Face model ready in {time.time() - started:.2f}s")
+        except Exception as e:
+            self.error = e
+            logger.error(f"Face model load error: {e}", exc_info=True)
+        self.load_time = time.time() - started
+
+        with self._lock:
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            self._notify(callback)
+
+    # callback(model, error) được gọi đúng một lần: ngay nếu đã nạp xong, nếu không thì từ luồng nạp
+    def add_ready_callback(self, callback):
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(callback)
+                return
+        self._notify(callback)
+
+    def _notify(self, callback):
+        try:
+            callback(self.model, self.error)
+        except Exception as e:
+            logger.error(f"Face model ready callback error: {e}")
+
+    def get_if_ready(self):
+        return self.model if self._done.is_set() else None
+
+    # Chặn tới khi nạp xong (tự bắt đầu nạp nếu chưa); ném lại lỗi nạp nếu có
+    def get(self, timeout=None):
+        self.start()
+        if not self._done.wait(timeout):
+            raise TimeoutError("Face model chưa nạp xong")
+        if self.error is not None:
+            raise self.error
+        return self.model
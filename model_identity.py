@@ -0,0 +1,39 @@
+import os
+
+# Embedding chỉ phụ thuộc vào model ArcFace (file ONNX nhận diện), không phụ thuộc gói hay detector:
+# buffalo_l và buffalo_m dùng chung w600k_r50, buffalo_s và buffalo_sc dùng chung w600k_mbf
+PACK_RECOGNITION_MODELS = {
+    'buffalo_l': 'w600k_r50',
+    'buffalo_m': 'w600k_r50',
+    'buffalo_s': 'w600k_mbf',
+    'buffalo_sc': 'w600k_mbf',
+    'antelopev2': 'glintr100',
+}
+
+# Bản lượng tử hóa (tools/quantize_models.py tạo <pack>_int8, giữ nguyên tên file) cho embedding
+# cùng không gian với bản fp32 gốc
+QUANTIZED_SUFFIXES = ('_int8', '_uint8', '_quant', '_fp16')
+
+# Model nhận diện đã tạo các embedding cũ chưa có cột ModelName (buffalo_l)
+LEGACY_MODEL_NAME = 'w600k_r50'
+
+
+def _strip_quantized_suffix(name):
+    for suffix in QUANTIZED_SUFFIXES:
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+    return name
+
+
+def recognition_model_name(model_file):
+    """Định danh model từ file ONNX nhận diện, ví dụ .../buffalo_l_int8/w600k_r50.onnx -> 'w600k_r50'."""
+    name = os.path.splitext(os.path.basename(model_file))[0]
+    return normalize_model_name(name)
+
+
+def normalize_model_name(name):
+    """Đưa giá trị ModelName (tên gói cũ như 'buffalo_m', bản '_int8', NULL) về định danh model nhận diện."""
+    if not name:
+        return LEGACY_MODEL_NAME
+    name = _strip_quantized_suffix(os.path.basename(os.path.normpath(name)))
+    return PACK_RECOGNITION_MODELS.get(name, name)
@@ -0,0 +1,40 @@
+import cv2
+import numpy as np
+
+
+class MotionGate:
+    """Phát hiện chuyển động rẻ bằng hiệu khung hình trên ảnh xám thu nhỏ.
+
+    Khung hình được thu về width pixel chiều ngang, làm mờ để bỏ nhiễu cảm biến
+    rồi so với khung hình nền trước đó. Có chuyển động khi tỉ lệ điểm ảnh thay
+    đổi quá pixel_threshold vượt min_changed_fraction. Nền được cập nhật dần
+    (background_rate) để ánh sáng thay đổi chậm không bị coi là chuyển động.
+    """
+
+    def __init__(self, width=160, pixel_threshold=15, min_changed_fraction=0.003, background_rate=0.2):
+        self.width = width
+        self.pixel_threshold = pixel_threshold
+        self.min_changed_fraction = min_changed_fraction
+        self.background_rate = background_rate
+        self.background = None
+        self.changed_fraction = 0.0
+
+    # Trả về True nếu khung hình khác nền đủ nhiều (khung hình đầu tiên luôn là True)
+    def update(self, frame):
+        h, w = frame.shape[:2]
+        small = cv2.resize(frame, (self.width, max(1, h * self.width // w)), interpolation=cv2.INTER_AREA)
+        gray = cv2.GaussianBlur(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY), (5, 5), 0).astype(np.float32)
+
+        if self.background is None or self.background.shape != gray.shape:
+            self.background = gray
+            self.changed_fraction = 1.0
+            return True
+
+        diff = cv2.absdiff(gray, self.background)
+        self.changed_fraction = float(np.count_nonzero(diff > self.pixel_threshold)) / diff.size
+        cv2.accumulateWeighted(gray, self.background, self.background_rate)
+        return self.changed_fraction >= self.min_changed_fraction
+
+    def reset(self):
+        self.background = None
+        self.changed_fraction = 0.0
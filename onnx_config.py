@@ -0,0 +1,186 @@
+import glob
+import hashlib
+import json
+import logging
+import os
+import platform
+
+import onnxruntime as ort
+from insightface.app import FaceAnalysis
+from insightface.model_zoo.arcface_onnx import ArcFaceONNX
+from insightface.model_zoo.retinaface import RetinaFace
+from insightface.utils.storage import ensure_available
+
+logger = logging.getLogger(__name__)
+
+# Nhận dạng vai trò model theo tên file của các gói insightface để bỏ qua model không dùng trước khi nạp
+MODEL_FILE_PREFIXES = {
+    'detection': ('det_', 'scrfd', 'retinaface'),
+    'recognition': ('w600k', 'glintr', 'glint', 'arcface', 'r50', 'r100', 'mbf'),
+    'landmark_3d_68': ('1k3d68',),
+    'landmark_2d_106': ('2d106',),
+    'genderage': ('genderage',),
+}
+# Các gói insightface tải tự động được; ngoài ra có thể truyền đường dẫn thư mục chứa file .onnx
+KNOWN_MODEL_PACKS = ('buffalo_l', 'buffalo_m', 'buffalo_s', 'buffalo_sc')
+
+
+class OnnxRuntimeConfig:
+    """Cấu hình ONNX Runtime cho các session của detector và ArcFace.
+
+    intra_op_num_threads / inter_op_num_threads = 0 để ORT tự chọn theo số lõi.
+    Nếu có optimized_model_dir, model sau khi tối ưu đồ thị được lưu lại (khóa
+    theo file model, mức tối ưu, phiên bản ORT và kiến trúc CPU); các lần khởi
+    động sau nạp thẳng bản đã tối ưu và tắt bước tối ưu lại.
+    """
+
+    EXECUTION_MODES = {
+        'sequential': ort.ExecutionMode.ORT_SEQUENTIAL,
+        'parallel': ort.ExecutionMode.ORT_PARALLEL,
+    }
+    OPTIMIZATION_LEVELS = {
+        'disabled': ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+        'basic': ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+        'extended': ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+        'all': ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+    }
+    FIELDS = ('providers', 'intra_op_num_threads', 'inter_op_num_threads', 'execution_mode',
+              'graph_optimization_level', 'enable_cpu_mem_arena', 'enable_mem_pattern', 'optimized_model_dir')
+
+    def __init__(self, providers=('CPUExecutionProvider',), intra_op_num_threads=0, inter_op_num_threads=0,
+                 execution_mode='sequential', graph_optimization_level='all', enable_cpu_mem_arena=True,
+                 enable_mem_pattern=True, optimized_model_dir='onnx_cache'):
+        if execution_mode not in self.EXECUTION_MODES:
+            raise ValueError(f"execution_mode phải là một trong {tuple(self.EXECUTION_MODES)}")
+        if graph_optimization_level not in self.OPTIMIZATION_LEVELS:
+            raise ValueError(f"graph_optimization_level phải là một trong {tuple(self.OPTIMIZATION_LEVELS)}")
+        self.providers = list(providers)
+        self.intra_op_num_threads = intra_op_num_threads
+        self.inter_op_num_threads = inter_op_num_threads
+        self.execution_mode = execution_mode
+        self.graph_optimization_level = graph_optimization_level
+        self.enable_cpu_mem_arena = enable_cpu_mem_arena
+        self.enable_mem_pattern = enable_mem_pattern
+        self.optimized_model_dir = optimized_model_dir
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+    def copy(self, **changes):
+        values = self.to_dict()
+        values.update(changes)
+        return OnnxRuntimeConfig(**values)
+
+    # Lưu/nạp cấu hình dạng JSON (tools/tune_onnx.py ghi file này)
+    def save(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding='utf-8') as f:
+            values = json.load(f)
+        return cls(**{k: v for k, v in values.items() if k in cls.FIELDS})
+
+    # Nạp file cấu hình nếu có, nếu không dùng mặc định
+    @classmethod
+    def load_or_default(cls, path='onnx_config.json'):
+        if path and os.path.exists(path):
+            try:
+                return cls.load(path)
+            except Exception as e:
+                logger.error(f"Không đọc được {path}, dùng cấu hình ONNX mặc định: {e}")
+        return cls()
+
+    def session_options(self):
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = self.intra_op_num_threads
+        options.inter_op_num_threads = self.inter_op_num_threads
+        options.execution_mode = self.EXECUTION_MODES[self.execution_mode]
+        options.graph_optimization_level = self.OPTIMIZATION_LEVELS[self.graph_optimization_level]
+        options.enable_cpu_mem_arena = self.enable_cpu_mem_arena
+        options.enable_mem_pattern = self.enable_mem_pattern
+        return options
+
+    # Đường dẫn bản đã tối ưu của model; khóa đổi khi model, mức tối ưu, ORT hoặc CPU đổi
+    def optimized_model_path(self, model_path):
+        stat = os.stat(model_path)
+        key = '|'.join([os.path.abspath(model_path), str(stat.st_size), str(int(stat.st_mtime)),
+                        self.graph_optimization_level, ort.__version__, platform.machine(),
+                        ','.join(self.providers)])
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:12]
+        name = os.path.splitext(os.path.basename(model_path))[0]
+        return os.path.join(self.optimized_model_dir, f"{name}.{digest}.opt.onnx")
+
+    # Tạo InferenceSession, dùng (hoặc tạo) bản đã tối ưu trong optimized_model_dir
+    def create_session(self, model_path):
+        options = self.session_options()
+        source = model_path
+        if self.optimized_model_dir and self.graph_optimization_level != 'disabled':
+            cached = self.optimized_model_path(model_path)
+            if os.path.exists(cached):
+                source = cached
+                options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+            else:
+                os.makedirs(self.optimized_model_dir, exist_ok=True)
+                options.optimized_model_filepath = cached
+        try:
+            return ort.InferenceSession(source, sess_options=options, providers=self.providers)
+        except Exception as e:
+            if source == model_path:
+                raise
+            # Bản tối ưu hỏng (ví dụ ghi dở): bỏ và tối ưu lại từ model gốc
+            logger.warning(f"Optimized model {source} unusable, rebuilding: {e}")
+            os.remove(source)
+            return self.create_session(model_path)
+
+
+# Đoán vai trò model theo tên file, None nếu không nhận ra
+def model_task_from_filename(model_path):
+    name = os.path.basename(model_path).lower()
+    for task, prefixes in MODEL_FILE_PREFIXES.items():
+        if name.startswith(prefixes):
+            return task
+    return None
+
+
+class TunedFaceAnalysis(FaceAnalysis):
+    """FaceAnalysis dùng OnnxRuntimeConfig cho mọi session.
+
+    FaceAnalysis gốc không truyền SessionOptions xuống model_zoo và tạo session
+    cho mọi file .onnx trong gói trước khi lọc allowed_modules. Lớp này nhận dạng
+    vai trò theo tên file và chỉ tạo session cho các module được dùng; prepare()
+    và get() giữ nguyên như FaceAnalysis.
+    """
+
+    # name: tên gói (KNOWN_MODEL_PACKS) hoặc thư mục chứa các file .onnx
+    def __init__(self, name='buffalo_l', root='~/.insightface', allowed_modules=None, config=None):
+        self.config = config or OnnxRuntimeConfig()
+        self.models = {}
+        if os.path.isdir(name):
+            self.model_dir = name
+        else:
+            if name not in KNOWN_MODEL_PACKS:
+                logger.warning(f"Gói model {name} không nằm trong {KNOWN_MODEL_PACKS}, thử tải theo tên")
+            self.model_dir = ensure_available('models', name, root=root)
+        for model_path in sorted(glob.glob(os.path.join(self.model_dir, '*.onnx'))):
+            task = model_task_from_filename(model_path)
+            if task is None or (allowed_modules is not None and task not in allowed_modules):
+                logger.info(f"Skip model {os.path.basename(model_path)} ({task or 'unknown'})")
+                continue
+            if task in self.models:
+                continue
+            session = self.config.create_session(model_path)
+            if task == 'detection':
+                self.models[task] = RetinaFace(model_file=model_path, session=session)
+            elif task == 'recognition':
+                self.models[task] = ArcFaceONNX(model_file=model_path, session=session)
+            else:
+                # Các head phụ (landmark, genderage) không có ở đây; dùng FaceAnalysis gốc nếu cần
+                logger.info(f"Skip model {os.path.basename(model_path)} ({task} not supported)")
+                continue
+            logger.info(f"Loaded {task}: {os.path.basename(model_path)}")
+
+        if 'detection' not in self.models:
+            raise RuntimeError(f"Không tìm thấy model detection trong {self.model_dir}")
+        self.det_model = self.models['detection']
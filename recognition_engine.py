@@ -0,0 +1,879 @@
+"""Lõi nhận diện không phụ thuộc Qt: đọc khung hình → detect → so khớp gallery → quyết định chấm công.
+
+Dùng từ script hoặc chạy như dịch vụ không màn hình (kiosk); WebcamThread trong
+camera.py chỉ là lớp chuyển sự kiện của engine thành tín hiệu Qt và vẽ giao diện.
+Module này không import PyQt5 hay PIL.
+
+Chạy từ thư mục gốc dự án:
+    python recognition_engine.py --source 0 --check-type "Check In"
+    python recognition_engine.py --source captured_frames --pacing fast --json
+
+Sự kiện là dict {'type', 'camera_id', 'time', ...}, nhận qua add_listener(callback)
+hoặc subscribe() (queue.Queue):
+    frame            : frame (khung hình gốc, chưa vẽ)
+    faces            : count (số khuôn mặt hợp lệ trong lượt nhận diện)
+    attendance_batch : records (danh sách bản ghi chấm công của một lượt)
+    attendance       : emp_id, message, emp_info, face_img, similarity, timestamp, check_type
+    status           : message (mở nguồn lỗi, mất tín hiệu, hết nguồn)
+    stopped          : vòng lặp đã kết thúc
+"""
+import argparse
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import wait as futures_wait
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+from face_tracker import FaceTracker, RoiState
+from frame_buffer import FrameGrabber, FrameRingBuffer
+from frame_source import PACING_MODES, open_frame_source
+from gallery_store import GalleryStore
+from inference_pool import InferencePool
+from model_identity import LEGACY_MODEL_NAME
+from motion_gate import MotionGate
+
+logger = logging.getLogger(__name__)
+
+EVENT_TYPES = ('frame', 'faces', 'attendance_batch', 'attendance', 'status', 'stopped')
+
+
+class RecognitionEngine:
+    """Nhận diện nhiều người trên một nguồn khung hình, báo kết quả qua sự kiện.
+
+    Các callback được gọi đồng bộ trên luồng phát ra sự kiện ('frame' trên luồng
+    chạy run(), còn lại trên luồng nhận diện), nên phải trả về nhanh; cần xử lý
+    lâu thì dùng subscribe() và đọc queue từ luồng khác. Queue đầy thì sự kiện
+    mới bị bỏ và được đếm trong dropped_events.
+    """
+
+    EXECUTION_MODES = ('thread', 'pool')
+
+    def __init__(self, face_recog, db, check_type, camera_id=0, gallery_store=None,
+                 snapshot_dir="gallery_snapshot", execution_mode='thread', inference_pool=None, scheduler=None,
+                 pacing='realtime'):
+        self.face_recog = face_recog
+        self.db = db
+        # camera_id: chỉ số thiết bị, file video, URL RTSP, thư mục ảnh hoặc FrameSource (xem open_frame_source);
+        # pacing 'fast' với video/thư mục ảnh: xử lý mọi khung hình nhanh nhất có thể theo thời gian trong bản ghi
+        self.camera_id = camera_id
+        self.pacing = pacing
+        self.source = None
+        self.check_type = check_type
+        self._running = True
+
+        self.frame_count = 0
+        self.fps_counter = 0
+        self.fps_time = time.time()
+        self.current_fps = 0
+
+        # Gallery được nạp từ bản chụp cục bộ rồi làm mới tăng dần trên luồng nền (xem GalleryStore)
+        self._owns_gallery = gallery_store is None
+        self.gallery_store = gallery_store or GalleryStore(
+            db, refresh_interval=30, snapshot_dir=snapshot_dir,
+            model_name=getattr(face_recog, 'model_name', LEGACY_MODEL_NAME))
+
+        self.max_concurrent_faces = 5
+        self.match_top_k = 3
+
+        # Nhiều camera dùng chung model: ROI riêng cho camera này, detector qua InferenceScheduler chung
+        self.roi_state = RoiState()
+        self.scheduler = scheduler
+
+        # Tách detection/recognition: detector chạy mỗi tick, ArcFace chỉ chạy cho track
+        # chưa có danh tính chắc chắn (hoặc đã đến hạn xác minh lại, xem FaceTracker)
+        self.split_pipeline = True
+        self.pipeline_stats = {'ticks': 0, 'faces': 0, 'embedded': 0, 'detect_time': 0.0, 'embed_time': 0.0}
+
+        self.recognition_interval = 0.1
+        self.last_recognition_time = 0
+
+        # Luồng đọc camera riêng ghi vào vòng đệm khung hình mới nhất; nhận diện và hiển thị
+        # là hai người đọc độc lập nên preview giữ FPS camera dù nhận diện chậm
+        self.threaded_capture = True
+        self.frame_buffer = None
+        self.frame_grabber = None
+        self.capture_stats = {'display_dropped': 0, 'recognition_dropped': 0, 'recognition_lag': 0.0}
+
+        # 'thread': detector + ArcFace chạy ngay trên luồng nhận diện; 'pool': giao cho các tiến trình
+        # InferencePool (mỗi tiến trình một model), nhiều khung hình được xử lý song song, kết quả theo thứ tự
+        self.execution_mode = 'thread'
+        self.inference_pool = inference_pool
+        self._owns_pool = False
+
+        # Bỏ qua detection khi cảnh trống và không có chuyển động; không thấy ai quá
+        # idle_after giây thì chuyển sang chế độ nghỉ, chỉ kiểm tra chuyển động mỗi idle_interval giây
+        self.motion_gate = MotionGate()
+        self.motion_gating = True
+        self.idle_after = 30.0
+        self.idle_interval = 0.5
+        self.is_idle = False
+        self.last_face_time = time.time()
+        self.skipped_detections = 0
+
+        self.confidence_threshold = 0.6
+        self.high_confidence = 0.7
+
+        # Danh tính được giữ theo track qua các khung hình, current_recognitions được khóa theo track_id
+        self.face_tracker = FaceTracker(reverify_interval=2.0, confident_similarity=self.high_confidence)
+
+        # Camera mở ở độ phân giải cao; detector chạy trên bản thu nhỏ (xem FaceRecognitionUtil.detect_faces)
+        self.capture_width = 1280
+        self.capture_height = 720
+
+        # Ngưỡng kích thước khuôn mặt tính theo khung hình 640 pixel chiều ngang
+        self.min_face_size = 30
+        self.max_face_size = 400
+        self.face_size_scale = 1.0
+
+        self.person_trackers = {}
+        self.attendance_cooldowns = {}
+        self.attendance_cooldown_time = 2.0
+
+        self.current_recognitions = {}
+
+        self.person_history = defaultdict(lambda: deque(maxlen=5))
+        self.person_confidence_buffer = defaultdict(lambda: deque(maxlen=3))
+
+        # Người nghe sự kiện: (callback, tập loại sự kiện hoặc None = mọi loại)
+        self._listeners = []
+        self._listeners_lock = threading.Lock()
+        self.dropped_events = 0
+        self._thread = None
+
+        # Sau cùng: set_execution_mode cần capture_width/height và max_concurrent_faces
+        if execution_mode != 'thread':
+            self.set_execution_mode(execution_mode)
+
+    # Đăng ký callback(event); events: các loại sự kiện cần nhận, None = mọi loại
+    def add_listener(self, callback, events=None):
+        unknown = set(events or ()) - set(EVENT_TYPES)
+        if unknown:
+            raise ValueError(f"Loại sự kiện không hợp lệ: {sorted(unknown)}")
+        with self._listeners_lock:
+            self._listeners.append((callback, frozenset(events) if events else None))
+        return callback
+
+    def remove_listener(self, callback):
+        with self._listeners_lock:
+            self._listeners = [(cb, events) for cb, events in self._listeners if cb is not callback]
+
+    # Nhận sự kiện qua queue.Queue thay cho callback
+    def subscribe(self, events=None, maxsize=100):
+        event_queue = queue.Queue(maxsize)
+
+        def put(event):
+            try:
+                event_queue.put_nowait(event)
+            except queue.Full:
+                self.dropped_events += 1
+
+        self.add_listener(put, events)
+        return event_queue
+
+    def _emit(self, kind, **data):
+        listeners = self._listeners
+        if not listeners:
+            return
+        event = dict(data, type=kind, camera_id=self.camera_id, time=time.time())
+        for callback, events in listeners:
+            if events is None or kind in events:
+                try:
+                    callback(event)
+                except Exception as e:
+                    logger.error(f"Recognition event listener error: {e}", exc_info=True)
+
+    # Chạy run() trên luồng nền
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._running = True
+            self._thread = threading.Thread(target=self.run, name=f'RecognitionEngine-{self.camera_id}', daemon=True)
+            self._thread.start()
+        return self
+
+    @property
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    # Vòng lặp chính, chặn tới khi stop() hoặc hết nguồn; start() chạy nó trên luồng riêng
+    def run(self):
+        try:
+            self._run()
+        finally:
+            self._emit('stopped')
+
+    def _run(self):
+        cam = self._setup_camera()
+        if not cam:
+            return
+
+        logger.info("🔥 Multi-person webcam thread started")
+
+        # Nguồn ghi sẵn chạy 'fast': không bỏ khung hình nào, mốc thời gian lấy từ bản ghi để chạy lại cho kết quả như nhau
+        if not cam.is_live and cam.pacing == 'fast':
+            self.last_face_time = 0.0
+            self.last_recognition_time = -self.recognition_interval
+            self._run_serial(cam)
+        elif self.threaded_capture:
+            self._run_threaded(cam)
+        else:
+            self._run_serial(cam)
+
+        cam.release()
+        logger.info("🔥 Multi-person webcam stopped")
+
+    # Đọc, nhận diện và phát khung hình nối tiếp trên cùng một luồng
+    def _run_serial(self, cam):
+        if self.execution_mode == 'pool' and self.inference_pool is not None and not cam.is_live:
+            self._run_serial_pool(cam)
+            self._release_failed_pool()
+        while self._running:
+            ret, frame = cam.read()
+            if not ret:
+                if not cam.is_live:
+                    self._emit('status', message="✅ Đã xử lý hết nguồn khung hình.")
+                    break
+                continue
+
+            self.frame_count += 1
+            self._update_fps()
+
+            self._recognition_tick(frame, cam.frame_time())
+
+            self._emit('frame', frame=frame)
+
+            if self.is_idle and cam.is_live:
+                time.sleep(self.idle_interval)
+
+    # Nguồn ghi sẵn ở chế độ pool: giữ tối đa num_workers khung hình đang detect, kết quả và sự kiện
+    # 'frame' theo đúng thứ tự khung hình, không bỏ khung hình nào. Dừng khi hết nguồn hoặc pool lỗi;
+    # khung hình của pool lỗi được _run_serial/_perform_multi_person_recognition xử lý lại trong luồng
+    def _run_serial_pool(self, cam):
+        pool = self.inference_pool
+        in_flight = deque()
+        # Khung hình không detect (chưa tới recognition_interval, cổng chuyển động) cũng phải chờ
+        # phát theo thứ tự; giới hạn số khung hình đọc trước để không nạp cả video vào RAM
+        max_pending = pool.num_workers * 8
+        submitted = 0
+        exhausted = False
+        while self._running and (in_flight or not exhausted):
+            while (not exhausted and submitted < pool.num_workers and len(in_flight) < max_pending
+                   and self.execution_mode == 'pool' and self._running):
+                ret, frame = cam.read()
+                if not ret:
+                    exhausted = True
+                    break
+                self.frame_count += 1
+                self._update_fps()
+                current_time = cam.frame_time()
+                future = None
+                if current_time - self.last_recognition_time >= self.recognition_interval:
+                    self.last_recognition_time = current_time
+                    if self._should_detect(frame, current_time):
+                        try:
+                            future = pool.submit(frame)
+                            submitted += 1
+                        except Exception as e:
+                            logger.error(f"Inference pool submit error: {e}")
+                            self._check_pool(pool)
+                            future = False
+                    else:
+                        self.skipped_detections += 1
+                in_flight.append((future, frame, current_time))
+            if not in_flight:
+                break
+
+            future, frame, current_time = in_flight.popleft()
+            if future is not None:
+                faces = None
+                if future is not False:
+                    submitted -= 1
+                    try:
+                        faces = future.result()
+                    except Exception as e:
+                        logger.error(f"Inference pool error: {e}")
+                        self._check_pool(pool)
+                # faces None: pool lỗi, detect lại khung hình này trong luồng
+                self._perform_multi_person_recognition(frame, current_time, faces=faces)
+                if self.current_recognitions:
+                    self.last_face_time = current_time
+            self._emit('frame', frame=frame)
+            if self.execution_mode != 'pool' and not in_flight:
+                break
+
+    # FrameGrabber đọc camera; luồng này phát mọi khung hình mới để hiển thị, luồng nền nhận diện khung hình mới nhất
+    def _run_threaded(self, cam):
+        self.frame_buffer = FrameRingBuffer(capacity=3)
+        self.frame_grabber = FrameGrabber(cam, self.frame_buffer).start()
+        recognizer = threading.Thread(target=self._recognition_loop, name='RecognitionConsumer', daemon=True)
+        recognizer.start()
+
+        last_seq = 0
+        while self._running:
+            entry = self.frame_buffer.latest(last_seq, timeout=0.5)
+            if entry is None:
+                if self.frame_buffer.closed:
+                    message = "❌ Mất tín hiệu webcam." if cam.is_live else "✅ Đã xử lý hết nguồn khung hình."
+                    self._emit('status', message=message)
+                    break
+                continue
+            seq, _, frame = entry
+            if last_seq:
+                self.capture_stats['display_dropped'] += seq - last_seq - 1
+            last_seq = seq
+
+            self.frame_count += 1
+            self._update_fps()
+
+            # Không nghỉ ở đây: chế độ nghỉ chỉ giãn nhịp nhận diện, xem trước vẫn theo FPS camera
+            self._emit('frame', frame=frame)
+
+        self._running = False
+        self.frame_grabber.stop()
+        recognizer.join(timeout=3)
+        if self._owns_pool and self.inference_pool is not None:
+            self.inference_pool.close()
+            self.inference_pool = None
+
+    # Người đọc thứ hai: mỗi recognition_interval lấy khung hình mới nhất, bỏ qua các khung hình ở giữa
+    def _recognition_loop(self):
+        last_seq = 0
+        while self._running:
+            if self.execution_mode == 'pool' and self.inference_pool is not None:
+                last_seq = self._pool_recognition_loop(last_seq)
+                self._release_failed_pool()
+                continue
+            wait = self.recognition_interval - (time.time() - self.last_recognition_time)
+            if wait > 0:
+                time.sleep(wait)
+            entry = self.frame_buffer.latest(last_seq, timeout=0.5)
+            if entry is None:
+                if self.frame_buffer.closed:
+                    break
+                continue
+            seq, captured_at, frame = entry
+            if last_seq:
+                self.capture_stats['recognition_dropped'] += seq - last_seq - 1
+            last_seq = seq
+
+            current_time = time.time()
+            try:
+                self._recognition_tick(frame, current_time)
+            except Exception as e:
+                logger.error(f"Recognition consumer error: {e}", exc_info=True)
+            self.capture_stats['recognition_lag'] = time.time() - captured_at
+
+            if self.is_idle:
+                time.sleep(self.idle_interval)
+
+    # Chế độ pool: giữ tối đa num_workers khung hình đang xử lý, xử lý kết quả theo đúng thứ tự nộp
+    def _pool_recognition_loop(self, last_seq):
+        pool = self.inference_pool
+        in_flight = deque()
+        while True:
+            active = self._running and self.execution_mode == 'pool'
+            if not active and not in_flight:
+                return last_seq
+
+            current_time = time.time()
+            if (active and len(in_flight) < pool.num_workers
+                    and current_time - self.last_recognition_time >= self.recognition_interval):
+                entry = self.frame_buffer.latest(last_seq, timeout=0 if in_flight else 0.5)
+                if entry is not None:
+                    seq, captured_at, frame = entry
+                    if last_seq:
+                        self.capture_stats['recognition_dropped'] += seq - last_seq - 1
+                    last_seq = seq
+                    self.last_recognition_time = current_time
+                    if self._should_detect(frame, current_time):
+                        try:
+                            in_flight.append((pool.submit(frame), frame, captured_at))
+                        except Exception as e:
+                            logger.error(f"Inference pool submit error: {e}")
+                            self._check_pool(pool)
+                    else:
+                        self.skipped_detections += 1
+                    continue
+                if self.frame_buffer.closed and not in_flight:
+                    return last_seq
+
+            if not in_flight:
+                if self.is_idle:
+                    time.sleep(self.idle_interval)
+                else:
+                    time.sleep(0.002)
+                continue
+            future, frame, captured_at = in_flight[0]
+            # Worker còn rảnh thì chỉ chờ ngắn để kịp nộp khung hình tiếp theo
+            full = not active or len(in_flight) >= pool.num_workers
+            futures_wait([future], timeout=0.5 if full else 0.002)
+            if not future.done():
+                continue
+            in_flight.popleft()
+            try:
+                faces = future.result()
+            except Exception as e:
+                logger.error(f"Inference pool error: {e}")
+                self._check_pool(pool)
+                continue
+            current_time = time.time()
+            self._perform_multi_person_recognition(frame, current_time, faces=faces)
+            if self.current_recognitions:
+                self.last_face_time = current_time
+            self.capture_stats['recognition_lag'] = time.time() - captured_at
+
+    # Pool hỏng hẳn (worker chết, nạp model lỗi) thì mọi submit sau đó đều lỗi:
+    # quay về chạy detector + ArcFace trong luồng và báo cho giao diện/CLI
+    def _check_pool(self, pool):
+        if pool.error is None or self.execution_mode != 'pool':
+            return
+        logger.error(f"Inference pool failed ({pool.error}), falling back to thread mode")
+        self.execution_mode = 'thread'
+        self._emit('status', message="⚠️ Inference pool lỗi, chuyển sang nhận diện trong luồng.")
+
+    # Đóng pool đã hỏng do engine tự tạo; set_execution_mode('pool') sẽ tạo pool mới
+    def _release_failed_pool(self):
+        pool = self.inference_pool
+        if pool is not None and pool.error is not None and self.execution_mode == 'thread':
+            if self._owns_pool:
+                pool.close()
+            self.inference_pool = None
+            self._owns_pool = False
+
+    # Chuyển giữa chạy trong luồng và chạy trên InferencePool; pool được tạo nếu chưa có
+    def set_execution_mode(self, mode, num_workers=2):
+        if mode not in self.EXECUTION_MODES:
+            raise ValueError(f"execution_mode phải là một trong {self.EXECUTION_MODES}")
+        if mode == 'pool' and self.inference_pool is None:
+            self.inference_pool = InferencePool(
+                num_workers=num_workers,
+                model_pack=getattr(self.face_recog, 'model_pack', 'buffalo_l'),
+                model_root=getattr(self.face_recog, 'model_root', '~/.insightface'),
+                max_frame_shape=(max(self.capture_height, 1080), max(self.capture_width, 1920), 3),
+                max_faces=self.max_concurrent_faces)
+            self._owns_pool = True
+        self.execution_mode = mode
+        logger.info(f"🔥 Execution mode: {mode}")
+
+    # Một lượt nhận diện nếu đã đến hạn recognition_interval
+    def _recognition_tick(self, frame, current_time):
+        if current_time - self.last_recognition_time < self.recognition_interval:
+            return
+        if self._should_detect(frame, current_time):
+            self._perform_multi_person_recognition(frame, current_time)
+            if self.current_recognitions:
+                self.last_face_time = current_time
+        else:
+            self.skipped_detections += 1
+        self.last_recognition_time = current_time
+
+    # Cổng chuyển động: chỉ detect khi có chuyển động hoặc vẫn còn người trong khung hình
+    def _should_detect(self, frame, current_time):
+        if not self.motion_gating:
+            return True
+
+        motion = self.motion_gate.update(frame)
+        if self.is_idle:
+            if not motion:
+                return False
+            self.is_idle = False
+            self.last_face_time = current_time
+            logger.info("🔥 Motion detected, leaving idle mode")
+            return True
+
+        if self.current_recognitions or motion:
+            return True
+        if current_time - self.last_face_time >= self.idle_after:
+            self.is_idle = True
+            self.face_tracker.clear()
+            logger.info(f"🔥 No faces for {self.idle_after:.0f}s, entering idle mode")
+        return False
+
+    # Bật/tắt cổng chuyển động và chế độ nghỉ
+    def set_motion_gating(self, enabled=True, idle_after=30.0, idle_interval=0.5):
+        self.motion_gating = enabled
+        self.idle_after = idle_after
+        self.idle_interval = idle_interval
+        self.is_idle = False
+        self.motion_gate.reset()
+        logger.info(f"🔥 Motion gating {'enabled' if enabled else 'disabled'}, idle after {idle_after}s")
+
+    # Hàm thiết lập camera
+    def _setup_camera(self):
+        try:
+            cam = open_frame_source(self.camera_id, pacing=self.pacing)
+        except (FileNotFoundError, ValueError) as e:
+            logger.error(f"Frame source error: {e}")
+            cam = None
+        if cam is None or not cam.isOpened():
+            self._emit('status', message="❌ Không mở được webcam.")
+            return None
+        if cam.is_device:
+            cam.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+            cam.set(cv2.CAP_PROP_FPS, 30)
+            cam.set(cv2.CAP_PROP_FRAME_WIDTH, self.capture_width)
+            cam.set(cv2.CAP_PROP_FRAME_HEIGHT, self.capture_height)
+        self.source = cam
+        # Camera có thể không hỗ trợ độ phân giải yêu cầu, dùng kích thước thực tế
+        actual_width = cam.get(cv2.CAP_PROP_FRAME_WIDTH) or 640
+        self.face_size_scale = actual_width / 640.0
+        logger.info(f"🔥 Camera {actual_width:.0f}x{cam.get(cv2.CAP_PROP_FRAME_HEIGHT):.0f}")
+        return cam
+
+    # Cập nhật số khung hình/giây (FPS)
+    def _update_fps(self):
+        self.fps_counter += 1
+        current_time = time.time()
+        if current_time - self.fps_time >= 1.0:
+            self.current_fps = self.fps_counter
+            self.fps_counter = 0
+            self.fps_time = current_time
+
+    # Nhận diện nhiều khuôn mặt trong cùng một khung hình
+    # faces: kết quả detector + ArcFace đã có sẵn (từ InferencePool), nếu None thì detect tại đây
+    def _perform_multi_person_recognition(self, frame, current_time, faces=None):
+
+        self.gallery_store.maybe_refresh(current_time)
+
+        faces = self._detect_multiple_faces(frame) if faces is None else self._filter_faces(faces)
+        if not faces:
+            self.face_tracker.update([], current_time)
+            self._emit('faces', count=0)
+            # Gán dict mới thay vì clear(): luồng hiển thị có thể đang duyệt dict cũ
+            self.current_recognitions = {}
+            return
+
+        self._emit('faces', count=len(faces))
+
+        new_recognitions = {}
+        attendance_batch = []
+
+        faces = faces[:self.max_concurrent_faces]
+        tracks = self.face_tracker.update([face.bbox for face in faces], current_time)
+        recognition_results = self._recognize_tracked_faces(frame, faces, tracks, current_time)
+
+        for face, track, recognition_result in zip(faces, tracks, recognition_results):
+            track_id = track.track_id
+
+            if recognition_result:
+                emp_id, similarity, bbox, face_img = recognition_result
+                emp_info = self.db.employees.get_employee_info(emp_id)
+
+                if emp_info:
+                    new_recognitions[track_id] = {
+                        'emp_id': emp_id, 'name': emp_info[1], 'similarity': similarity,
+                        'bbox': bbox, 'face_img': face_img, 'emp_info': emp_info, 'is_unknown': False,
+                        'track_id': track.track_id, 'verified_at': track.verified_at
+                    }
+                    if self._should_process_attendance(emp_id, similarity, current_time):
+                        attendance_info = self._process_individual_attendance(
+                            emp_id, similarity, face_img, emp_info, current_time)
+                        if attendance_info:
+                            attendance_batch.append(attendance_info)
+            else:
+                try:
+                    x1, y1, x2, y2 = [int(i) for i in face.bbox]
+                    h, w, _ = frame.shape
+                    x1, y1, x2, y2 = max(0, x1), max(0, y1), min(w, x2), min(h, y2)
+                    if x2 > x1 and y2 > y1:
+                        face_img = frame[y1:y2, x1:x2].copy()
+                        if face_img.size > 0:
+                            new_recognitions[track_id] = {
+                                'emp_id': None, 'name': 'Chưa đăng ký', 'similarity': 0.0,
+                                'bbox': face.bbox, 'face_img': face_img, 'emp_info': None, 'is_unknown': True,
+                                'track_id': track.track_id, 'verified_at': track.verified_at
+                            }
+                except Exception as e:
+                    logger.error(f"Error processing unknown face {track_id}: {e}")
+
+        self.current_recognitions = new_recognitions
+        if attendance_batch:
+            self._emit('attendance_batch', records=attendance_batch)
+            for att_info in attendance_batch:
+                self._emit('attendance', **att_info)
+
+    def _detect_multiple_faces(self, frame):
+        try:
+            started = time.perf_counter()
+            if self.execution_mode == 'pool' and self.inference_pool is not None:
+                pool = self.inference_pool
+                try:
+                    faces = pool.submit(frame).result(timeout=10)
+                except Exception:
+                    # Pool hỏng hẳn thì chuyển sang luồng và detect lại khung hình này ngay
+                    self._check_pool(pool)
+                    if self.execution_mode == 'pool':
+                        raise
+                    return self._detect_multiple_faces(frame)
+            elif self.scheduler is not None:
+                faces = self.scheduler.detect(self.camera_id, frame, self.roi_state, timeout=10)
+            elif self.split_pipeline:
+                faces = self.face_recog.detect_faces(frame, roi_state=self.roi_state)
+            else:
+                faces = self.face_recog.face_app.get(frame)
+            self.pipeline_stats['detect_time'] += time.perf_counter() - started
+            return self._filter_faces(faces)
+        except Exception as e:
+            logger.error(f"Multi-face detection error: {e}")
+            return []
+
+    # Lọc theo kích thước khuôn mặt, giữ tối đa max_concurrent_faces khuôn mặt lớn nhất
+    def _filter_faces(self, faces):
+        try:
+            self.pipeline_stats['ticks'] += 1
+            if not faces: return []
+
+            valid_faces = []
+            for face in faces:
+                bbox = face.bbox
+                width, height = bbox[2] - bbox[0], bbox[3] - bbox[1]
+                width, height = width / self.face_size_scale, height / self.face_size_scale
+                if self.min_face_size <= width <= self.max_face_size and self.min_face_size <= height <= self.max_face_size:
+                    valid_faces.append(face)
+
+            valid_faces.sort(key=lambda f: (f.bbox[2] - f.bbox[0]) * (f.bbox[3] - f.bbox[1]), reverse=True)
+            return valid_faces[:self.max_concurrent_faces]
+        except Exception as e:
+            logger.error(f"Multi-face detection error: {e}")
+            return []
+
+    # Lấy embedding đã chuẩn hóa của khuôn mặt (nếu có)
+    def _get_face_embedding(self, face):
+        if hasattr(face, 'normed_embedding') and face.normed_embedding is not None:
+            return face.normed_embedding
+        if hasattr(face, 'embedding') and face.embedding is not None:
+            return face.embedding
+        return None
+
+    # Cắt ảnh khuôn mặt theo bbox, trả về None nếu bbox nằm ngoài khung hình
+    def _crop_face(self, frame, bbox):
+        x1, y1, x2, y2 = [int(i) for i in bbox]
+        h, w, _ = frame.shape
+        x1, y1, x2, y2 = max(0, x1), max(0, y1), min(w, x2), min(h, y2)
+        if x2 <= x1 or y2 <= y1: return None
+        face_img = frame[y1:y2, x1:x2].copy()
+        if face_img.size == 0: return None
+        return face_img
+
+    # Nhận diện mọi khuôn mặt trong khung hình bằng một lần GEMM với gallery
+    def _recognize_faces(self, frame, faces):
+        results = [None] * len(faces)
+        matcher = self.gallery_store.matcher
+        if not faces or len(matcher) == 0:
+            return results
+
+        try:
+            embeddings = [self._get_face_embedding(face) for face in faces]
+            ids, scores = matcher.match_batch(embeddings, top_k=self.match_top_k)
+
+            for face_idx, face in enumerate(faces):
+                if embeddings[face_idx] is None:
+                    logger.warning(f"Face {face_idx}: No valid embedding found.")
+                    continue
+                best_match, best_similarity = ids[face_idx, 0], float(scores[face_idx, 0])
+                if best_match is None or best_similarity < self.confidence_threshold:
+                    continue
+                face_img = self._crop_face(frame, face.bbox)
+                if face_img is None:
+                    continue
+                results[face_idx] = (best_match, best_similarity, face.bbox, face_img)
+        except Exception as e:
+            logger.error(f"Multi-face recognition error: {e}", exc_info=True)
+        return results
+
+    # Dùng lại danh tính của track, chỉ nhận diện track chưa chắc chắn hoặc đến hạn xác minh lại
+    def _recognize_tracked_faces(self, frame, faces, tracks, current_time):
+        results = [None] * len(faces)
+        pending = []
+        for face_idx, (face, track) in enumerate(zip(faces, tracks)):
+            if self.face_tracker.needs_embedding(track, current_time):
+                pending.append(face_idx)
+            elif track.has_identity:
+                face_img = self._crop_face(frame, face.bbox)
+                if face_img is not None:
+                    results[face_idx] = (track.emp_id, track.similarity, face.bbox, face_img)
+
+        self.pipeline_stats['faces'] += len(faces)
+        if not pending:
+            return results
+
+        pending_faces = [faces[i] for i in pending]
+        # Khuôn mặt từ InferencePool đã có embedding
+        to_embed = [face for face in pending_faces if face.embedding is None]
+        if self.split_pipeline and to_embed:
+            started = time.perf_counter()
+            self.face_recog.embed_faces(frame, to_embed)
+            self.pipeline_stats['embed_time'] += time.perf_counter() - started
+        self.pipeline_stats['embedded'] += len(pending)
+
+        for face_idx, result in zip(pending, self._recognize_faces(frame, pending_faces)):
+            results[face_idx] = result
+            emp_id, similarity = (result[0], result[1]) if result else (None, 0.0)
+            self.face_tracker.assign_identity(tracks[face_idx], emp_id, similarity, current_time)
+        return results
+
+    def _recognize_single_face(self, frame, face, face_idx):
+        try:
+            return self._recognize_faces(frame, [face])[0]
+        except Exception as e:
+            logger.error(f"Single face recognition error: {e}", exc_info=True)
+            return None
+
+    def _should_process_attendance(self, emp_id, similarity, current_time):
+        if similarity >= self.high_confidence: return True
+        if emp_id in self.attendance_cooldowns and current_time - self.attendance_cooldowns[
+            emp_id] < self.attendance_cooldown_time:
+            return False
+        self.person_confidence_buffer[emp_id].append(similarity)
+        if len(self.person_confidence_buffer[emp_id]) >= 3:
+            return np.mean(list(self.person_confidence_buffer[emp_id])) >= self.confidence_threshold
+        return False
+
+    def _process_individual_attendance(self, emp_id, similarity, face_img, emp_info, current_time):
+        try:
+            success = self.db.attendance.log_attendance(emp_id, self.check_type, face_img, similarity)
+            if success:
+                self.attendance_cooldowns[emp_id] = current_time
+                self.person_confidence_buffer[emp_id].clear()
+                action = "Vào" if self.check_type == 'Check In' else "Ra"
+                message = f"✅ {action}: {emp_info[1]} - {similarity:.0%}"
+                logger.info(f"🔥 Multi-person attendance: {emp_id} - {similarity:.3f} - {self.check_type}")
+                return {'emp_id': emp_id, 'message': message, 'emp_info': emp_info, 'face_img': face_img,
+                        'similarity': similarity, 'timestamp': current_time, 'check_type': self.check_type}
+            else:
+                return {'emp_id': emp_id, 'message': f"❌ Lỗi: {emp_info[1]}", 'emp_info': None,
+                        'face_img': None, 'similarity': similarity, 'timestamp': current_time}
+        except Exception as e:
+            logger.error(f"Individual attendance error: {e}")
+            return None
+
+    # Bật chỉ mục ANN cho gallery lớn; n_probe càng lớn recall càng cao nhưng chậm hơn
+    def set_ann_mode(self, min_gallery_size=50000, n_probe=8, index_path=None):
+        self.gallery_store.set_ann_mode(min_gallery_size, n_probe, index_path)
+
+    def set_pca_mode(self, min_gallery_size=50000, n_components=128, shortlist=100, basis_path=None):
+        self.gallery_store.set_pca_mode(min_gallery_size, n_components, shortlist, basis_path)
+
+    # Yêu cầu dừng; chờ tối đa timeout giây nếu engine chạy bằng start()
+    def stop(self, timeout=3.0):
+        logger.info("🔥 Stopping multi-person thread...")
+        self._running = False
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+    # Dừng rồi giải phóng gallery và InferencePool do engine tự tạo
+    def close(self):
+        self.stop()
+        if self._owns_pool and self.inference_pool is not None:
+            self.inference_pool.close()
+            self.inference_pool = None
+        if self._owns_gallery:
+            self.gallery_store.close()
+
+    def update_check_type(self, check_type):
+        self.check_type = check_type
+
+    def clear_cache(self):
+        self.gallery_store.clear()
+        self.attendance_cooldowns.clear()
+        self.current_recognitions = {}
+        self.face_tracker.clear()
+        self.roi_state.clear()
+        self.person_confidence_buffer.clear()
+        self.person_history.clear()
+        logger.info("🔥 All caches cleared")
+
+    def set_multi_person_mode(self, max_faces=5, cooldown=2.0):
+        self.max_concurrent_faces = max_faces
+        self.attendance_cooldown_time = cooldown
+        logger.info(f"🔥 Multi-person mode: {max_faces} faces, {cooldown}s cooldown")
+
+    def get_statistics(self):
+        gallery_stats = self.gallery_store.get_statistics()
+        stats = self.pipeline_stats
+        ticks = max(stats['ticks'], 1)
+        return {
+            'total_frames': self.frame_count, 'current_fps': self.current_fps,
+            'cached_faces': gallery_stats['employees'], 'cached_templates': gallery_stats['templates'],
+            'current_recognitions': len(self.current_recognitions),
+            'active_cooldowns': len(self.attendance_cooldowns), 'max_concurrent_faces': self.max_concurrent_faces,
+            'ann_index': gallery_stats['ann_index'], 'mode': 'multi_person_fast',
+            'split_pipeline': self.split_pipeline, 'tracks': len(self.face_tracker),
+            'idle': self.is_idle, 'skipped_detections': self.skipped_detections,
+            'detect_ms_per_tick': stats['detect_time'] * 1000 / ticks,
+            'embed_ms_per_tick': stats['embed_time'] * 1000 / ticks,
+            'embedded_ratio': stats['embedded'] / stats['faces'] if stats['faces'] else 0.0,
+            'threaded_capture': self.threaded_capture,
+            'capture_fps': self.frame_grabber.fps if self.frame_grabber else self.current_fps,
+            'grabbed_frames': self.frame_grabber.stats['grabbed'] if self.frame_grabber else self.frame_count,
+            'read_failures': self.frame_grabber.stats['failures'] if self.frame_grabber else 0,
+            'display_dropped': self.capture_stats['display_dropped'],
+            'recognition_dropped': self.capture_stats['recognition_dropped'],
+            'recognition_lag_ms': self.capture_stats['recognition_lag'] * 1000,
+            'execution_mode': self.execution_mode, 'pacing': self.pacing,
+            'inference_pool': self.inference_pool.get_statistics() if self.inference_pool else None
+        }
+
+    def get_current_recognitions(self):
+        return dict(self.current_recognitions)
+
+
+# Một dòng log cho sự kiện: JSON (bỏ ảnh và khung hình) hoặc văn bản
+def format_event(event, as_json=False):
+    if as_json:
+        emp_info = event.get('emp_info')
+        data = {key: value for key, value in event.items()
+                if key not in ('frame', 'face_img', 'emp_info', 'records')}
+        if emp_info:
+            data['name'] = emp_info[1]
+        return json.dumps(data, ensure_ascii=False, default=str)
+    stamp = datetime.fromtimestamp(event['time']).strftime('%Y-%m-%d %H:%M:%S')
+    return f"{stamp} [{event['camera_id']}] {event.get('message', event['type'])}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--source', default='0', help='chỉ số camera, file video, URL RTSP hoặc thư mục ảnh')
+    parser.add_argument('--check-type', default='Check In', choices=['Check In', 'Check Out'])
+    parser.add_argument('--pacing', default='realtime', choices=PACING_MODES)
+    parser.add_argument('--model-pack', default=os.environ.get('FACE_MODEL_PACK', 'buffalo_l'))
+    parser.add_argument('--execution-mode', default='thread', choices=RecognitionEngine.EXECUTION_MODES)
+    parser.add_argument('--max-faces', type=int, default=5)
+    parser.add_argument('--json', action='store_true', help='in sự kiện dạng JSON, mỗi dòng một sự kiện')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    from db.database import Database
+    from face_recognition_util import FaceRecognitionUtil
+
+    engine = RecognitionEngine(FaceRecognitionUtil(model_pack=args.model_pack), Database(), args.check_type,
+                               camera_id=args.source, execution_mode=args.execution_mode, pacing=args.pacing)
+    engine.set_multi_person_mode(max_faces=args.max_faces, cooldown=engine.attendance_cooldown_time)
+    events = engine.subscribe(events=('attendance', 'status', 'stopped'))
+    engine.start()
+
+    try:
+        while True:
+            event = events.get()
+            if event['type'] == 'stopped':
+                break
+            print(format_event(event, args.json), flush=True)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        engine.close()
+
+    stats = engine.get_statistics()
+    print(f"Frames: {stats['total_frames']}, detect {stats['detect_ms_per_tick']:.1f} ms/tick, "
+          f"embed {stats['embed_ms_per_tick']:.1f} ms/tick, skipped detections {stats['skipped_detections']}")
+
+
+if __name__ == '__main__':
+    main()
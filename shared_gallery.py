@@ -0,0 +1,241 @@
+import json
+import logging
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from face_gallery import FaceGallery
+
+logger = logging.getLogger(__name__)
+
+# Khối điều khiển: [seq, generation, độ dài tên] (int64) + tên segment dữ liệu hiện hành
+CONTROL_SIZE = 128
+CONTROL_NAME_OFFSET = 32
+ALIGNMENT = 64
+GALLERY_ARRAYS = ('matrix', 'scales', 'template_ids', 'row_employee', 'employee_ids', 'offsets')
+_attach_lock = threading.Lock()
+
+
+# Gắn vào segment có sẵn mà không để resource_tracker của tiến trình đọc xóa nó khi thoát
+def attach_segment(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13 không có tham số track: tạm bỏ đăng ký với resource_tracker trong lúc gắn
+        with _attach_lock:
+            register = resource_tracker.register
+            resource_tracker.register = lambda *args, **kwargs: None
+            try:
+                return shared_memory.SharedMemory(name=name)
+            finally:
+                resource_tracker.register = register
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+class SharedGalleryWriter:
+    """Tiến trình ghi duy nhất công bố gallery vào shared memory cho nhiều tiến trình đọc.
+
+    Mỗi thế hệ gallery nằm trong một segment riêng (không bao giờ bị sửa sau khi
+    công bố). Khối điều khiển chứa số thế hệ hiện hành, được cập nhật theo kiểu
+    seqlock: seq lẻ trong lúc ghi, chẵn khi xong. Tiến trình đọc chỉ cần đọc lại
+    seq/generation ở mỗi lần tra cứu, không có khóa trên đường nóng.
+    """
+
+    KEEP_GENERATIONS = 2
+
+    def __init__(self, name='face_gallery'):
+        self.name = name
+        self.generation = 0
+        self._segments = []
+        try:
+            self._control = shared_memory.SharedMemory(name=f"{name}_ctl", create=True, size=CONTROL_SIZE)
+        except FileExistsError:
+            # Segment còn sót lại từ lần chạy trước bị tắt đột ngột
+            self._control = attach_segment(f"{name}_ctl")
+            self.generation = int(np.ndarray((3,), dtype=np.int64, buffer=self._control.buf)[1])
+        self._header = np.ndarray((3,), dtype=np.int64, buffer=self._control.buf)
+
+    # Ghi gallery vào segment mới rồi chuyển khối điều khiển sang thế hệ đó
+    def publish(self, gallery, watermark=None):
+        arrays = {k: getattr(gallery, k) for k in GALLERY_ARRAYS if getattr(gallery, k) is not None}
+        layout = {
+            'dim': gallery.dim, 'reduce': gallery.reduce, 'storage': gallery.storage,
+            'rerank_k': gallery.rerank_k, 'watermark': None if watermark is None else
+            [watermark[0], str(watermark[1]) if watermark[1] else None, watermark[2]],
+            'arrays': {},
+        }
+        # Tính vị trí từng mảng trước, sau đó mới biết kích thước phần header JSON
+        offset = 0
+        for key, array in arrays.items():
+            layout['arrays'][key] = [offset, array.dtype.str, list(array.shape)]
+            offset = _align(offset + array.nbytes)
+        data_size = offset
+        layout_bytes = json.dumps(layout).encode('utf-8')
+        data_start = _align(8 + len(layout_bytes))
+
+        generation = self.generation + 1
+        segment_name = f"{self.name}_g{generation}"
+        try:
+            shm = shared_memory.SharedMemory(name=segment_name, create=True, size=max(1, data_start + data_size))
+        except FileExistsError:
+            stale = attach_segment(segment_name)
+            stale.close()
+            stale.unlink()
+            shm = shared_memory.SharedMemory(name=segment_name, create=True, size=max(1, data_start + data_size))
+
+        np.ndarray((1,), dtype=np.int64, buffer=shm.buf)[0] = data_start
+        shm.buf[8:8 + len(layout_bytes)] = layout_bytes
+        for key, array in arrays.items():
+            start = data_start + layout['arrays'][key][0]
+            view = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf, offset=start)
+            view[...] = array
+
+        self._set_current(generation, segment_name)
+        self.generation = generation
+        self._segments.append(shm)
+        self._release_old_segments()
+        logger.info(f"🔥 Shared gallery generation {generation}: {len(gallery)} templates, "
+                    f"{(data_start + data_size) / 1024 / 1024:.1f} MB")
+        return generation
+
+    # Seqlock: seq lẻ báo cho tiến trình đọc biết khối điều khiển đang được ghi
+    def _set_current(self, generation, segment_name):
+        name_bytes = segment_name.encode('utf-8')
+        self._header[0] += 1
+        self._header[1] = generation
+        self._header[2] = len(name_bytes)
+        self._control.buf[CONTROL_NAME_OFFSET:CONTROL_NAME_OFFSET + len(name_bytes)] = name_bytes
+        self._header[0] += 1
+
+    # Gỡ các thế hệ cũ; tiến trình đọc đang giữ chúng vẫn dùng được tới khi tự đóng
+    def _release_old_segments(self):
+        while len(self._segments) > self.KEEP_GENERATIONS:
+            shm = self._segments.pop(0)
+            shm.close()
+            shm.unlink()
+
+    def close(self):
+        for shm in self._segments:
+            shm.close()
+            shm.unlink()
+        self._segments = []
+        del self._header
+        self._control.close()
+        self._control.unlink()
+
+
+class SharedGalleryReader:
+    """Tiến trình đọc gắn zero-copy vào gallery do SharedGalleryWriter công bố.
+
+    Cùng giao diện với GalleryStore (matcher, maybe_refresh, get_statistics) nên có
+    thể truyền thẳng vào WebcamThread(gallery_store=...). Ma trận là view trực tiếp
+    trên shared memory, không sao chép; khi thấy thế hệ mới, gallery mới được dựng
+    trên segment mới và thay bằng một phép gán tham chiếu.
+    """
+
+    def __init__(self, name='face_gallery', reduce=None, attach_timeout=10.0):
+        self.name = name
+        self.reduce = reduce
+        self.gallery = FaceGallery(reduce=reduce or 'max')
+        self.generation = 0
+        self.watermark = None
+        self._segments = []
+
+        deadline = time.time() + attach_timeout
+        while True:
+            try:
+                self._control = attach_segment(f"{name}_ctl")
+                break
+            except FileNotFoundError:
+                if time.time() >= deadline:
+                    raise
+                time.sleep(0.1)
+        self._header = np.ndarray((3,), dtype=np.int64, buffer=self._control.buf)
+        self.maybe_refresh()
+
+    # Chỉ đọc hai số nguyên trên đường nóng; chỉ gắn segment khi thế hệ thay đổi
+    @property
+    def matcher(self):
+        if self._header[1] != self.generation:
+            self.maybe_refresh()
+        return self.gallery
+
+    # Đọc (generation, tên segment) nhất quán theo seqlock
+    def _read_current(self):
+        while True:
+            seq = int(self._header[0])
+            if seq % 2:
+                time.sleep(0)
+                continue
+            generation = int(self._header[1])
+            length = int(self._header[2])
+            name = bytes(self._control.buf[CONTROL_NAME_OFFSET:CONTROL_NAME_OFFSET + length]).decode('utf-8')
+            if int(self._header[0]) == seq:
+                return generation, name
+
+    def maybe_refresh(self, current_time=None):
+        generation, segment_name = self._read_current()
+        if generation == 0 or generation == self.generation:
+            return False
+        try:
+            shm = attach_segment(segment_name)
+        except FileNotFoundError:
+            # Thế hệ đã bị thay tiếp trong lúc đọc, lần sau thử lại
+            return False
+
+        data_start = int(np.ndarray((1,), dtype=np.int64, buffer=shm.buf)[0])
+        layout = json.loads(bytes(shm.buf[8:data_start]).rstrip(b'\0').decode('utf-8'))
+        gallery = FaceGallery(dim=layout['dim'], reduce=self.reduce or layout['reduce'],
+                              storage=layout['storage'], rerank_k=layout['rerank_k'])
+        for key, (offset, dtype, shape) in layout['arrays'].items():
+            array = np.ndarray(tuple(shape), dtype=np.dtype(dtype), buffer=shm.buf, offset=data_start + offset)
+            array.flags.writeable = False
+            setattr(gallery, key, array)
+
+        self.gallery = gallery
+        self.generation = generation
+        self.watermark = layout['watermark']
+        self._segments.append(shm)
+        self._release_old_segments()
+        return True
+
+    # Segment cũ chỉ đóng được khi không còn view nào trỏ vào (luồng khác có thể vẫn đang tra cứu)
+    def _release_old_segments(self):
+        remaining = []
+        for shm in self._segments[:-1]:
+            try:
+                shm.close()
+            except BufferError:
+                remaining.append(shm)
+        self._segments = remaining + self._segments[-1:]
+
+    # Tiến trình ghi sở hữu việc làm mới; tiến trình đọc chỉ cần thả thế hệ hiện tại
+    def clear(self):
+        self.generation = 0
+
+    def set_ann_mode(self, *args, **kwargs):
+        logger.warning("Shared gallery chưa hỗ trợ chỉ mục ANN, dùng quét toàn bộ")
+
+    def get_statistics(self):
+        gallery = self.gallery
+        return {
+            'employees': gallery.num_employees, 'templates': len(gallery),
+            'storage': gallery.storage, 'gallery_bytes': gallery.nbytes,
+            'ann_index': False, 'watermark': self.watermark, 'generation': self.generation,
+        }
+
+    def close(self):
+        self.gallery = FaceGallery(reduce=self.reduce or 'max')
+        for shm in self._segments:
+            try:
+                shm.close()
+            except BufferError:
+                pass
+        self._segments = []
+        del self._header
+        self._control.close()
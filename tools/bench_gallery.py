@@ -0,0 +1,201 @@
+"""Đo bộ nhớ, độ trễ và độ chính xác của FaceGallery theo kiểu lưu trữ.
+
+Chạy từ thư mục gốc dự án:
+    python -m tools.bench_gallery --size 100000
+    python -m tools.bench_gallery --from-db
+    python -m tools.bench_gallery --codec --size 20000
+    python -m tools.bench_gallery --select
+"""
+import argparse
+import contextlib
+import io
+import sys
+import time
+
+import numpy as np
+
+from db.encoding_codec import decode_embedding, encode_embedding, encode_embedding_text
+from face_gallery import FaceGallery
+
+
+# Gallery tổng hợp: mỗi nhân viên một "danh tính" ngẫu nhiên, template là bản nhiễu của nó
+def synthetic_rows(size, templates_per_employee=1, dim=512, seed=0):
+    rng = np.random.default_rng(seed)
+    identities = rng.normal(size=(size, dim)).astype(np.float32)
+    rows = []
+    for emp_id in range(size):
+        for t in range(templates_per_employee):
+            noise = rng.normal(scale=0.3, size=dim).astype(np.float32)
+            rows.append((len(rows), emp_id, identities[emp_id] + noise))
+    return rows
+
+
+def load_db_rows():
+    from db.database import Database
+    db = Database()
+    try:
+        return db.employees.get_all_encoding_rows()
+    finally:
+        db.close()
+
+
+# Probe = template có sẵn cộng nhiễu, nhãn đúng là EmployeeID của template đó
+def make_probes(rows, count, noise=0.4, seed=1):
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(len(rows), size=min(count, len(rows)), replace=False)
+    probes = [np.asarray(rows[i][2], dtype=np.float32) + rng.normal(scale=noise, size=len(rows[i][2]))
+              for i in picks]
+    return probes, [rows[i][1] for i in picks]
+
+
+# Bộ nhớ của cache cũ: mỗi encoding là list Python gồm 512 float
+def python_list_bytes(num_rows, dim=512):
+    sample = [float(x) for x in np.random.default_rng(0).normal(size=dim)]
+    per_row = sys.getsizeof(sample) + sum(sys.getsizeof(x) for x in sample)
+    return per_row * num_rows
+
+
+# Cách get_all_encodings cũ đọc chuỗi: split + float() từng phần tử, in từng giá trị
+def legacy_parse(encoding_str):
+    print(f" - Original encoding string: {encoding_str}")
+    encoding = []
+    for x in encoding_str.split(','):
+        try:
+            encoding.append(float(x.strip()))
+        except ValueError:
+            pass
+    print(f" - Converted encoding (first 5 values): {encoding[:5]}... ✅")
+    return encoding
+
+
+# Thời gian khởi động lạnh: giải mã toàn bộ bảng rồi dựng FaceGallery
+def bench_codec(rows):
+    texts = [(i, emp_id, encode_embedding_text(enc)) for i, emp_id, enc in rows]
+    blobs = [(i, emp_id, encode_embedding(enc)) for i, emp_id, enc in rows]
+    print(f"{'format':<28}{'decode s':>10}{'gallery s':>11}{'total s':>9}")
+
+    def run(label, decode, source):
+        started = time.perf_counter()
+        decoded = [(i, emp_id, decode(value)) for i, emp_id, value in source]
+        decoded_at = time.perf_counter()
+        FaceGallery.from_rows(decoded)
+        done = time.perf_counter()
+        print(f"{label:<28}{decoded_at - started:>10.3f}{done - decoded_at:>11.3f}{done - started:>9.3f}")
+
+    with contextlib.redirect_stdout(io.StringIO()) as sink:
+        started = time.perf_counter()
+        legacy = [(i, emp_id, legacy_parse(value)) for i, emp_id, value in texts]
+        legacy_time = time.perf_counter() - started
+    del sink
+    started = time.perf_counter()
+    FaceGallery.from_rows(legacy)
+    gallery_time = time.perf_counter() - started
+    print(f"{'text, old loop + print':<28}{legacy_time:>10.3f}{gallery_time:>11.3f}{legacy_time + gallery_time:>9.3f}")
+    run('text, dual-read parser', lambda v: decode_embedding(None, v), texts)
+    run('VARBINARY + frombuffer', lambda v: decode_embedding(v, None), blobs)
+
+
+# Câu SELECT thật trên FaceEncodings: cột đọc song song cũ (luôn kèm chuỗi) so với _encoding_columns hiện tại
+def bench_select(repeat=3):
+    from db.database import Database
+    db = Database()
+    try:
+        employees = db.employees
+        if not employees.has_binary_encoding_column():
+            print("Chưa có cột EncodingBin, không có gì để so sánh")
+            return
+        variants = [('EncodingBin, Encoding', "EncodingBin, Encoding"),
+                    ('text only when bin missing', employees._encoding_columns())]
+        print(f"{'columns':<28}{'rows':>8}{'MB fetched':>12}{'select s':>10}{'decode s':>10}")
+        for label, columns in variants:
+            best = None
+            for _ in range(repeat):
+                cursor = db.conn.cursor()
+                try:
+                    started = time.perf_counter()
+                    cursor.execute(f"SELECT EncodingID, EmployeeID, {columns} FROM FaceEncodings")
+                    fetched = cursor.fetchall()
+                    fetched_at = time.perf_counter()
+                finally:
+                    cursor.close()
+                decoded = [decode_embedding(encoding_bin, encoding_str) for _, _, encoding_bin, encoding_str in fetched]
+                done = time.perf_counter()
+                size = sum(len(value) for row in fetched for value in row[2:] if value is not None)
+                timing = (fetched_at - started, done - fetched_at)
+                if best is None or sum(timing) < sum(best[1]):
+                    best = (len(decoded), timing, size)
+            rows, (select_time, decode_time), size = best
+            print(f"{label:<28}{rows:>8}{size / 2 ** 20:>12.2f}{select_time:>10.3f}{decode_time:>10.3f}")
+    finally:
+        db.close()
+
+
+def time_per_call(fn, probes, repeat=1):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for probe in probes:
+            fn(probe)
+    return (time.perf_counter() - started) / (repeat * len(probes)) * 1000.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=20000, help='số nhân viên của gallery tổng hợp')
+    parser.add_argument('--templates', type=int, default=1, help='số template mỗi nhân viên (tổng hợp)')
+    parser.add_argument('--from-db', action='store_true', help='dùng FaceEncodings thật thay vì dữ liệu tổng hợp')
+    parser.add_argument('--probes', type=int, default=200)
+    parser.add_argument('--rerank-k', type=int, default=32, help='0: không chấm lại bằng float32')
+    parser.add_argument('--codec', action='store_true',
+                        help='đo thời gian tải gallery: chuỗi văn bản so với float32 nhị phân')
+    parser.add_argument('--select', action='store_true',
+                        help='đo câu SELECT FaceEncodings thật: có và không tải chuỗi Encoding cũ')
+    parser.add_argument('--loop-baseline', action='store_true',
+                        help='đo thêm vòng lặp compare_faces cũ (chậm với gallery lớn)')
+    args = parser.parse_args()
+
+    if args.select:
+        bench_select()
+        return
+    rows = load_db_rows() if args.from_db else synthetic_rows(args.size, args.templates)
+    if args.codec:
+        bench_codec(rows)
+        return
+    probes, labels = make_probes(rows, args.probes)
+    print(f"Gallery: {len(rows)} templates, {len(set(r[1] for r in rows))} employees, {len(probes)} probes")
+
+    list_bytes = python_list_bytes(len(rows))
+    print(f"{'storage':<12}{'MB':>10}{'B/template':>12}{'ms/probe':>10}{'rank-1':>9}{'=fp32':>8}{'max|Δscore|':>13}")
+    print(f"{'list[float]':<12}{list_bytes / 2 ** 20:>10.1f}{list_bytes / len(rows):>12.0f}")
+
+    if args.loop_baseline:
+        from face_recognition_util import FaceRecognitionUtil
+        encodings = {emp_id: list(map(float, enc)) for _, emp_id, enc in rows}
+
+        def loop_match(probe):
+            best, best_sim = None, 0
+            for emp_id, known in encodings.items():
+                _, sim = FaceRecognitionUtil.compare_faces(None, probe, known)
+                if sim > best_sim:
+                    best, best_sim = emp_id, sim
+            return best, best_sim
+
+        print(f"{'loop':<12}{'':>10}{'':>12}{time_per_call(loop_match, probes[:10]):>10.2f}")
+
+    reference = None
+    for storage in FaceGallery.STORAGE_MODES:
+        # Dòng float32 cho rerank nằm trên đĩa (mmap bản chụp) trong thực tế, không tính vào MB
+        gallery = FaceGallery.from_rows(rows, storage=storage, rerank_k=args.rerank_k, keep_full=args.rerank_k > 0)
+        gallery.match(probes[0])
+        latency = time_per_call(gallery.match, probes)
+        results = [gallery.match(p) for p in probes]
+        accuracy = np.mean([r[0] == label for r, label in zip(results, labels)])
+        if reference is None:
+            reference = results
+        same = np.mean([r[0] == ref[0] for r, ref in zip(results, reference)])
+        delta = max(abs(r[1] - ref[1]) for r, ref in zip(results, reference))
+        print(f"{storage:<12}{gallery.nbytes / 2 ** 20:>10.1f}{gallery.nbytes / len(gallery):>12.0f}"
+              f"{latency:>10.2f}{accuracy:>9.3f}{same:>8.3f}{delta:>13.2e}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""Đo CPU của vòng lặp nhận diện trên cảnh trống: luôn detect, có cổng chuyển động, chế độ nghỉ.
+
+Chạy từ thư mục gốc dự án (nên quay camera vào cảnh trống, hoặc dùng video cảnh trống):
+    python -m tools.bench_idle --video 0 --seconds 20
+    python -m tools.bench_idle --synthetic --seconds 10
+
+Với --synthetic, khung hình là một cảnh tĩnh có nhiễu cảm biến nhẹ, và chỉ đo
+phần chi phí của chính cổng chuyển động (không cần mô hình).
+CPU% = thời gian CPU của tiến trình / thời gian thực, tính cả luồng onnxruntime.
+"""
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from frame_source import open_frame_source
+from motion_gate import MotionGate
+
+
+class SyntheticScene:
+    def __init__(self, width=640, height=480, seed=0):
+        self.rng = np.random.default_rng(seed)
+        self.base = cv2.GaussianBlur(self.rng.integers(0, 255, (height, width, 3), dtype=np.uint8), (31, 31), 0)
+
+    def read(self):
+        noise = self.rng.integers(-3, 4, self.base.shape, dtype=np.int16)
+        return True, np.clip(self.base.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+
+    def release(self):
+        pass
+
+
+# Mô phỏng vòng lặp của WebcamThread.run trong seconds giây, trả về (CPU%, số lần detect)
+def run_loop(source, seconds, detect, mode, recognition_interval=0.1, idle_interval=0.5, fps=30):
+    gate = MotionGate()
+    frame_period = 1.0 / fps
+    detections = 0
+    last_recognition = 0.0
+    cpu_started, wall_started = time.process_time(), time.perf_counter()
+    while time.perf_counter() - wall_started < seconds:
+        tick_started = time.perf_counter()
+        ret, frame = source.read()
+        if not ret:
+            break
+        now = time.perf_counter()
+        if now - last_recognition >= recognition_interval:
+            if mode == 'always' or gate.update(frame):
+                detect(frame)
+                detections += 1
+            last_recognition = now
+        if mode == 'idle':
+            time.sleep(idle_interval)
+        else:
+            # Camera thật tự giới hạn ở fps; ở đây ngủ phần còn lại của chu kỳ khung hình
+            time.sleep(max(0.0, frame_period - (time.perf_counter() - tick_started)))
+    wall = time.perf_counter() - wall_started
+    return (time.process_time() - cpu_started) / wall * 100, detections
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--video', help='đường dẫn video hoặc chỉ số camera')
+    parser.add_argument('--synthetic', action='store_true')
+    parser.add_argument('--seconds', type=float, default=20)
+    args = parser.parse_args()
+
+    if args.synthetic:
+        detect = lambda frame: None
+        open_source = SyntheticScene
+    else:
+        from face_recognition_util import FaceRecognitionUtil
+        util = FaceRecognitionUtil()
+        detect = util.detect_faces
+        open_source = lambda: open_frame_source(args.video or 0, pacing='realtime')
+
+    gate = MotionGate()
+    frame = SyntheticScene().read()[1]
+    started = time.perf_counter()
+    for _ in range(200):
+        gate.update(frame)
+    print(f"MotionGate.update: {(time.perf_counter() - started) * 1000 / 200:.3f} ms/frame")
+
+    print(f"{'mode':<10}{'CPU %':>8}{'detections':>12}")
+    for mode in ('always', 'gated', 'idle'):
+        source = open_source()
+        cpu, detections = run_loop(source, args.seconds, detect, mode)
+        source.release()
+        print(f"{mode:<10}{cpu:>8.1f}{detections:>12}")
+
+
+if __name__ == '__main__':
+    main()
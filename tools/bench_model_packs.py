@@ -0,0 +1,127 @@
+"""So sánh độ trễ và độ chính xác của các gói model insightface trên ảnh attendance_images.
+
+Chạy từ thư mục gốc dự án:
+    python -m tools.bench_model_packs
+    python -m tools.bench_model_packs --packs buffalo_l buffalo_s buffalo_l_int8 /path/to/custom_pack
+
+Ảnh trong attendance_images là ảnh cắt khuôn mặt tên <EmployeeID>_<thời gian>.png.
+Mỗi nhân viên, một nửa số ảnh làm gallery, nửa còn lại làm ảnh thử. Mỗi gói
+dùng detector và ArcFace của chính nó cho cả hai tập, và báo:
+    - tỉ lệ ảnh phát hiện được khuôn mặt
+    - độ trễ detector (ms/ảnh, gồm tiền xử lý) và ArcFace (ms/khuôn mặt)
+    - rank-1 và điểm khớp trung bình (công thức compare_faces của FaceGallery)
+
+Chọn gói cho ứng dụng bằng biến môi trường FACE_MODEL_PACK. Embedding của các gói
+khác nhau không so sánh được: đổi gói thì phải đăng ký lại khuôn mặt.
+"""
+import argparse
+import os
+import time
+
+import cv2
+import numpy as np
+from insightface.utils import face_align
+
+from face_gallery import FaceGallery
+from onnx_config import KNOWN_MODEL_PACKS, OnnxRuntimeConfig, TunedFaceAnalysis
+from tools.quantize_models import collect_images
+
+
+# Phát hiện trên ảnh đã thêm viền, trả về (emp_id, ảnh căn chỉnh) và thời gian detector từng ảnh
+def detect_and_align(app, items, pad_ratio=0.5):
+    faces, times = [], []
+    for emp_id, path in items:
+        img = cv2.imread(path)
+        if img is None:
+            continue
+        pad_y, pad_x = int(img.shape[0] * pad_ratio), int(img.shape[1] * pad_ratio)
+        padded = cv2.copyMakeBorder(img, pad_y, pad_y, pad_x, pad_x, cv2.BORDER_CONSTANT, value=0)
+        started = time.perf_counter()
+        bboxes, kpss = app.det_model.detect(padded, max_num=1)
+        times.append((time.perf_counter() - started) * 1000)
+        if bboxes.shape[0] == 0 or kpss is None:
+            continue
+        faces.append((emp_id, face_align.norm_crop(padded, landmark=kpss[0], image_size=112)))
+    return faces, times
+
+
+# Embedding từng khuôn mặt một như trên đường nhận diện trực tiếp
+def embed_faces(app, faces):
+    rec_model = app.models['recognition']
+    embeddings, times = [], []
+    for _, aligned in faces:
+        started = time.perf_counter()
+        embeddings.append(rec_model.get_feat(aligned)[0])
+        times.append((time.perf_counter() - started) * 1000)
+    if not embeddings:
+        return np.zeros((0, 0), dtype=np.float32), times
+    return FaceGallery._normalize_rows(np.stack(embeddings)), times
+
+
+def bench_pack(pack, root, gallery_items, probe_items, det_size, config):
+    app = TunedFaceAnalysis(name=pack, root=root, allowed_modules=['detection', 'recognition'], config=config)
+    app.prepare(ctx_id=0, det_size=det_size)
+    if 'recognition' not in app.models:
+        raise RuntimeError(f"Gói {pack} không có model recognition")
+
+    # Lần chạy đầu khởi tạo bộ nhớ của ORT, không tính vào thời gian
+    detect_and_align(app, gallery_items[:1])
+    gallery_faces, det_times = detect_and_align(app, gallery_items)
+    probe_faces, probe_det_times = detect_and_align(app, probe_items)
+    det_times += probe_det_times
+    embed_faces(app, gallery_faces[:1])
+    gallery_emb, rec_times = embed_faces(app, gallery_faces)
+    probe_emb, probe_rec_times = embed_faces(app, probe_faces)
+    rec_times += probe_rec_times
+
+    result = {
+        'pack': os.path.basename(os.path.normpath(pack)),
+        'detected': (len(gallery_faces) + len(probe_faces)) / max(1, len(gallery_items) + len(probe_items)),
+        'det_ms': float(np.median(det_times)) if det_times else float('nan'),
+        'rec_ms': float(np.median(rec_times)) if rec_times else float('nan'),
+        'rank1': float('nan'), 'score': float('nan'),
+    }
+    if len(gallery_faces) and len(probe_faces):
+        gallery = FaceGallery.from_rows([(i, int(f[0]), e) for i, (f, e) in enumerate(zip(gallery_faces, gallery_emb))])
+        ids, scores = gallery.match_batch(list(probe_emb), top_k=1)
+        truth = np.array([int(f[0]) for f in probe_faces], dtype=np.int64)
+        result['rank1'] = float(np.mean(ids[:, 0] == truth))
+        result['score'] = float(scores[:, 0].mean())
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--packs', nargs='+', default=list(KNOWN_MODEL_PACKS),
+                        help='tên gói hoặc thư mục chứa file .onnx')
+    parser.add_argument('--root', default='~/.insightface')
+    parser.add_argument('--images', default='attendance_images')
+    parser.add_argument('--per-employee', type=int, default=20, help='số ảnh tối đa mỗi nhân viên')
+    parser.add_argument('--det-size', type=int, default=416)
+    parser.add_argument('--config', default='onnx_config.json', help='cấu hình ONNX Runtime (tools/tune_onnx.py)')
+    args = parser.parse_args()
+    det_size = (args.det_size, args.det_size)
+    config = OnnxRuntimeConfig.load_or_default(args.config)
+
+    gallery_items, probe_items = collect_images(args.images, args.per_employee)
+    print(f"{len(gallery_items)} ảnh gallery, {len(probe_items)} ảnh thử, "
+          f"{len({emp_id for emp_id, _ in gallery_items})} nhân viên")
+    if not gallery_items or not probe_items:
+        print("Không đủ ảnh để so sánh")
+        return
+
+    results = []
+    for pack in args.packs:
+        try:
+            results.append(bench_pack(pack, args.root, gallery_items, probe_items, det_size, config))
+        except Exception as e:
+            print(f"[WARNING] Bỏ qua {pack}: {e}")
+
+    print(f"\n{'pack':<18}{'detected':>10}{'det ms':>9}{'embed ms':>10}{'rank-1':>8}{'score':>8}")
+    for r in results:
+        print(f"{r['pack']:<18}{r['detected']:>10.3f}{r['det_ms']:>9.2f}{r['rec_ms']:>10.2f}"
+              f"{r['rank1']:>8.3f}{r['score']:>8.3f}")
+
+
+if __name__ == '__main__':
+    main()
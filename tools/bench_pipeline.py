@@ -0,0 +1,81 @@
+"""Đo CPU mỗi tick: face_app.get đầy đủ buffalo_l so với pipeline tách detection/recognition.
+
+Chạy từ thư mục gốc dự án (ảnh lấy đệ quy trong thư mục, hoặc từ video/camera):
+    python -m tools.bench_pipeline --images attendance_images
+    python -m tools.bench_pipeline --video 0 --frames 200
+
+Ba trường hợp được đo trên cùng các khung hình:
+    full   : FaceAnalysis với mọi module (detection, landmark 2d/3d, genderage, ArcFace)
+    split  : detector + ArcFace cho mọi khuôn mặt (tick đầu, chưa ai được nhận diện)
+    steady : chỉ detector (mọi khuôn mặt đã có danh tính chắc chắn từ tick trước)
+"""
+import argparse
+import time
+
+from insightface.app import FaceAnalysis
+
+from face_recognition_util import FaceRecognitionUtil
+from frame_source import open_frame_source
+
+
+def load_frames(args):
+    frames = []
+    source = open_frame_source(args.video if args.video is not None else args.images, pacing='fast')
+    while len(frames) < args.frames:
+        ret, frame = source.read()
+        if not ret:
+            break
+        frames.append(frame)
+    source.release()
+    return frames
+
+
+# Trả về (CPU ms/tick, wall ms/tick); process_time tính cả các luồng của onnxruntime
+def measure(fn, frames, repeat):
+    for frame in frames[:2]:
+        fn(frame)
+    cpu_started, wall_started = time.process_time(), time.perf_counter()
+    for _ in range(repeat):
+        for frame in frames:
+            fn(frame)
+    ticks = len(frames) * repeat
+    return ((time.process_time() - cpu_started) * 1000 / ticks,
+            (time.perf_counter() - wall_started) * 1000 / ticks)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', default='attendance_images')
+    parser.add_argument('--video', help='đường dẫn video hoặc chỉ số camera')
+    parser.add_argument('--frames', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--det-size', type=int, default=416)
+    args = parser.parse_args()
+
+    frames = load_frames(args)
+    if not frames:
+        print("Không có khung hình nào để đo")
+        return
+    det_size = (args.det_size, args.det_size)
+
+    full_app = FaceAnalysis(name='buffalo_l', providers=['CPUExecutionProvider'])
+    full_app.prepare(ctx_id=0, det_size=det_size)
+    util = FaceRecognitionUtil(det_size=det_size)
+
+    faces_per_frame = sum(len(util.detect_faces(f)) for f in frames) / len(frames)
+    print(f"{len(frames)} khung hình, trung bình {faces_per_frame:.2f} khuôn mặt/khung hình")
+    print(f"module đầy đủ: {sorted(full_app.models)}; pipeline tách: {sorted(util.face_app.models)}")
+
+    results = {
+        'full': measure(full_app.get, frames, args.repeat),
+        'split': measure(lambda f: util.embed_faces(f, util.detect_faces(f)), frames, args.repeat),
+        'steady': measure(util.detect_faces, frames, args.repeat),
+    }
+    base_cpu = results['full'][0]
+    print(f"{'mode':<8}{'CPU ms/tick':>13}{'wall ms/tick':>14}{'CPU saved':>11}")
+    for mode, (cpu_ms, wall_ms) in results.items():
+        print(f"{mode:<8}{cpu_ms:>13.1f}{wall_ms:>14.1f}{(1 - cpu_ms / base_cpu) * 100:>10.0f}%")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""Học cơ sở PCA từ FaceEncodings, lưu ra file và đo recall@1 so với quét toàn bộ.
+
+Chạy từ thư mục gốc dự án:
+    python -m tools.fit_pca --components 128 --output pca_basis.npz
+    python -m tools.fit_pca --synthetic 50000 --components 64 128 --shortlist 50 100 200
+
+File .npz dùng cho WebcamThread.set_pca_mode(basis_path=...).
+"""
+import argparse
+import time
+
+import numpy as np
+
+from face_gallery import FaceGallery
+from face_index import PCAIndex, index_file_path
+from tools.bench_gallery import load_db_rows, make_probes
+
+
+# Gallery tổng hợp có cấu trúc hạng thấp giống embedding thật (PCA vô nghĩa trên nhiễu đẳng hướng)
+def low_rank_rows(size, dim=512, rank=96, seed=0):
+    rng = np.random.default_rng(seed)
+    basis = rng.normal(size=(rank, dim)).astype(np.float32)
+    spectrum = (1.0 / np.sqrt(np.arange(1, rank + 1))).astype(np.float32)
+    latent = rng.normal(size=(size, rank)).astype(np.float32) * spectrum
+    identities = latent @ basis + rng.normal(scale=0.5, size=(size, dim)).astype(np.float32)
+    return [(i, i, identities[i]) for i in range(size)]
+
+
+def time_per_probe(fn, probes):
+    started = time.perf_counter()
+    for probe in probes:
+        fn(probe)
+    return (time.perf_counter() - started) * 1000 / len(probes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--components', type=int, nargs='+', default=[64, 128])
+    parser.add_argument('--shortlist', type=int, nargs='+', default=[50, 100, 200])
+    parser.add_argument('--probes', type=int, default=500)
+    parser.add_argument('--noise', type=float, default=0.4)
+    parser.add_argument('--synthetic', type=int, default=0, help='dùng gallery tổng hợp N nhân viên thay vì DB')
+    parser.add_argument('--output', help='lưu cơ sở PCA của giá trị --components đầu tiên')
+    args = parser.parse_args()
+
+    rows = low_rank_rows(args.synthetic) if args.synthetic else load_db_rows()
+    gallery = FaceGallery.from_rows(rows)
+    print(f"Gallery: {len(gallery)} templates, {gallery.num_employees} employees")
+    if len(gallery) < 2:
+        print("Gallery quá nhỏ để học PCA")
+        return
+
+    probes, _ = make_probes(rows, args.probes, noise=args.noise)
+    brute_ids, _ = gallery.match_batch(probes, top_k=1)
+    brute_ms = time_per_probe(gallery.match, probes)
+    print(f"{'mode':<22}{'recall@1':>10}{'ms/probe':>10}")
+    print(f"{'brute force 512-d':<22}{1.0:>10.3f}{brute_ms:>10.2f}")
+
+    for i, n_components in enumerate(args.components):
+        index = PCAIndex(n_components=min(n_components, gallery.dim)).fit(gallery)
+        if i == 0 and args.output:
+            index.save(args.output)
+            print(f"Đã lưu cơ sở PCA {n_components} chiều vào {index_file_path(args.output)}")
+        index = index.rebuild(gallery)
+        for shortlist in args.shortlist:
+            index.shortlist = shortlist
+            pca_ids, _ = index.match_batch(probes, top_k=1)
+            recall = float(np.mean(pca_ids[:, 0] == brute_ids[:, 0]))
+            ms = time_per_probe(index.match, probes)
+            print(f"{f'pca {n_components}-d / {shortlist}':<22}{recall:>10.3f}{ms:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
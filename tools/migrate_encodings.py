@@ -0,0 +1,44 @@
+"""Chuyển một lần các dòng FaceEncodings từ chuỗi văn bản sang cột nhị phân EncodingBin.
+
+Chạy db/migrations/001_face_encoding_binary.sql trước, sau đó từ thư mục gốc dự án:
+    python -m tools.migrate_encodings --batch-size 500
+
+Thời gian tải gallery (get_all_encoding_rows) được đo trước và sau khi chuyển.
+"""
+import argparse
+import logging
+import time
+
+from db.database import Database
+
+
+def time_gallery_load(employees):
+    started = time.perf_counter()
+    rows = employees.get_all_encoding_rows()
+    return len(rows), time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--batch-size', type=int, default=500)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    db = Database()
+    try:
+        employees = db.employees
+        count, before = time_gallery_load(employees)
+        print(f"Tải gallery trước khi chuyển: {count} dòng trong {before:.3f}s")
+
+        converted, skipped = employees.migrate_encodings_to_binary(batch_size=args.batch_size)
+        print(f"Đã chuyển {converted} dòng, bỏ qua {skipped} dòng lỗi")
+
+        count, after = time_gallery_load(employees)
+        print(f"Tải gallery sau khi chuyển: {count} dòng trong {after:.3f}s "
+              f"(nhanh hơn {before / after if after else float('inf'):.1f}x)")
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+"""Lượng tử hóa tĩnh INT8 detector và ArcFace của một gói model, hiệu chỉnh bằng ảnh attendance_images.
+
+Chạy từ thư mục gốc dự án:
+    python -m tools.quantize_models --pack buffalo_l --images attendance_images
+    python -m tools.quantize_models --evaluate-only --pack buffalo_l
+
+Kết quả là gói mới <root>/models/<pack>_int8 (cùng tên file), dùng bằng
+FaceRecognitionUtil(model_pack='buffalo_l_int8').
+
+Ảnh trong attendance_images là ảnh cắt khuôn mặt tên <EmployeeID>_<thời gian>.png.
+Mỗi nhân viên, một nửa số ảnh dùng để hiệu chỉnh, nửa còn lại để đánh giá:
+    - độ trễ detector/ArcFace fp32 so với int8
+    - cosine giữa embedding fp32 và int8 của cùng một ảnh
+    - điểm xác minh (công thức compare_faces) với gallery fp32 và độ lệch rank-1
+"""
+import argparse
+import glob
+import os
+import shutil
+import time
+from collections import defaultdict
+
+import cv2
+import numpy as np
+from insightface.utils import face_align
+from onnxruntime.quantization import (CalibrationDataReader, CalibrationMethod, QuantFormat, QuantType,
+                                      quantize_static)
+from onnxruntime.quantization.shape_inference import quant_pre_process
+
+from face_gallery import FaceGallery
+from onnx_config import OnnxRuntimeConfig, TunedFaceAnalysis
+
+
+class BlobReader(CalibrationDataReader):
+    """Đưa lần lượt từng blob đầu vào cho bộ hiệu chỉnh của onnxruntime."""
+
+    def __init__(self, input_name, blobs):
+        self.input_name = input_name
+        self._blobs = iter(blobs)
+
+    def get_next(self):
+        blob = next(self._blobs, None)
+        return None if blob is None else {self.input_name: blob}
+
+
+# Ảnh khuôn mặt theo nhân viên, chia đôi thành tập hiệu chỉnh và tập đánh giá
+def collect_images(root, per_employee):
+    by_employee = defaultdict(list)
+    for path in sorted(glob.glob(os.path.join(root, '**', '*.png'), recursive=True)
+                       + sorted(glob.glob(os.path.join(root, '**', '*.jpg'), recursive=True))):
+        emp_id = os.path.basename(path).split('_', 1)[0]
+        if len(by_employee[emp_id]) < per_employee:
+            by_employee[emp_id].append(path)
+
+    calibration, evaluation = [], []
+    for emp_id, paths in by_employee.items():
+        half = max(1, len(paths) // 2)
+        calibration += [(emp_id, p) for p in paths[:half]]
+        evaluation += [(emp_id, p) for p in paths[half:]]
+    return calibration, evaluation
+
+
+# Ảnh cắt sát mặt: thêm viền để detector thấy toàn bộ khuôn mặt, rồi căn chỉnh 112×112 theo kps
+def prepare_faces(app, items, pad_ratio=0.5):
+    faces = []
+    for emp_id, path in items:
+        img = cv2.imread(path)
+        if img is None:
+            continue
+        pad_y, pad_x = int(img.shape[0] * pad_ratio), int(img.shape[1] * pad_ratio)
+        padded = cv2.copyMakeBorder(img, pad_y, pad_y, pad_x, pad_x, cv2.BORDER_CONSTANT, value=0)
+        bboxes, kpss = app.det_model.detect(padded, max_num=1)
+        if bboxes.shape[0] == 0 or kpss is None:
+            continue
+        aligned = face_align.norm_crop(padded, landmark=kpss[0], image_size=112)
+        faces.append((emp_id, padded, aligned))
+    return faces
+
+
+# Tiền xử lý giống RetinaFace.detect: giữ tỉ lệ, đặt vào khung det_size, chuẩn hóa
+def detector_blob(img, det_size, det_model):
+    det_w, det_h = det_size
+    ratio = min(det_w / img.shape[1], det_h / img.shape[0])
+    resized = cv2.resize(img, (int(img.shape[1] * ratio), int(img.shape[0] * ratio)))
+    canvas = np.zeros((det_h, det_w, 3), dtype=np.uint8)
+    canvas[:resized.shape[0], :resized.shape[1]] = resized
+    mean, std = det_model.input_mean, det_model.input_std
+    return cv2.dnn.blobFromImage(canvas, 1.0 / std, (det_w, det_h), (mean, mean, mean), swapRB=True)
+
+
+def recognition_blob(aligned, rec_model):
+    mean, std = rec_model.input_mean, rec_model.input_std
+    return cv2.dnn.blobFromImages(aligned, 1.0 / std, (112, 112), (mean, mean, mean), swapRB=True)
+
+
+def quantize_model(source, target, reader):
+    prepared = target + '.pre.onnx'
+    try:
+        quant_pre_process(source, prepared)
+    except Exception as e:
+        print(f"[WARNING] quant_pre_process failed ({e}), quantizing the original graph")
+        shutil.copyfile(source, prepared)
+    try:
+        quantize_static(prepared, target, reader, quant_format=QuantFormat.QDQ, per_channel=True,
+                        activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8,
+                        calibrate_method=CalibrationMethod.MinMax)
+    finally:
+        os.remove(prepared)
+
+
+def median_ms(session, blob, runs=20):
+    name = session.get_inputs()[0].name
+    session.run(None, {name: blob})
+    times = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        session.run(None, {name: blob})
+        times.append((time.perf_counter() - started) * 1000)
+    return float(np.median(times))
+
+
+def embed(app, aligned):
+    features = app.models['recognition'].get_feat(aligned)
+    return FaceGallery._normalize_rows(features)
+
+
+def evaluate(fp32_app, int8_app, calibration_faces, evaluation_faces, det_size):
+    config = OnnxRuntimeConfig(optimized_model_dir=None)
+    sample = evaluation_faces[0]
+    det_blob = detector_blob(sample[1], det_size, fp32_app.det_model)
+    rec_blob = recognition_blob([sample[2]], fp32_app.models['recognition'])
+    print(f"\n{'model':<14}{'fp32 ms':>10}{'int8 ms':>10}{'speedup':>9}")
+    for task, blob in (('detection', det_blob), ('recognition', rec_blob)):
+        fp32_ms = median_ms(config.create_session(fp32_app.models[task].model_file), blob)
+        int8_ms = median_ms(config.create_session(int8_app.models[task].model_file), blob)
+        print(f"{task:<14}{fp32_ms:>10.2f}{int8_ms:>10.2f}{fp32_ms / int8_ms:>8.2f}x")
+
+    # Cùng ảnh căn chỉnh, chỉ khác model ArcFace
+    aligned = [f[2] for f in evaluation_faces]
+    labels = np.array([f[0] for f in evaluation_faces])
+    fp32_emb, int8_emb = embed(fp32_app, aligned), embed(int8_app, aligned)
+    self_cos = np.sum(fp32_emb * int8_emb, axis=1)
+    print(f"\ncos(fp32, int8) cùng ảnh: mean {self_cos.mean():.4f}, min {self_cos.min():.4f}")
+
+    # Gallery fp32 giống kiosk: embedding fp32 của tập hiệu chỉnh, nhiều template mỗi nhân viên
+    gallery_emb = embed(fp32_app, [f[2] for f in calibration_faces])
+    gallery = FaceGallery.from_rows([(i, int(f[0]), e) for i, (f, e) in enumerate(zip(calibration_faces, gallery_emb))])
+    fp32_ids, fp32_scores = gallery.match_batch(list(fp32_emb), top_k=1)
+    int8_ids, int8_scores = gallery.match_batch(list(int8_emb), top_k=1)
+    truth = labels.astype(np.int64)
+    shift = int8_scores[:, 0] - fp32_scores[:, 0]
+    print(f"rank-1 fp32 {np.mean(fp32_ids[:, 0] == truth):.3f}, int8 {np.mean(int8_ids[:, 0] == truth):.3f}, "
+          f"top-1 giống nhau {np.mean(fp32_ids[:, 0] == int8_ids[:, 0]):.3f}")
+    print(f"điểm xác minh: fp32 {fp32_scores[:, 0].mean():.4f}, int8 {int8_scores[:, 0].mean():.4f}, "
+          f"lệch trung bình {shift.mean():+.4f}, lệch lớn nhất {np.abs(shift).max():.4f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pack', default='buffalo_l')
+    parser.add_argument('--root', default='~/.insightface')
+    parser.add_argument('--images', default='attendance_images')
+    parser.add_argument('--per-employee', type=int, default=40, help='số ảnh tối đa mỗi nhân viên')
+    parser.add_argument('--det-size', type=int, default=416)
+    parser.add_argument('--evaluate-only', action='store_true', help='chỉ đánh giá gói int8 đã tạo')
+    args = parser.parse_args()
+    det_size = (args.det_size, args.det_size)
+    config = OnnxRuntimeConfig(optimized_model_dir=None)
+
+    fp32_app = TunedFaceAnalysis(name=args.pack, root=args.root, allowed_modules=['detection', 'recognition'],
+                                 config=config)
+    fp32_app.prepare(ctx_id=0, det_size=det_size)
+
+    calibration, evaluation = collect_images(args.images, args.per_employee)
+    calibration_faces = prepare_faces(fp32_app, calibration)
+    evaluation_faces = prepare_faces(fp32_app, evaluation)
+    print(f"{len(calibration_faces)} ảnh hiệu chỉnh, {len(evaluation_faces)} ảnh đánh giá")
+    if not calibration_faces or not evaluation_faces:
+        print("Không đủ ảnh có khuôn mặt để lượng tử hóa")
+        return
+
+    int8_pack = f"{args.pack}_int8"
+    int8_dir = os.path.join(os.path.expanduser(args.root), 'models', int8_pack)
+    if not args.evaluate_only:
+        os.makedirs(int8_dir, exist_ok=True)
+        det_model, rec_model = fp32_app.det_model, fp32_app.models['recognition']
+        quantize_model(det_model.model_file, os.path.join(int8_dir, os.path.basename(det_model.model_file)),
+                       BlobReader(det_model.session.get_inputs()[0].name,
+                                  [detector_blob(f[1], det_size, det_model) for f in calibration_faces]))
+        quantize_model(rec_model.model_file, os.path.join(int8_dir, os.path.basename(rec_model.model_file)),
+                       BlobReader(rec_model.session.get_inputs()[0].name,
+                                  [recognition_blob([f[2]], rec_model) for f in calibration_faces]))
+        print(f"Đã ghi gói INT8 vào {int8_dir}")
+
+    int8_app = TunedFaceAnalysis(name=int8_pack, root=args.root, allowed_modules=['detection', 'recognition'],
+                                 config=config)
+    int8_app.prepare(ctx_id=0, det_size=det_size)
+    evaluate(fp32_app, int8_app, calibration_faces, evaluation_faces, det_size)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""Tìm cấu hình ONNX Runtime nhanh nhất cho detector + ArcFace trên CPU hiện tại.
+
+Chạy từ thư mục gốc dự án:
+    python -m tools.tune_onnx --save onnx_config.json
+    python -m tools.tune_onnx --det-model path/det_10g.onnx --rec-model path/w600k_r50.onnx
+
+Mỗi cấu hình được chấm bằng: thời gian detector (det_size) + faces × thời gian ArcFace
+(112×112), trung vị qua --runs lần chạy. FaceRecognitionUtil tự nạp onnx_config.json.
+"""
+import argparse
+import glob
+import itertools
+import os
+import time
+
+import numpy as np
+
+from onnx_config import OnnxRuntimeConfig, model_task_from_filename
+
+
+def find_pack_models(name, root):
+    from insightface.utils.storage import ensure_available
+    model_dir = ensure_available('models', name, root=root)
+    models = {}
+    for path in sorted(glob.glob(os.path.join(model_dir, '*.onnx'))):
+        models.setdefault(model_task_from_filename(path), path)
+    return models.get('detection'), models.get('recognition')
+
+
+# Trung vị ms/lần chạy của một session với đầu vào ngẫu nhiên đúng shape
+def time_session(session, shape, runs):
+    input_name = session.get_inputs()[0].name
+    data = np.random.default_rng(0).standard_normal(shape).astype(np.float32)
+    session.run(None, {input_name: data})
+    times = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        session.run(None, {input_name: data})
+        times.append((time.perf_counter() - started) * 1000)
+    return float(np.median(times))
+
+
+def candidate_configs():
+    cores = os.cpu_count() or 4
+    threads = sorted({1, 2, max(1, cores // 2), cores})
+    for intra, inter, mode, level, arena in itertools.product(
+            threads, (1, 2), ('sequential', 'parallel'), ('extended', 'all'), (True, False)):
+        # inter_op chỉ có tác dụng ở chế độ parallel
+        if mode == 'sequential' and inter != 1:
+            continue
+        yield OnnxRuntimeConfig(intra_op_num_threads=intra, inter_op_num_threads=inter, execution_mode=mode,
+                                graph_optimization_level=level, enable_cpu_mem_arena=arena,
+                                optimized_model_dir=None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pack', default='buffalo_l')
+    parser.add_argument('--root', default='~/.insightface')
+    parser.add_argument('--det-model')
+    parser.add_argument('--rec-model')
+    parser.add_argument('--det-size', type=int, default=416)
+    parser.add_argument('--faces', type=int, default=2, help='số khuôn mặt cần embed mỗi tick')
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--save', help='ghi cấu hình tốt nhất ra file JSON')
+    args = parser.parse_args()
+
+    det_model, rec_model = args.det_model, args.rec_model
+    if not det_model or not rec_model:
+        pack_det, pack_rec = find_pack_models(args.pack, args.root)
+        det_model, rec_model = det_model or pack_det, rec_model or pack_rec
+    print(f"detector: {det_model}\nrecognition: {rec_model}\nCPU cores: {os.cpu_count()}")
+
+    results = []
+    print(f"{'intra':>5}{'inter':>6}{'mode':>12}{'opt':>10}{'arena':>7}{'det ms':>9}{'rec ms':>9}{'tick ms':>9}")
+    for config in candidate_configs():
+        det_ms = time_session(config.create_session(det_model), (1, 3, args.det_size, args.det_size), args.runs)
+        rec_ms = time_session(config.create_session(rec_model), (1, 3, 112, 112), args.runs)
+        tick_ms = det_ms + args.faces * rec_ms
+        results.append((tick_ms, config))
+        print(f"{config.intra_op_num_threads:>5}{config.inter_op_num_threads:>6}{config.execution_mode:>12}"
+              f"{config.graph_optimization_level:>10}{str(config.enable_cpu_mem_arena):>7}"
+              f"{det_ms:>9.2f}{rec_ms:>9.2f}{tick_ms:>9.2f}")
+
+    default_ms = next(ms for ms, c in results if c.intra_op_num_threads == (os.cpu_count() or 4)
+                      and c.execution_mode == 'sequential' and c.graph_optimization_level == 'all'
+                      and c.enable_cpu_mem_arena)
+    best_ms, best = min(results, key=lambda r: r[0])
+    print(f"\nBest: {best.to_dict()}\n{best_ms:.2f} ms/tick (all cores, sequential, 'all': {default_ms:.2f} ms/tick)")
+    if args.save:
+        best.copy(optimized_model_dir='onnx_cache').save(args.save)
+        print(f"Saved to {args.save}")
+
+
+if __name__ == '__main__':
+    main()
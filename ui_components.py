@@ -1,7 +1,7 @@
 from PyQt5.QtWidgets import (QWidget, QPushButton, QLabel, QVBoxLayout, QHBoxLayout,
                              QTableWidget, QTableWidgetItem, QHeaderView, QFrame,
                              QAbstractItemView, QStyle, QLineEdit)
-from PyQt5.QtCore import Qt, pyqtSignal, QSize
+from PyQt5.QtCore import Qt, pyqtSignal, QSize, QObject
 from PyQt5.QtGui import QFont
 
 # --- STYLESHEET CONSTANTS ---
@@ -318,3 +318,17 @@ class CustomTableWidget(QWidget):
             self._populate_action_buttons(row_idx)
 
 
+# Chuyển thông báo của FaceModelHolder (từ luồng nạp model) thành signal Qt trên luồng giao diện
+class ModelLoadNotifier(QObject):
+    ready = pyqtSignal(object)
+    failed = pyqtSignal(str)
+
+    # Nối signal trước rồi mới watch: nếu model đã sẵn sàng, signal được phát ngay
+    def watch(self, holder):
+        holder.add_ready_callback(self._on_loaded)
+
+    def _on_loaded(self, model, error):
+        if error is not None:
+            self.failed.emit(str(error))
+        else:
+            self.ready.emit(model)